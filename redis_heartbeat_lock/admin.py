@@ -0,0 +1,195 @@
+"""Inspect and force-release locks in bulk, e.g. from an operations script.
+
+Locks are found by cursoring through the keyspace with `SCAN MATCH`, so Redis only ever looks at
+`count` keys per call, and never blocks on the whole keyspace like `KEYS` would. Each batch of
+keys found is looked up in a single pipelined round-trip: the owner token, the time left on the
+lock, and its fencing counter. Results stream out as an async generator, so listing millions of
+locks never holds them all in memory. Only exclusive locks are listed; semaphores and read locks
+are sorted sets, and are skipped.
+"""
+
+import asyncio
+import re
+import redis
+import time
+from typing import Any, AsyncIterator, Iterable, List, NamedTuple, Optional, Union
+
+from .backends import Backend, from_client, from_url
+from .cluster import related_key
+from .notifications import release_channel
+from .pool import get_registry
+from .scripts import FORCE_RELEASE, RELEASE
+from .shared import Command, DEFAULT_SCAN_COUNT, FENCE_KEY_SUFFIX
+
+# Owner tokens, as made by `new_owner_token`: host, process ID, a random part, and, since they've
+# carried it, when the token was made
+OWNER_TOKEN = re.compile(r"^(?P<owner>.+:\d+):[0-9a-f]{32}(@(?P<made_at>\d+))?$")
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _glob(prefix: str) -> str:
+    """A `SCAN MATCH` pattern for keys starting with `prefix`, taken literally."""
+    return re.sub(r"([*?\[\]\\])", r"\\\1", prefix) + "*"
+
+
+class LockInfo(NamedTuple):
+    """A held lock, as found by a scan."""
+
+    # The lock's key
+    key: str
+
+    # The token of the acquisition holding it
+    token: str
+
+    # Who holds it, as `host:pid`
+    owner: str
+
+    # Seconds left before the lock lapses unless its holder refreshes it, or `None` if it never
+    # lapses
+    ttl: Optional[float]
+
+    # Seconds since it was taken, by our clock, or `None` if its holder didn't say when it took it
+    age: Optional[float]
+
+    # The fencing counter of the acquisition holding it, if it has one
+    fencing_token: Optional[int]
+
+
+class LockAdmin:
+    """Lists held locks and force-releases them, over a scan of the keyspace."""
+
+    # The backend executing our Redis commands
+    __backend: Backend
+
+    # Keys Redis looks at per `SCAN`, and so most keys looked up per round-trip
+    __count: int
+
+    def __init__(self, client: Union[redis.Redis, Backend, Any], count: int = DEFAULT_SCAN_COUNT):
+        self.__backend = from_client(client)
+        self.__count = count
+
+    @classmethod
+    async def create(
+        cls,
+        url: str,
+        backend: Optional[str] = None,
+        share_client: bool = True,
+        count: int = DEFAULT_SCAN_COUNT,
+    ) -> "LockAdmin":
+        """Asynchronously create a Redis client and initialize the admin. Each `SCAN` asks Redis
+        to look at `count` keys."""
+        if share_client:
+            client = await get_registry().get(url, backend)
+        else:
+            client = await from_url(url, backend)
+        return cls(client, count)
+
+    async def __scan(self, pattern: str) -> AsyncIterator[List[str]]:
+        """Yield batches of string keys matching the pattern. On a cluster, scan each primary in
+        turn, keeping only the keys it serves, so a slot moving mid-scan isn't listed twice."""
+        client = self.__backend.client
+        nodes = client.get_primaries() if self.__backend.cluster else [None]
+        for node in nodes:
+            options = {"match": pattern, "count": self.__count, "_type": "string"}
+            if node is not None:
+                options["target_nodes"] = node
+            cursor = 0
+            while True:
+                cursor, keys = await self.__backend.call("scan", cursor, **options)
+                if isinstance(cursor, dict):
+                    # Cluster clients report a cursor per node
+                    [cursor] = cursor.values()
+                found = [_decode(key) for key in keys]
+                if node is not None:
+                    found = [k for k in found if client.get_node_from_key(k).name == node.name]
+                if found:
+                    yield found
+                if int(cursor) == 0:
+                    break
+
+    async def __look_up(self, keys: List[str]) -> List[LockInfo]:
+        """Look up the owner, TTL and fencing counter of each key in one round-trip."""
+        commands = []
+        for key in keys:
+            fence_key = related_key(key, FENCE_KEY_SUFFIX, self.__backend.cluster)
+            commands += [
+                Command("get", (key,)),
+                Command("pttl", (key,)),
+                Command("get", (fence_key,)),
+            ]
+        results = await self.__backend.pipeline(commands)
+
+        now = time.time()
+        locks = []
+        for i, key in enumerate(keys):
+            token, ttl, fence = results[3 * i : 3 * i + 3]
+            if token is None or isinstance(token, Exception) or isinstance(ttl, Exception):
+                # Released since we found it, or it isn't a lock
+                continue
+            match = OWNER_TOKEN.match(_decode(token))
+            if match is None:
+                continue
+            made_at = match.group("made_at")
+            locks.append(
+                LockInfo(
+                    key=key,
+                    token=_decode(token),
+                    owner=match.group("owner"),
+                    ttl=ttl / 1000 if ttl >= 0 else None,
+                    age=max(now - int(made_at) / 1000, 0.0) if made_at is not None else None,
+                    fencing_token=int(fence) if isinstance(fence, (bytes, str, int)) else None,
+                )
+            )
+        return locks
+
+    async def locks(
+        self, prefix: str = "", pattern: Optional[str] = None
+    ) -> AsyncIterator[LockInfo]:
+        """Stream every held lock whose key starts with `prefix`, or matches the glob-style
+        `pattern` if given, a batch at a time."""
+        async for keys in self.__scan(pattern if pattern is not None else _glob(prefix)):
+            for lock in await self.__look_up(keys):
+                yield lock
+
+    async def force_release(self, locks: Iterable[Union[str, LockInfo]]) -> int:
+        """Release the given locks, whoever holds them, and wake anyone waiting for them. Locks
+        found by a scan are only released if the same acquisition still holds them, so a holder
+        that's taken the lock since isn't thrown off it; bare keys are released regardless.
+        Returns how many locks were released."""
+        released = 0
+        batch: List[Command] = []
+        for lock in locks:
+            if isinstance(lock, LockInfo):
+                batch.append(RELEASE.command([lock.key], [lock.token, release_channel(lock.key)]))
+            else:
+                batch.append(FORCE_RELEASE.command([lock], [release_channel(lock)]))
+            if len(batch) >= self.__count:
+                released += await self.__release(batch)
+                batch = []
+        if batch:
+            released += await self.__release(batch)
+        return released
+
+    async def __release(self, commands: List[Command]) -> int:
+        results = await self.__backend.pipeline(commands)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        # Each script returns 1 if it released its lock
+        return sum(int(result) for result in results)
+
+    async def release_all(
+        self, prefix: str = "", pattern: Optional[str] = None, pause: float = 0.0
+    ) -> int:
+        """Force-release every held lock whose key starts with `prefix`, or matches `pattern`, a
+        batch at a time, pausing `pause` seconds between batches to go easier on Redis. Returns
+        how many locks were released."""
+        released = 0
+        async for keys in self.__scan(pattern if pattern is not None else _glob(prefix)):
+            released += await self.force_release(await self.__look_up(keys))
+            if pause > 0:
+                await asyncio.sleep(pause)
+        return released
@@ -1,26 +1,49 @@
 """Simple async wrapper around a Redis client to manage getting and holding a lock."""
 
-import asyncio
+import contextlib
 import redis
-import time
-from typing import Any, Optional
+from concurrent.futures import Executor
+from typing import Any, List, Optional, Tuple, Union
 
-from .executor import run_sync_in_thread_pool
+from .backoff import Backoff, DecorrelatedJitterBackoff, FixedBackoff
+from .backends import Backend, from_client
+from .base_lock import BaseLock, finish_release, retry_acquisition
+from .cluster import related_key
+from .instrumentation import get_instrumentation
+from .lease import Lease
+from .local import LocalHold, get_local_table
+from .notifications import get_listener, release_channel
+from .scripts import ACQUIRE, ACQUIRE_FAIR, EXTEND, RELEASE
 from .shared import (
+    Command,
+    DEFAULT_BACKOFF_BASE,
+    DEFAULT_BACKOFF_CAP,
     DEFAULT_LOCK_ACQUISITION_TIMEOUT,
     DEFAULT_LOCK_CHECK_RATE,
     DEFAULT_LOCK_EXPIRY,
+    DEFAULT_NOTIFY_POLL_RATE,
+    DEFAULT_QUEUE_WAITER_TTL,
+    FENCE_KEY_SUFFIX,
+    QUEUE_DEADLINES_KEY_SUFFIX,
+    QUEUE_KEY_SUFFIX,
+    STRATEGY_FAIR,
+    STRATEGY_FIXED,
+    STRATEGY_JITTER,
+    WAIT_MODE_NOTIFY,
+    WAIT_MODE_POLL,
+    monotonic,
+    new_owner_token,
 )
 
 
-class AsyncLock:
+class AsyncLock(BaseLock):
     """An async wrapper around the officially supported Redis client for Python, used to implement basic locking."""
 
     # The key to lock on
     __key: str
 
-    # The Redis client
-    __client: redis.Redis
+    # The backend executing our Redis commands
+    __backend: Backend
 
     # Timeout when acquiring the lock
     __lock_acquisition_timeout: float
@@ -31,22 +54,91 @@ class AsyncLock:
     # Expiration of the lock, in seconds
     __lock_expiry: int
 
-    # When we last obtained the lock
-    __lock_obtained_at: float
+    # How we wait for a held lock to be released
+    __wait_mode: str
+
+    # In notify mode, rate at which to check the lock in case we missed a release notification
+    __notify_poll_rate: float
+
+    # How we retry a contended lock
+    __strategy: str
+
+    # With jittered retries, the longest we wait between attempts
+    __backoff_cap: float
+
+    # How long we can count on holding the lock, from when we last set or refreshed it
+    __lease: Lease
+
+    # When we last made our expiration command, on the monotonic clock
+    __refresh_made_at: float
+
+    # Token identifying our current acquisition, stored as the lock's value
+    __token: Optional[str]
+
+    # Fencing counter for our current acquisition
+    __fencing_token: Optional[int]
+
+    # Attempts made by the current call to `set_lock`
+    __attempts: int
+
+    # When we took the lock, on the monotonic clock, if we hold it
+    __acquired_at: Optional[float]
+
+    # Whether we queue behind other locks on the key in this process before going to Redis
+    __local_first: bool
+
+    # Our claim on the key in the process's lock table, while we hold it with `local_first`
+    __hold: Optional[LocalHold]
+
+    # Whether we took the lock by re-entering one our task already held
+    __reentered: bool
+
+    # Our own holds that we've re-entered, innermost last: each one's hold, whether it was itself
+    # re-entered, token, fencing counter, lease, and when it was taken, to restore on release
+    __outer_holds: List[
+        Tuple[LocalHold, bool, Optional[str], Optional[int], Lease, Optional[float]]
+    ]
 
     def __init__(
         self,
         key: str,
-        client: redis.Redis,
+        client: Union[redis.Redis, Backend, Any],
         lock_acquisition_timeout: float,
         lock_check_rate: float,
         lock_expiry: int,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+        strategy: str = STRATEGY_FIXED,
+        backoff_cap: float = DEFAULT_BACKOFF_CAP,
+        local_first: bool = False,
+        executor: Optional[Executor] = None,
     ):
+        if wait_mode not in (WAIT_MODE_POLL, WAIT_MODE_NOTIFY):
+            raise Exception(f"Unknown wait mode {wait_mode}.")
+        if strategy not in (STRATEGY_FIXED, STRATEGY_JITTER, STRATEGY_FAIR):
+            raise Exception(f"Unknown strategy {strategy}.")
+
         self.__key = key
-        self.__client = client
+        self.__backend = from_client(client)
+        if executor is not None:
+            self.__backend = self.__backend.with_executor(executor)
         self.__lock_acquisition_timeout = lock_acquisition_timeout
         self.__lock_check_rate = lock_check_rate
         self.__lock_expiry = lock_expiry
+        self.__lease = Lease(lock_expiry)
+        self.__refresh_made_at = 0.0
+        self.__wait_mode = wait_mode
+        self.__notify_poll_rate = notify_poll_rate
+        self.__strategy = strategy
+        self.__backoff_cap = backoff_cap
+        self.__token = None
+        self.__fencing_token = None
+        self.__attempts = 0
+        self.__acquired_at = None
+        self.__local_first = local_first
+        self.__hold = None
+        self.__reentered = False
+        self.__outer_holds = []
 
     @classmethod
     async def create(
@@ -56,72 +148,298 @@ class AsyncLock:
         lock_acquisition_timeout: float = DEFAULT_LOCK_ACQUISITION_TIMEOUT,
         lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
         lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        backend: Optional[str] = None,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+        share_client: bool = True,
+        strategy: str = STRATEGY_FIXED,
+        backoff_cap: float = DEFAULT_BACKOFF_CAP,
+        local_first: bool = False,
+        executor: Optional[Executor] = None,
     ) -> "AsyncLock":
-        """Asynchronously create a Redis client and initialize the wrapper class."""
+        """Asynchronously create a Redis client and initialize the wrapper class. By default, the
+        client talks to Redis natively on the event loop; pass `backend="thread_pool"` to run the
+        synchronous client on our thread pool instead.
 
-        def _inner() -> redis.Redis:
-            return redis.Redis.from_url(url=url)
+        With `wait_mode="notify"`, waiters retry as soon as they hear the lock was released, and
+        only poll every `notify_poll_rate` seconds as a safety net.
 
-        client = await run_sync_in_thread_pool(_inner)
-        return cls(key, client, lock_acquisition_timeout, lock_check_rate, lock_expiry)
+        By default, waiters retry every `lock_check_rate` seconds. With `strategy="jitter"`, they
+        back off with decorrelated jitter, up to `backoff_cap` seconds, so they don't retry in
+        lockstep. With `strategy="fair"`, they queue in Redis and take the lock in the order they
+        asked for it; every lock on the key should then use the fair strategy.
 
-    async def set_lock(self, value: Any, nx: bool = False) -> bool:
-        """Try to set the given key until we timeout."""
-
-        def _inner() -> bool:
-            _start_time = time.time()
-            _set_lock = self.__client.set(
-                name=self.__key,
-                value=str(value),
-                ex=self.__lock_expiry,
-                px=None,
-                nx=nx,
+        With `local_first=True`, locks on the same key in this process queue behind each other
+        before going to Redis, and a task holding the key can take it again without waiting.
+
+        Locks on the same URL share a client and connection pool from the process-wide registry;
+        pass `share_client=False` to give this lock a client of its own. With the thread-pool
+        backend, pass an `executor` to run this lock's commands on it, rather than on our shared
+        thread pools."""
+        return cls(
+            key,
+            await cls._connect(url, backend, share_client),
+            lock_acquisition_timeout,
+            lock_check_rate,
+            lock_expiry,
+            wait_mode=wait_mode,
+            notify_poll_rate=notify_poll_rate,
+            strategy=strategy,
+            backoff_cap=backoff_cap,
+            local_first=local_first,
+            executor=executor,
+        )
+
+    @property
+    def key(self) -> str:
+        """The key we lock on."""
+        return self.__key
+
+    @property
+    def backend(self) -> Backend:
+        """The backend executing our Redis commands."""
+        return self.__backend
+
+    @property
+    def lock_expiry(self) -> int:
+        """How long the lock lasts after each refresh, in seconds."""
+        return self.__lock_expiry
+
+    @property
+    def lease(self) -> Lease:
+        """Our lease on the lock, to check how long we can count on holding it without asking
+        Redis."""
+        return self.__lease
+
+    @property
+    def token(self) -> Optional[str]:
+        """The token identifying our current acquisition of the lock, if we've taken it."""
+        return self.__token
+
+    @property
+    def fencing_token(self) -> Optional[int]:
+        """The fencing counter for our current acquisition, if we've taken it. Every acquisition
+        of a key gets a higher counter than the last, so resources guarded by the lock can reject
+        writes from holders that have since lost it."""
+        return self.__fencing_token
+
+    @property
+    def reentered(self) -> bool:
+        """Whether we hold the lock by re-entering it from a task that already held it. The outer
+        holder keeps the lock alive, so it doesn't need another heartbeat."""
+        return self.__reentered
+
+    def __related_key(self, suffix: str) -> str:
+        """A key holding some of the lock's state; on a cluster, in the lock key's hash slot."""
+        return related_key(self.__key, suffix, self.__backend.cluster)
+
+    def __queue_keys(self) -> List[str]:
+        return [
+            self.__related_key(QUEUE_KEY_SUFFIX),
+            self.__related_key(QUEUE_DEADLINES_KEY_SUFFIX),
+        ]
+
+    async def __set(self, value: Any, nx: bool, token: Optional[str] = None) -> bool:
+        """Try to take the lock once. Given a `token`, take our turn in the key's fair queue,
+        joining it under that token if we haven't already."""
+        self.__attempts += 1
+        sent_at = monotonic()
+        if token is not None:
+            ret = await self.__backend.run_script(
+                ACQUIRE_FAIR,
+                [self.__key, self.__related_key(FENCE_KEY_SUFFIX), *self.__queue_keys()],
+                [token, self.__lock_expiry * 1000, int(self.__waiter_ttl() * 1000)],
             )
-            while _set_lock is not True and (
-                (time.time() - _start_time) < self.__lock_acquisition_timeout
-            ):
-                _set_lock = self.__client.set(
-                    name=self.__key,
-                    value=str(value),
-                    ex=self.__lock_expiry,
-                    px=None,
-                    nx=nx,
-                )
-                time.sleep(self.__lock_check_rate)
+        else:
+            token = new_owner_token()
+            ret = await self.__backend.run_script(
+                ACQUIRE,
+                [self.__key, self.__related_key(FENCE_KEY_SUFFIX)],
+                [token, self.__lock_expiry * 1000, 1 if nx else 0],
+            )
+        if ret is None:
+            return False
+
+        self.__token = token
+        self.__fencing_token = int(ret)
+        self.__lease.renewed(sent_at)
+        return True
+
+    async def set_lock(self, value: Any, nx: bool = False) -> bool:
+        """Try to set the given key until we timeout. The key's value is a token unique to this
+        acquisition; `value` is accepted for backwards compatibility, but no longer stored."""
+        started_at = monotonic()
+        self.__attempts = 0
+        timeout = self.__lock_acquisition_timeout
+        hold = None
+        if nx and self.__local_first:
+            table = get_local_table()
+            hold = table.reenter(self.__backend, self.__key)
+            if hold is not None:
+                if self.__hold is not None:
+                    # We're re-entering this very lock; pick our outer hold up again on release
+                    self.__outer_holds.append(
+                        (
+                            self.__hold,
+                            self.__reentered,
+                            self.__token,
+                            self.__fencing_token,
+                            self.__lease,
+                            self.__acquired_at,
+                        )
+                    )
+                self.__hold = hold
+                self.__reentered = True
+                self.__token = hold.token
+                self.__fencing_token = hold.fencing_token
+                # The outer holder keeps the lock alive, so its lease is ours too
+                self.__lease = hold.lease or self.__lease
+                return True
+
+            hold = await table.wait(self.__backend, self.__key, timeout)
+            timeout -= monotonic() - started_at
+
+        if nx and self.__local_first and hold is None:
+            # Timed out behind another holder in this process
+            set_lock = False
+        elif nx and self.__strategy == STRATEGY_FAIR:
+            set_lock = await self.__set_lock_fair(value, timeout)
+        elif nx and self.__wait_mode == WAIT_MODE_NOTIFY:
+            set_lock = await self.__set_lock_on_release(value, timeout)
+        else:
+            set_lock = await self.__set_lock_polling(value, nx, timeout)
 
-            set_lock = _set_lock is True
+        if hold is not None:
             if set_lock is True:
-                self.__lock_obtained_at = time.time()
+                get_local_table().taken(hold, self.__token, self.__fencing_token, self.__lease)
+                self.__hold = hold
+                self.__reentered = False
+            else:
+                get_local_table().leave(self.__backend, self.__key, hold)
 
-            return set_lock
+        if set_lock is True:
+            self.__acquired_at = monotonic()
 
-        ret = await run_sync_in_thread_pool(_inner)
-        return ret
+        get_instrumentation().acquisition(
+            self.__key, monotonic() - started_at, self.__attempts, set_lock is True
+        )
+        return set_lock
 
-    async def set_expiration(self) -> None:
-        """Set the expiration, in seconds, on the given key."""
+    def __backoff(self) -> Backoff:
+        if self.__strategy == STRATEGY_JITTER:
+            return DecorrelatedJitterBackoff(DEFAULT_BACKOFF_BASE, self.__backoff_cap)
+        return FixedBackoff(self.__lock_check_rate)
 
-        def _inner():
-            self.__client.expire(name=self.__key, time=self.__lock_expiry)
-            self.__lock_obtained_at = time.time()
+    def __waiter_ttl(self) -> float:
+        """How long we keep our place in the fair queue between attempts. We check in at least
+        every `lock_check_rate` (or `notify_poll_rate`) seconds, so allow a few of those."""
+        interval = self.__lock_check_rate
+        if self.__wait_mode == WAIT_MODE_NOTIFY:
+            interval = self.__notify_poll_rate
+        return max(DEFAULT_QUEUE_WAITER_TTL, 3 * interval)
 
-        await run_sync_in_thread_pool(_inner)
+    async def __set_lock_polling(self, value: Any, nx: bool, timeout: float) -> bool:
+        backoff = self.__backoff()
+        return await retry_acquisition(lambda: self.__set(value, nx), timeout, backoff.next_delay)
 
-    async def release(self) -> None:
-        """Release the lock, if it hasn't expired."""
-        if time.time() - self.__lock_obtained_at > self.__lock_expiry:
-            raise Exception(f"{self.__key} lost lock before releasing.")
+    async def __set_lock_fair(self, value: Any, timeout: float) -> bool:
+        """Join the key's queue, and wait our turn. In notify mode, every waiter checks whether
+        it's reached the head of the queue each time the lock is released."""
+        token = new_owner_token()
+        async with contextlib.AsyncExitStack() as stack:
+            signal = None
+            interval = self.__lock_check_rate
+            if self.__wait_mode == WAIT_MODE_NOTIFY:
+                signal = await stack.enter_async_context(
+                    get_listener(self.__backend).subscribe(self.__key)
+                )
+                interval = self.__notify_poll_rate
+            set_lock = await retry_acquisition(
+                lambda: self.__set(value, True, token), timeout, lambda: interval, signal
+            )
+
+        if set_lock is not True:
+            # Give up our place, rather than making everyone behind us wait for it to lapse
+            queue, deadlines = self.__queue_keys()
+            await self.__backend.pipeline(
+                [Command("zrem", (queue, token)), Command("zrem", (deadlines, token))]
+            )
+        return set_lock
 
-        def _inner():
-            self.__client.delete(self.__key)
+    async def __set_lock_on_release(self, value: Any, timeout: float) -> bool:
+        """Subscribe to releases of the key before trying it, so we can't miss a release between a
+        failed attempt and starting to wait. Then retry whenever we hear the lock was released, or
+        every `notify_poll_rate` seconds if we hear nothing."""
+        async with get_listener(self.__backend).subscribe(self.__key) as signal:
+            return await retry_acquisition(
+                lambda: self.__set(value, True), timeout, lambda: self.__notify_poll_rate, signal
+            )
 
-        await run_sync_in_thread_pool(_inner)
+    def expiration_command(self) -> Command:
+        """The command refreshing the lock's expiration, so it can be batched with other locks'.
+        It only extends the lock if it still holds our token."""
+        self.__refresh_made_at = monotonic()
+        return EXTEND.command([self.__key], [self.__token or "", self.__lock_expiry * 1000])
 
-    async def exists(self) -> None:
-        """Check if the key exists. Mostly for testing."""
+    def expiration_set(self, result: Any, sent_at: Optional[float] = None) -> bool:
+        """Record the result of our expiration command. Returns whether we still hold the lock."""
+        if result == 1:
+            self.__lease.renewed(self.__refresh_made_at if sent_at is None else sent_at)
+            return True
+        self.__lease.end()
+        return False
 
-        def _inner() -> int:
-            return self.__client.exists(self.__key)
+    async def set_expiration(self) -> bool:
+        """Set the expiration, in seconds, on the given key, if we still hold it. Returns whether
+        we do."""
+        sent_at = monotonic()
+        ret = await self.__backend.run_script(
+            EXTEND, [self.__key], [self.__token or "", self.__lock_expiry * 1000]
+        )
+        return self.expiration_set(ret, sent_at)
 
-        ret = await run_sync_in_thread_pool(_inner)
+    async def release(self) -> None:
+        """Release the lock, if it's still ours, and tell anyone waiting on it that it's free.
+        Raises if we'd already lost the lock, e.g. it expired and someone else took it.
+
+        With `local_first`, the lock is only released in Redis once every re-entrant holder in
+        our task has released it; then the next lock waiting in this process gets its turn.
+        Releasing a re-entry of this same lock picks our outer hold back up."""
+        hold, self.__hold = self.__hold, None
+        self.__reentered = False
+        if hold is not None:
+            hold.depth -= 1
+            if hold.depth > 0 and self.__outer_holds:
+                (
+                    self.__hold,
+                    self.__reentered,
+                    self.__token,
+                    self.__fencing_token,
+                    self.__lease,
+                    self.__acquired_at,
+                ) = self.__outer_holds.pop()
+                return
+            if hold.depth > 0:
+                self.__token = None
+                self.__fencing_token = None
+                self.__acquired_at = None
+                self.__lease = Lease(self.__lock_expiry)
+                return
+
+        try:
+            ret = await self.__backend.run_script(
+                RELEASE, [self.__key], [self.__token or "", release_channel(self.__key)]
+            )
+        finally:
+            if hold is not None:
+                get_local_table().leave(self.__backend, self.__key, hold)
+        self.__token = None
+        self.__fencing_token = None
+        self.__lease.end()
+        acquired_at, self.__acquired_at = self.__acquired_at, None
+        finish_release(self.__key, acquired_at, ret == 1)
+
+    async def exists(self) -> int:
+        """Check if the key exists. Mostly for testing."""
+        ret = await self.__backend.call("exists", self.__key)
         return ret
@@ -0,0 +1,419 @@
+"""Backends that execute Redis commands on behalf of a lock.
+
+The native backend talks to Redis directly on the event loop, using the asyncio client that ships
+with `redis-py` (4.2 and later). The thread-pool backend wraps the synchronous client and runs each
+command on our thread pool; it's the fallback for older `redis-py` releases. Either can drive a
+Redis Cluster client, when given a `redis+cluster://` URL, if the installed `redis-py` has one
+(4.1 and later for the thread-pool backend, 4.3 for the native one).
+"""
+
+import abc
+import asyncio
+import inspect
+import redis
+from concurrent.futures import Executor, ThreadPoolExecutor
+from redis.exceptions import NoScriptError
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from .cluster import split_cluster_url
+from .executor import run_in_executor, run_sync_in_thread_pool
+from .scripts import Script
+from .shared import BACKEND_NATIVE, BACKEND_THREAD_POOL, Command
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis-py < 4.2
+    aioredis = None  # type: ignore
+
+try:
+    from redis.cluster import ClusterPipeline, RedisCluster
+except ImportError:  # pragma: no cover - redis-py < 4.1
+    ClusterPipeline = RedisCluster = None  # type: ignore
+
+# Clients each backend drives, and the cluster clients and their pipelines among them
+SYNC_CLIENTS: tuple = (redis.Redis,)
+ASYNC_CLIENTS: tuple = ()
+CLUSTER_CLIENTS: tuple = ()
+CLUSTER_PIPELINES: tuple = ()
+if RedisCluster is not None:
+    SYNC_CLIENTS += (RedisCluster,)
+    CLUSTER_CLIENTS += (RedisCluster,)
+    CLUSTER_PIPELINES += (ClusterPipeline,)
+if aioredis is not None:
+    ASYNC_CLIENTS += (aioredis.Redis,)
+    # The asyncio cluster client arrived in redis-py 4.3
+    if hasattr(aioredis, "RedisCluster"):
+        ASYNC_CLIENTS += (aioredis.RedisCluster,)
+        CLUSTER_CLIENTS += (aioredis.RedisCluster,)
+        CLUSTER_PIPELINES += (aioredis.cluster.ClusterPipeline,)
+
+# A synchronous client, for a single node or a cluster
+SyncClient = Union[redis.Redis, RedisCluster]
+
+
+class PubSub(abc.ABC):
+    """A pub/sub connection. Messages are `redis-py` message dicts."""
+
+    @abc.abstractmethod
+    async def subscribe(self, *channels: str) -> None:
+        """Subscribe to the given channels."""
+
+    @abc.abstractmethod
+    async def unsubscribe(self, *channels: str) -> None:
+        """Unsubscribe from the given channels."""
+
+    @abc.abstractmethod
+    async def get_message(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait up to `timeout` seconds for the next message, including subscribe confirmations."""
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        """Close the connection."""
+
+
+class Backend(abc.ABC):
+    """Executes Redis commands for a lock, without blocking the event loop."""
+
+    @property
+    @abc.abstractmethod
+    def name(self) -> str:
+        """The name of this backend, e.g. `native`."""
+
+    @property
+    @abc.abstractmethod
+    def client(self) -> Any:
+        """The underlying `redis-py` client."""
+
+    @property
+    def cluster(self) -> bool:
+        """Whether the client talks to a Redis Cluster, so keys used together must share a hash
+        slot."""
+        return isinstance(self.client, CLUSTER_CLIENTS)
+
+    def with_executor(self, executor: Executor) -> "Backend":
+        """A backend sharing our client, which runs blocking calls on the given executor. Backends
+        that don't block return themselves."""
+        return self
+
+    @abc.abstractmethod
+    async def call(self, command: str, *args, **kwargs) -> Any:
+        """Call the named `redis-py` client method, e.g. `call("expire", name=key, time=8)`."""
+
+    @abc.abstractmethod
+    async def _execute_pipeline(self, commands: Sequence[Command]) -> List[Any]:
+        """Send the given commands in a single round-trip, without a transaction. Errors are
+        returned in place of results rather than raised."""
+
+    async def pipeline(self, commands: Sequence[Command]) -> List[Any]:
+        """Send the given commands in a single round-trip, without a transaction. Errors are
+        returned in place of results rather than raised. If the server doesn't know a script we
+        sent by SHA1, we load it and resend the affected commands."""
+        results = await self._execute_pipeline(commands)
+        missing = [i for i, result in enumerate(results) if isinstance(result, NoScriptError)]
+        if missing:
+            for sha in {commands[i].args[0] for i in missing}:
+                script = Script.by_sha(sha)
+                if script is not None:
+                    await self.call("script_load", script.source)
+            retried = await self._execute_pipeline([commands[i] for i in missing])
+            for i, result in zip(missing, retried):
+                results[i] = result
+        return results
+
+    async def run_script(self, script: Script, keys: Sequence[str], args: Sequence[Any] = ()) -> Any:
+        """Run a script by SHA1, loading it first if the server doesn't know it yet."""
+        command = script.command(keys, args)
+        try:
+            ret = await self.call(command.name, *command.args)
+        except NoScriptError:
+            await self.call("script_load", script.source)
+            ret = await self.call(command.name, *command.args)
+        return ret
+
+    async def _open_connections(self, count: int) -> None:
+        """Open up to `count` connections, unless they're open already. Clients without a single
+        pool to fill, like cluster clients, open one."""
+        await self.call("ping")
+
+    async def warm_up(self, connections: int = 1) -> None:
+        """Open up to `connections` connections, and load every script we ship, so the first
+        locks wait on neither handshakes nor a `NOSCRIPT` and reload."""
+        await self._open_connections(connections)
+        if self.cluster:
+            # The cluster client loads each script on every primary
+            for script in Script.all():
+                await self.call("script_load", script.source)
+            return
+        results = await self._execute_pipeline(
+            [Command("script_load", (script.source,)) for script in Script.all()]
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    @abc.abstractmethod
+    def pubsub(self) -> PubSub:
+        """Open a pub/sub connection."""
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        """Close the client's connections."""
+
+
+def queue_command(pipe: Any, command: Command) -> None:
+    """Queue a command in a pipeline. Cluster pipelines refuse scripts queued by method name, but
+    route them by their keys like any other command when queued as raw commands."""
+    if isinstance(pipe, CLUSTER_PIPELINES) and not command.kwargs:
+        pipe.execute_command(command.name.upper(), *command.args)
+    else:
+        getattr(pipe, command.name)(*command.args, **command.kwargs)
+
+
+def _check_out(pool: Any) -> Any:
+    """Take a connection from a pool. Before redis-py 5.3, `get_connection` needed the name of a
+    command to run; since, it warns if given one."""
+    try:
+        return pool.get_connection()
+    except TypeError:
+        return pool.get_connection("PING")
+
+
+class ThreadPoolPubSub(PubSub):
+    """Wraps the synchronous `redis-py` pub/sub client. Blocking reads get a dedicated thread, so
+    waiting for messages never ties up our thread pool."""
+
+    # The pub/sub client
+    __pubsub: Any
+
+    # Thread to block on reads in
+    __reader: ThreadPoolExecutor
+
+    def __init__(self, pubsub: Any):
+        self.__pubsub = pubsub
+        self.__reader = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="redis-heartbeat-lock-pubsub"
+        )
+
+    async def subscribe(self, *channels: str) -> None:
+        await run_sync_in_thread_pool(self.__pubsub.subscribe, *channels)
+
+    async def unsubscribe(self, *channels: str) -> None:
+        await run_sync_in_thread_pool(self.__pubsub.unsubscribe, *channels)
+
+    async def get_message(self, timeout: float) -> Optional[Dict[str, Any]]:
+        future = self.__reader.submit(self.__pubsub.get_message, timeout=timeout)
+        ret = await asyncio.wrap_future(future)
+        return ret
+
+    async def close(self) -> None:
+        await run_sync_in_thread_pool(self.__pubsub.close)
+        self.__reader.shutdown(wait=False)
+
+
+class NativePubSub(PubSub):
+    """Wraps the asyncio `redis-py` pub/sub client."""
+
+    # The pub/sub client
+    __pubsub: Any
+
+    def __init__(self, pubsub: Any):
+        self.__pubsub = pubsub
+
+    async def subscribe(self, *channels: str) -> None:
+        await self.__pubsub.subscribe(*channels)
+
+    async def unsubscribe(self, *channels: str) -> None:
+        await self.__pubsub.unsubscribe(*channels)
+
+    async def get_message(self, timeout: float) -> Optional[Dict[str, Any]]:
+        if not self.__pubsub.subscribed:
+            # The asyncio client refuses to read before the first subscription
+            await asyncio.sleep(timeout)
+            return None
+        ret = await self.__pubsub.get_message(timeout=timeout)
+        return ret
+
+    async def close(self) -> None:
+        close = getattr(self.__pubsub, "aclose", None) or self.__pubsub.close
+        await close()
+
+
+class ThreadPoolBackend(Backend):
+    """Runs commands from the synchronous `redis-py` client on our thread pool."""
+
+    # The Redis client
+    __client: SyncClient
+
+    # Executor to run commands on, instead of our shared thread pools
+    __executor: Optional[Executor]
+
+    def __init__(self, client: SyncClient, executor: Optional[Executor] = None):
+        self.__client = client
+        self.__executor = executor
+
+    @property
+    def name(self) -> str:
+        return BACKEND_THREAD_POOL
+
+    @property
+    def client(self) -> SyncClient:
+        return self.__client
+
+    def with_executor(self, executor: Executor) -> "ThreadPoolBackend":
+        return ThreadPoolBackend(self.__client, executor)
+
+    def __run(self, func, *args, **kwargs):
+        if self.__executor is not None:
+            return run_in_executor(self.__executor, func, *args, **kwargs)
+        return run_sync_in_thread_pool(func, *args, **kwargs)
+
+    async def call(self, command: str, *args, **kwargs) -> Any:
+        ret = await self.__run(getattr(self.__client, command), *args, **kwargs)
+        return ret
+
+    async def _execute_pipeline(self, commands: Sequence[Command]) -> List[Any]:
+        def _inner() -> List[Any]:
+            pipe = self.__client.pipeline(transaction=False)
+            for command in commands:
+                queue_command(pipe, command)
+            return pipe.execute(raise_on_error=False)
+
+        ret = await self.__run(_inner)
+        return ret
+
+    async def _open_connections(self, count: int) -> None:
+        pool = getattr(self.__client, "connection_pool", None)
+        if pool is None or self.cluster:
+            await super()._open_connections(count)
+            return
+
+        def _inner() -> None:
+            # Hold every connection at once, so the pool has to open each of them
+            held = []
+            try:
+                for _ in range(min(count, getattr(pool, "max_connections", count))):
+                    held.append(_check_out(pool))
+            finally:
+                for connection in held:
+                    pool.release(connection)
+
+        await self.__run(_inner)
+
+    def pubsub(self) -> PubSub:
+        return ThreadPoolPubSub(self.__client.pubsub(ignore_subscribe_messages=False))
+
+    async def close(self) -> None:
+        await run_sync_in_thread_pool(self.__client.close)
+
+
+class NativeBackend(Backend):
+    """Runs commands from the asyncio `redis-py` client directly on the event loop."""
+
+    # The Redis client
+    __client: Any
+
+    def __init__(self, client: Any):
+        self.__client = client
+
+    @property
+    def name(self) -> str:
+        return BACKEND_NATIVE
+
+    @property
+    def client(self) -> Any:
+        return self.__client
+
+    async def call(self, command: str, *args, **kwargs) -> Any:
+        ret = await getattr(self.__client, command)(*args, **kwargs)
+        return ret
+
+    async def _execute_pipeline(self, commands: Sequence[Command]) -> List[Any]:
+        async with self.__client.pipeline(transaction=False) as pipe:
+            for command in commands:
+                queue_command(pipe, command)
+            ret = await pipe.execute(raise_on_error=False)
+        return ret
+
+    async def _open_connections(self, count: int) -> None:
+        pool = getattr(self.__client, "connection_pool", None)
+        if pool is None or self.cluster:
+            await super()._open_connections(count)
+            return
+
+        # Hold every connection at once, so the pool has to open each of them
+        held = []
+        try:
+            for _ in range(min(count, getattr(pool, "max_connections", count))):
+                connection = _check_out(pool)
+                held.append(await connection if inspect.isawaitable(connection) else connection)
+        finally:
+            for connection in held:
+                released = pool.release(connection)
+                if inspect.isawaitable(released):
+                    await released
+
+    def pubsub(self) -> PubSub:
+        return NativePubSub(self.__client.pubsub(ignore_subscribe_messages=False))
+
+    async def close(self) -> None:
+        # `aclose` replaced `close` in redis-py 5.0.1
+        close = getattr(self.__client, "aclose", None) or self.__client.close
+        await close()
+
+
+def native_backend_available() -> bool:
+    """Whether the installed `redis-py` ships an asyncio client."""
+    return aioredis is not None
+
+
+def from_client(client: Union[Backend, redis.Redis, Any]) -> Backend:
+    """Wrap a `redis-py` client (sync or asyncio) in the matching backend."""
+    if isinstance(client, Backend):
+        return client
+    if isinstance(client, ASYNC_CLIENTS):
+        return NativeBackend(client)
+    if isinstance(client, SYNC_CLIENTS):
+        return ThreadPoolBackend(client)
+    raise Exception(f"Unsupported Redis client: {type(client).__name__}.")
+
+
+def cluster_client_class(backend: str) -> Any:
+    """The `redis-py` Redis Cluster client the given backend drives. Raises if the installed
+    `redis-py` doesn't have one."""
+    if backend == BACKEND_NATIVE:
+        cls = getattr(aioredis, "RedisCluster", None)
+        if cls is None:
+            raise Exception(f"Redis Cluster on the {backend} backend needs redis-py 4.3 or later.")
+        return cls
+    if RedisCluster is None:
+        raise Exception(f"Redis Cluster on the {backend} backend needs redis-py 4.1 or later.")
+    return RedisCluster
+
+
+async def from_url(url: str, backend: Optional[str] = None) -> Backend:
+    """Build a client for the given URL, wrapped in the requested backend. If no backend is
+    requested, use the native one when it's available. A `redis+cluster://` URL gets a Redis
+    Cluster client, which finds the other nodes from the one in the URL."""
+    if backend is None:
+        backend = BACKEND_NATIVE if native_backend_available() else BACKEND_THREAD_POOL
+    cluster, url = split_cluster_url(url)
+
+    if backend == BACKEND_NATIVE:
+        if aioredis is None:
+            raise Exception(f"The {BACKEND_NATIVE} backend requires redis-py 4.2 or later.")
+        # Building the asyncio client doesn't do any I/O; connections are opened on first use.
+        if cluster:
+            return NativeBackend(cluster_client_class(backend).from_url(url=url))
+        return NativeBackend(aioredis.Redis.from_url(url=url))
+
+    if backend == BACKEND_THREAD_POOL:
+        # Building the synchronous client doesn't do any I/O either, so there's no need to wait
+        # for a thread, except that the cluster client asks the node for the cluster's layout.
+        client: SyncClient
+        if cluster:
+            client = await run_sync_in_thread_pool(cluster_client_class(backend).from_url, url=url)
+        else:
+            client = redis.Redis.from_url(url=url)
+        return ThreadPoolBackend(client)
+
+    raise Exception(f"Unknown backend {backend}.")
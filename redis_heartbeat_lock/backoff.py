@@ -0,0 +1,56 @@
+"""Delays between attempts to take a contended lock.
+
+Waiters that all retry on the same fixed period stay in lockstep, and hit Redis together every
+time the lock is released. :class:`DecorrelatedJitterBackoff` spreads them out: each delay is drawn
+at random between a small base and three times the previous delay, up to a cap.
+"""
+
+import abc
+import random
+from typing import Optional
+
+
+class Backoff(abc.ABC):
+    """Hands out the delay before each retry."""
+
+    @abc.abstractmethod
+    def next_delay(self) -> float:
+        """Seconds to wait before the next attempt."""
+
+
+class FixedBackoff(Backoff):
+    """The same delay every time."""
+
+    # Seconds between attempts
+    __delay: float
+
+    def __init__(self, delay: float):
+        self.__delay = delay
+
+    def next_delay(self) -> float:
+        return self.__delay
+
+
+class DecorrelatedJitterBackoff(Backoff):
+    """Decorrelated jitter: each delay is uniform between `base` and three times the last delay,
+    capped at `cap`."""
+
+    # Smallest delay, in seconds
+    __base: float
+
+    # Largest delay, in seconds
+    __cap: float
+
+    # The last delay we handed out
+    __last: float
+
+    def __init__(self, base: float, cap: float, rng: Optional[random.Random] = None):
+        self.__base = min(base, cap)
+        self.__cap = cap
+        self.__last = self.__base
+        # Seeded from `random`, so seeding that makes our delays reproducible, e.g. in a simulation
+        self.__random = rng if rng is not None else random.Random(random.random())
+
+    def next_delay(self) -> float:
+        self.__last = min(self.__cap, self.__random.uniform(self.__base, self.__last * 3))
+        return self.__last
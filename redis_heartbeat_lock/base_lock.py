@@ -0,0 +1,183 @@
+"""The interface shared by every kind of lock, so the context manager and heartbeat scheduler can
+hold any of them."""
+
+import abc
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from .backends import Backend, from_url
+from .instrumentation import end_hold, get_instrumentation
+from .lease import Lease
+from .notifications import ReleaseSignal
+from .pool import get_registry
+from .shared import Command, monotonic
+
+
+class BaseLock(abc.ABC):
+    """A lock held in Redis with an expiry, kept alive by refreshing it. Subclasses keep the
+    state shared by every kind of lock here, and add what's particular to them."""
+
+    # A name for the lock: the key it locks on, for most locks
+    __key: str
+
+    # The backend executing our Redis commands
+    __backend: Backend
+
+    # Expiration of the lock, in seconds
+    __lock_expiry: int
+
+    # How long we can count on holding the lock, from when we last set or refreshed it
+    __lease: Lease
+
+    # When we last made our expiration command, on the monotonic clock
+    __refresh_made_at: float
+
+    # Token identifying our current acquisition
+    __token: Optional[str]
+
+    # When we took the lock, on the monotonic clock, if we hold it
+    __acquired_at: Optional[float]
+
+    def __init__(self, key: str, backend: Backend, lock_expiry: int):
+        self.__key = key
+        self.__backend = backend
+        self.__lock_expiry = lock_expiry
+        self.__lease = Lease(lock_expiry)
+        self.__refresh_made_at = 0.0
+        self.__token = None
+        self.__acquired_at = None
+
+    @staticmethod
+    async def _connect(url: str, backend: Optional[str], share_client: bool) -> Backend:
+        """A backend for `create` to build the lock on: the process-wide registry's for the URL,
+        or without `share_client`, one with a client of its own."""
+        if share_client:
+            return await get_registry().get(url, backend)
+        return await from_url(url, backend)
+
+    @property
+    def key(self) -> str:
+        """A name for the lock, for error messages."""
+        return self.__key
+
+    @property
+    def backend(self) -> Backend:
+        """The backend executing our Redis commands."""
+        return self.__backend
+
+    @property
+    def lock_expiry(self) -> int:
+        """How long the lock lasts after each refresh, in seconds."""
+        return self.__lock_expiry
+
+    @property
+    def lease(self) -> Lease:
+        """Our lease on the lock, to check how long we can count on holding it without asking
+        Redis."""
+        return self.__lease
+
+    @property
+    def token(self) -> Optional[str]:
+        """The token identifying our current acquisition of the lock, if we've taken it."""
+        return self.__token
+
+    @property
+    def batched(self) -> bool:
+        """Whether the lock is refreshed by its expiration command alone, so it can be batched in
+        its backend's pipeline. Otherwise, it's refreshed with `set_expiration`."""
+        return True
+
+    @property
+    def reentered(self) -> bool:
+        """Whether we hold the lock by re-entering it, so an outer holder keeps it alive."""
+        return False
+
+    @abc.abstractmethod
+    async def set_lock(self, value: Any, nx: bool = False) -> bool:
+        """Try to take the lock until we timeout. Returns whether we got it."""
+
+    @abc.abstractmethod
+    def expiration_command(self) -> Command:
+        """The command refreshing the lock's expiration, so it can be batched with other locks'."""
+
+    def expiration_set(self, result: Any, sent_at: Optional[float] = None) -> bool:
+        """Record the result of our expiration command, sent at `sent_at` on the monotonic clock,
+        or else as soon as it was made. Returns whether we still hold the lock."""
+        if self._still_held(result):
+            self.__lease.renewed(self.__refresh_made_at if sent_at is None else sent_at)
+            return True
+        self.__lease.end()
+        return False
+
+    @abc.abstractmethod
+    async def set_expiration(self) -> bool:
+        """Refresh the lock's expiration. Returns whether we still hold the lock."""
+
+    @abc.abstractmethod
+    async def release(self) -> None:
+        """Release the lock."""
+
+    @abc.abstractmethod
+    async def exists(self) -> int:
+        """Check if the lock is held. Mostly for testing."""
+
+    def _still_held(self, result: Any) -> bool:
+        """Whether the result of our expiration command says we still hold the lock."""
+        return result == 1
+
+    def _refresh_made(self) -> None:
+        """Record that we just made our expiration command, so a batch sending it can leave out
+        when it was sent."""
+        self.__refresh_made_at = monotonic()
+
+    def _taken(self, token: str, sent_at: float) -> None:
+        """Record that an attempt sent at `sent_at` on the monotonic clock took the lock, with
+        `token` identifying the acquisition."""
+        self.__token = token
+        self.__lease.renewed(sent_at)
+
+    def _acquired(self, started_at: float, attempts: int, acquired: bool) -> None:
+        """Record the end of a call to `set_lock` that started at `started_at` on the monotonic
+        clock, and took `attempts` attempts."""
+        if acquired:
+            self.__acquired_at = monotonic()
+        get_instrumentation().acquisition(self.key, monotonic() - started_at, attempts, acquired)
+
+    def _released(self, released: bool) -> None:
+        """Forget our acquisition once we've asked Redis to release the lock. Raises if we found
+        we'd lost the lock before `released` it."""
+        self.__token = None
+        self.__lease.end()
+        acquired_at, self.__acquired_at = self.__acquired_at, None
+        finish_release(self.key, acquired_at, released)
+
+
+async def retry_acquisition(
+    attempt: Callable[[], Awaitable[bool]],
+    timeout: float,
+    delay: Callable[[], float],
+    signal: Optional[ReleaseSignal] = None,
+) -> bool:
+    """Call `attempt` until it takes the lock, or `timeout` seconds have passed. Between attempts,
+    sleep for `delay()` seconds or, given a release `signal`, wait up to that long for the lock to
+    be released. Returns whether we took the lock."""
+    started_at = monotonic()
+    set_lock = await attempt()
+    while set_lock is not True:
+        remaining = timeout - (monotonic() - started_at)
+        if remaining <= 0:
+            break
+        if signal is not None:
+            await signal.wait(min(delay(), remaining))
+        else:
+            await asyncio.sleep(delay())
+        set_lock = await attempt()
+    return set_lock
+
+
+def finish_release(key: str, acquired_at: Optional[float], released: bool) -> None:
+    """Finish releasing a lock acquired at `acquired_at` on the monotonic clock, if we'd acquired
+    it. Raises if we found we'd lost the lock before `released` it."""
+    end_hold(key, acquired_at, monotonic(), released)
+    if not released:
+        raise Exception(f"{key} lost lock before releasing.")
@@ -0,0 +1,397 @@
+"""Benchmarks, run against our in-process stand-in for Redis with injectable latency.
+
+    python -m redis_heartbeat_lock.benchmark --latency 0.0005 --output results.json
+
+Each scenario reports its parameters and metrics as JSON, so results can be compared between
+releases. The stand-in serves from its own thread, so the numbers measure our client code and the
+injected latency, rather than a real server.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import redis
+
+from .async_lock import AsyncLock
+from .backends import Backend, from_url
+from .context_manager import ContextManager
+from .executor import get_executor
+from .heartbeat import HeartbeatScheduler
+from .instrumentation import InMemoryInstrumentation, get_instrumentation, set_instrumentation
+from .shared import (
+    BACKEND_THREAD_POOL,
+    DEFAULT_LOCK_CHECK_RATE,
+    STRATEGY_FAIR,
+    STRATEGY_FIXED,
+    STRATEGY_JITTER,
+    WAIT_MODE_NOTIFY,
+    WAIT_MODE_POLL,
+)
+from .testing import FakeRedisServer
+
+# How long locks in the benchmarks wait before giving up; long enough never to matter
+ACQUISITION_TIMEOUT = 60.0
+
+# What a fresh process imports before taking its first lock
+COLD_START_IMPORT = "import redis_heartbeat_lock.async_lock, redis_heartbeat_lock.context_manager"
+
+
+class BenchmarkResult(NamedTuple):
+    """The outcome of one benchmark scenario."""
+
+    # The scenario's name
+    name: str
+
+    # The parameters it ran with
+    params: Dict[str, Any]
+
+    # What we measured. Durations are in seconds.
+    metrics: Dict[str, float]
+
+
+def _distribution(prefix: str, samples: Sequence[float]) -> Dict[str, float]:
+    """Summarize samples as their mean and percentiles, with names starting with `prefix`."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def _percentile(q: float) -> float:
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    return {
+        f"{prefix}_mean": sum(ordered) / len(ordered),
+        f"{prefix}_p50": _percentile(0.5),
+        f"{prefix}_p90": _percentile(0.9),
+        f"{prefix}_p99": _percentile(0.99),
+        f"{prefix}_max": ordered[-1],
+    }
+
+
+def _lock(key: str, backend: Backend, **kwargs: Any) -> AsyncLock:
+    return AsyncLock(
+        key,
+        backend,
+        lock_acquisition_timeout=kwargs.pop("lock_acquisition_timeout", ACQUISITION_TIMEOUT),
+        lock_check_rate=kwargs.pop("lock_check_rate", DEFAULT_LOCK_CHECK_RATE),
+        lock_expiry=kwargs.pop("lock_expiry", 8),
+        **kwargs,
+    )
+
+
+async def acquisitions_per_second(
+    server: FakeRedisServer, workers: int = 8, duration: float = 2.0, backend: Optional[str] = None
+) -> BenchmarkResult:
+    """Uncontended throughput: each worker takes and releases its own key as fast as it can."""
+    client = await from_url(server.url, backend)
+    latencies: List[float] = []
+
+    async def _worker(i: int) -> None:
+        lock = _lock(f"bench:acquire:{i}", client)
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            started_at = time.monotonic()
+            await lock.set_lock(True, True)
+            await lock.release()
+            latencies.append(time.monotonic() - started_at)
+
+    started_at = time.monotonic()
+    await asyncio.gather(*[_worker(i) for i in range(workers)])
+    elapsed = time.monotonic() - started_at
+    await client.close()
+
+    metrics = {"acquisitions_per_second": len(latencies) / elapsed}
+    metrics.update(_distribution("acquire_release_latency", latencies))
+    return BenchmarkResult(
+        "acquisitions_per_second",
+        {"workers": workers, "duration": duration, "backend": client.name},
+        metrics,
+    )
+
+
+async def handoff_latency(
+    server: FakeRedisServer,
+    contenders: int = 8,
+    rounds: int = 3,
+    hold: float = 0.01,
+    wait_mode: str = WAIT_MODE_POLL,
+    strategy: str = STRATEGY_FIXED,
+    backend: Optional[str] = None,
+) -> BenchmarkResult:
+    """Contended handoff: `contenders` tasks each want the same key once. We measure the gap
+    between one holder releasing the key and the next taking it, and the commands each acquisition
+    cost."""
+    client = await from_url(server.url, backend)
+    gaps: List[float] = []
+    commands_before = server.commands_received
+
+    for round_ in range(rounds):
+        released_at: List[float] = []
+
+        async def _contender(lock: AsyncLock) -> None:
+            await lock.set_lock(True, True)
+            if released_at:
+                gaps.append(time.monotonic() - released_at[-1])
+            await asyncio.sleep(hold)
+            await lock.release()
+            released_at.append(time.monotonic())
+
+        locks = [
+            _lock(f"bench:handoff:{round_}", client, wait_mode=wait_mode, strategy=strategy)
+            for _ in range(contenders)
+        ]
+        await asyncio.gather(*[_contender(lock) for lock in locks])
+    commands = server.commands_received - commands_before
+    await client.close()
+
+    metrics = {"commands_per_acquisition": commands / (contenders * rounds)}
+    metrics.update(_distribution("handoff", gaps))
+
+    return BenchmarkResult(
+        "handoff_latency",
+        {
+            "contenders": contenders,
+            "rounds": rounds,
+            "hold": hold,
+            "wait_mode": wait_mode,
+            "strategy": strategy,
+            "lock_check_rate": DEFAULT_LOCK_CHECK_RATE,
+            "backend": client.name,
+        },
+        metrics,
+    )
+
+
+async def _loop_lag(stop: asyncio.Event, samples: List[float], interval: float = 0.01) -> None:
+    """Measure how late the event loop wakes us up, while `stop` isn't set."""
+    while not stop.is_set():
+        started_at = time.monotonic()
+        await asyncio.sleep(interval)
+        samples.append(max(time.monotonic() - started_at - interval, 0.0))
+
+
+async def heartbeat_overhead(
+    server: FakeRedisServer,
+    locks: int = 100,
+    duration: float = 2.0,
+    period: float = 0.5,
+    scheduled: bool = True,
+    backend: Optional[str] = None,
+) -> BenchmarkResult:
+    """Hold `locks` locks for `duration` seconds, heartbeating every `period` seconds, either from
+    a shared scheduler or a task per lock. We count the commands reaching Redis, and measure how
+    much the heartbeats delay the event loop."""
+    client = await from_url(server.url, backend)
+    scheduler = HeartbeatScheduler() if scheduled else None
+    lag: List[float] = []
+    stop = asyncio.Event()
+
+    async with contextlib.AsyncExitStack() as stack:
+        for i in range(locks):
+            manager = ContextManager(
+                _lock(f"bench:heartbeat:{i}", client), period=period, scheduler=scheduler
+            )
+            await stack.enter_async_context(manager)
+
+        commands_before = server.commands_received
+        probe = asyncio.ensure_future(_loop_lag(stop, lag))
+        await asyncio.sleep(duration)
+        stop.set()
+        await probe
+        commands = server.commands_received - commands_before
+    await client.close()
+
+    metrics = {
+        "commands_per_second": commands / duration,
+        "commands_per_lock_per_period": commands / locks / (duration / period),
+    }
+    metrics.update(_distribution("loop_lag", lag))
+    return BenchmarkResult(
+        "heartbeat_overhead",
+        {
+            "locks": locks,
+            "duration": duration,
+            "period": period,
+            "scheduled": scheduled,
+            "backend": client.name,
+        },
+        metrics,
+    )
+
+
+async def executor_saturation(
+    server: FakeRedisServer, concurrency: int = 32, operations: int = 500
+) -> BenchmarkResult:
+    """Run `operations` commands through the thread-pool backend, `concurrency` at a time, and
+    measure how long they queue for a thread."""
+    client = await from_url(server.url, BACKEND_THREAD_POOL)
+    recorder = InMemoryInstrumentation()
+    previous = get_instrumentation()
+    set_instrumentation(recorder)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def _operation(i: int) -> None:
+        async with limit:
+            await client.call("exists", f"bench:executor:{i}")
+
+    try:
+        started_at = time.monotonic()
+        await asyncio.gather(*[_operation(i) for i in range(operations)])
+        elapsed = time.monotonic() - started_at
+    finally:
+        set_instrumentation(previous)
+        await client.close()
+
+    delay = recorder.executor_delay.summary()
+    return BenchmarkResult(
+        "executor_saturation",
+        {
+            "concurrency": concurrency,
+            "operations": operations,
+            "max_workers": getattr(get_executor(), "max_workers", None),
+        },
+        {
+            "operations_per_second": operations / elapsed,
+            "queue_delay_mean": delay.sum / delay.samples if delay.samples else 0.0,
+            "queue_delay_p50": delay.p50,
+            "queue_delay_p99": delay.p99,
+            "queue_delay_max": delay.max,
+        },
+    )
+
+
+async def _import_times() -> Tuple[float, float]:
+    """Import the package in a fresh interpreter. Returns how long all of it took, and how long
+    our own modules took, leaving out their dependencies, in seconds."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-X",
+        "importtime",
+        "-c",
+        COLD_START_IMPORT,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+    )
+    _, stderr = await process.communicate()
+
+    total = ours = 0
+    for line in stderr.decode().splitlines():
+        # e.g. "import time:       197 |        197 |   redis_heartbeat_lock.shared"
+        fields = line.split(":", 1)[-1].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        own, cumulative, name = int(fields[0]), int(fields[1]), fields[2]
+        if len(name) - len(name.lstrip()) == 1:
+            # Only count modules imported directly, since theirs include their imports' times
+            total += cumulative
+        if name.strip().startswith("redis_heartbeat_lock"):
+            ours += own
+    return total / 1e6, ours / 1e6
+
+
+async def _first_acquisition(server: FakeRedisServer, warm: bool) -> float:
+    """How long a fresh client's first acquisition takes, optionally after warming it up."""
+    client = await from_url(server.url)
+    try:
+        if warm:
+            await client.warm_up()
+        lock = _lock(f"bench:cold_start:{warm}", client)
+        started_at = time.monotonic()
+        await lock.set_lock(True, True)
+        elapsed = time.monotonic() - started_at
+        await lock.release()
+    finally:
+        await client.close()
+    return elapsed
+
+
+async def cold_start(server: FakeRedisServer) -> BenchmarkResult:
+    """What a fresh process pays before its first lock: importing the package, and the first
+    acquisition, which has to connect and load a script unless the client was warmed up."""
+    import_total, import_ours = await _import_times()
+    # The cold run goes first, so the server doesn't know our scripts yet
+    cold = await _first_acquisition(server, warm=False)
+    warm = await _first_acquisition(server, warm=True)
+    return BenchmarkResult(
+        "cold_start",
+        {"imports": COLD_START_IMPORT},
+        {
+            "import_seconds": import_total,
+            "package_import_seconds": import_ours,
+            "first_acquisition_cold": cold,
+            "first_acquisition_warm": warm,
+        },
+    )
+
+
+def scenarios(quick: bool = False) -> List[Callable[[FakeRedisServer], Any]]:
+    """The standard benchmark scenarios, each taking the server to run against. `quick` shrinks
+    them, e.g. for a smoke test."""
+    duration = 0.3 if quick else 2.0
+    locks = 20 if quick else 200
+    period = 0.1 if quick else 0.5
+    rounds = 1 if quick else 3
+    return [
+        lambda s: acquisitions_per_second(s, duration=duration),
+        lambda s: handoff_latency(s, rounds=rounds, wait_mode=WAIT_MODE_POLL),
+        lambda s: handoff_latency(s, rounds=rounds, strategy=STRATEGY_JITTER),
+        lambda s: handoff_latency(s, rounds=rounds, strategy=STRATEGY_FAIR),
+        lambda s: handoff_latency(s, rounds=rounds, wait_mode=WAIT_MODE_NOTIFY),
+        lambda s: heartbeat_overhead(s, locks, duration, period, scheduled=False),
+        lambda s: heartbeat_overhead(s, locks, duration, period, scheduled=True),
+        lambda s: executor_saturation(s, operations=50 if quick else 500),
+        cold_start,
+    ]
+
+
+async def run(latency: float = 0.0, quick: bool = False) -> Dict[str, Any]:
+    """Run every scenario against a fresh stand-in server, delaying each reply by `latency`
+    seconds. Returns the results, ready to be dumped as JSON."""
+    results = []
+    for scenario in scenarios(quick):
+        server = FakeRedisServer(latency=latency).start_in_thread()
+        try:
+            results.append((await scenario(server))._asdict())
+        finally:
+            server.stop_thread()
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "redis_py": redis.__version__,
+            "platform": platform.platform(),
+            "latency": latency,
+            "quick": quick,
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds the server delays each reply."
+    )
+    parser.add_argument("--quick", action="store_true", help="Run shortened scenarios.")
+    parser.add_argument("--output", help="File to write results to, instead of stdout.")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(asyncio.run(run(args.latency, args.quick)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
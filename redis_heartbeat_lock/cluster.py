@@ -0,0 +1,68 @@
+"""Helpers for locks on a Redis Cluster.
+
+A cluster spreads keys over its nodes by hash slot, and a script or multi-key command can only
+touch keys in one slot. A lock's own keys (its fencing counter, fair queue, readers and so on) are
+named after the lock's key, so on a cluster we wrap the lock's key in a hash tag when naming them:
+`{my-key}:fence` hashes only `my-key`, and lands in the same slot as `my-key` itself. Keys that
+already have a hash tag keep their names, since their related keys share the tag. To lock several
+keys at once, give them a common hash tag, e.g. `{dataset:1}:partition:1`.
+
+`redis-py` follows `MOVED` and `ASK` redirects while slots move between nodes, and its cluster
+pipelines split commands by node and send each node its share at once, so batched heartbeats make
+one round-trip per node rather than per lock.
+"""
+
+from binascii import crc_hqx
+from typing import Iterable, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from .shared import CLUSTER_SLOTS, CLUSTER_URL_SCHEMES
+
+
+def hash_tag(key: str) -> Optional[str]:
+    """The part of the key Redis Cluster hashes, if the key has a hash tag: what's between the
+    first `{` and the next `}`, if that's not empty."""
+    start = key.find("{")
+    if start == -1:
+        return None
+    end = key.find("}", start + 1)
+    if end <= start + 1:
+        return None
+    return key[start + 1 : end]
+
+
+def key_slot(key: str) -> int:
+    """The hash slot the key lives in: the CRC16 of its hash tag, or of the whole key."""
+    tag = hash_tag(key)
+    return crc_hqx((key if tag is None else tag).encode(), 0) % CLUSTER_SLOTS
+
+
+def related_key(key: str, suffix: str, cluster: bool) -> str:
+    """The name of a key holding some of a lock's state, e.g. its fencing counter. On a cluster,
+    it's put in the lock key's slot."""
+    if not cluster or hash_tag(key) is not None:
+        return f"{key}{suffix}"
+    related = f"{{{key}}}{suffix}"
+    if key_slot(related) != key_slot(key):
+        raise Exception(f"Can't keep the keys of lock {key} in one hash slot; give it a hash tag.")
+    return related
+
+
+def check_same_slot(keys: Iterable[str]) -> None:
+    """Raise unless every key lives in the same hash slot, so one script can touch them all."""
+    slots = {key_slot(key) for key in keys}
+    if len(slots) > 1:
+        raise Exception(
+            "Keys locked together on a Redis Cluster must share a hash slot; give them a common "
+            "hash tag, e.g. {dataset:1}:partition:1."
+        )
+
+
+def split_cluster_url(url: str) -> Tuple[bool, str]:
+    """Whether the URL points at a Redis Cluster, and the URL with the plain scheme `redis-py`
+    expects, e.g. `redis+cluster://host:6379` becomes `redis://host:6379`."""
+    parts = urlsplit(url)
+    scheme = CLUSTER_URL_SCHEMES.get(parts.scheme)
+    if scheme is None:
+        return False, url
+    return True, urlunsplit((scheme, parts.netloc, parts.path, parts.query, parts.fragment))
@@ -1,9 +1,14 @@
 """Main module. Builds on top of our redis client, adding a heartbeat and context manager."""
 
 import asyncio
+from typing import Callable, Optional
 
-from .async_lock import AsyncLock
-from .shared import DEFAULT_HEARTBEAT_PERIOD
+from .base_lock import BaseLock
+from .executor import use_pool
+from .heartbeat import HeartbeatRegistration, HeartbeatScheduler
+from .instrumentation import get_instrumentation
+from .pacing import AdaptivePeriod
+from .shared import DEFAULT_HEARTBEAT_PERIOD, THREAD_POOL_HEARTBEAT, monotonic
 
 
 class ContextManager:
@@ -12,40 +17,174 @@ class ContextManager:
     # Period to poll the heartbeat on
     __period: float
 
-    # The heartbeat task
-    __future: asyncio.Task
+    # The heartbeat task, or our registration's future if a scheduler runs the heartbeat
+    future: "asyncio.Future[None]"
+
+    # Set as soon as the heartbeat finds we've lost the lock
+    lost: asyncio.Event
 
     # Redis lock
-    __redis: AsyncLock
+    __redis: BaseLock
+
+    # Shared scheduler running our heartbeat, if any
+    __scheduler: Optional[HeartbeatScheduler]
+
+    # Our registration with the scheduler, while we hold the lock
+    __registration: Optional[HeartbeatRegistration]
+
+    # Whether to pace refreshes by their latency, rather than every `period` seconds
+    __adaptive: bool
+
+    # Called with the reason as soon as the heartbeat finds we've lost the lock
+    __on_lost: Optional[Callable[[Exception], None]]
+
+    # Whether to cancel the task running the protected block when we lose the lock
+    __cancel_on_loss: bool
+
+    # The task running the protected block, while we hold the lock
+    __task: "Optional[asyncio.Task[object]]"
+
+    # Why we lost the lock, if we have
+    __lost_reason: Optional[Exception]
+
+    # Whether we cancelled the protected block because we lost the lock
+    __cancelled: bool
 
-    def __init__(self, redis: AsyncLock, period: float = DEFAULT_HEARTBEAT_PERIOD):
+    # Whether the protected block has finished, so there's nothing left to cancel
+    __exiting: bool
+
+    def __init__(
+        self,
+        redis: BaseLock,
+        period: float = DEFAULT_HEARTBEAT_PERIOD,
+        scheduler: Optional[HeartbeatScheduler] = None,
+        adaptive: bool = False,
+        on_lost: Optional[Callable[[Exception], None]] = None,
+        cancel_on_loss: bool = False,
+    ):
         self.__period = period
         self.__redis = redis
+        self.__scheduler = scheduler
+        self.__registration = None
+        self.__adaptive = adaptive
+        self.__on_lost = on_lost
+        self.__cancel_on_loss = cancel_on_loss
+        self.__task = None
+        self.__lost_reason = None
+        self.__cancelled = False
+        self.__exiting = False
+
+    def __lose(self, reason: Exception) -> None:
+        """Tell the protected block we've lost the lock, so it stops working on it."""
+        if self.__lost_reason is not None:
+            return
+        self.__lost_reason = reason
+        self.lost.set()
+        if self.__on_lost is not None:
+            self.__on_lost(reason)
+        if self.__cancel_on_loss and not self.__exiting and self.__task is not None:
+            self.__cancelled = True
+            self.__task.cancel()
 
     async def __heartbeat(self) -> None:
-        """Refresh the Redis lock and go back to sleep."""
+        """Refresh the Redis lock and go back to sleep. The next refresh is due a period after we
+        sent this one, so time spent waiting on Redis doesn't push refreshes later and later. If
+        we find we've lost the lock, or can't reach Redis until it lapses, we stop and say so."""
+        key = self.__redis.key
+        lease = self.__redis.lease
+        pacer = AdaptivePeriod(self.__redis.lock_expiry) if self.__adaptive else None
+        due = monotonic()
         while True:
-            await self.__redis.set_expiration()
-            await asyncio.sleep(self.__period)
+            sent_at = monotonic()
+            get_instrumentation().heartbeat(key, sent_at - due)
+            try:
+                with use_pool(THREAD_POOL_HEARTBEAT):
+                    held = await asyncio.wait_for(
+                        self.__redis.set_expiration(), timeout=lease.refresh_timeout()
+                    )
+            except asyncio.CancelledError:
+                # Before Python 3.8, cancellation is an `Exception`; it's how `__aexit__` stops us
+                raise
+            except Exception:  # pylint: disable=broad-except
+                # We couldn't reach Redis in time. Keep trying until the lock would have lapsed.
+                if not lease.is_valid():
+                    get_instrumentation().lock_lost(key)
+                    self.__lose(Exception(f"{key} lost lock: it expired before refreshing."))
+                    return
+                due = sent_at + min(self.__period, lease.remaining())
+                await asyncio.sleep(max(due - monotonic(), 0.0))
+                continue
+
+            if held is not True:
+                get_instrumentation().lock_lost(key)
+                self.__lose(Exception(f"{key} lost lock while refreshing."))
+                return
+
+            period = self.__period
+            if pacer is not None:
+                pacer.observe(monotonic() - sent_at)
+                period = pacer.period()
+            due = sent_at + period
+            await asyncio.sleep(max(due - monotonic(), 0.0))
 
     async def __aenter__(self) -> None:
-        """Start the heartbeat. First, we set the Redis lock, then start the background task."""
+        """Start the heartbeat. First, we set the Redis lock, then start the background task, or
+        register with the shared scheduler if we were given one."""
         lock = await self.__redis.set_lock(value=True, nx=True)
         if lock is not True:
             raise Exception(f"Failed to get lock.")
 
-        self.future = asyncio.create_task(self.__heartbeat())
+        self.lost = asyncio.Event()
+        self.__task = asyncio.current_task()
+        self.__lost_reason = None
+        self.__cancelled = False
+        self.__exiting = False
+        if self.__redis.reentered:
+            # Whoever holds the lock outside us keeps it alive; don't refresh it twice.
+            self.future = asyncio.get_running_loop().create_future()
+        elif self.__scheduler is not None:
+            self.__registration = self.__scheduler.register(
+                self.__redis,
+                self.__period,
+                on_failure=lambda _, reason: self.__lose(reason),
+                adaptive=self.__adaptive,
+            )
+            self.future = self.__registration.future
+        else:
+            self.future = asyncio.create_task(self.__heartbeat())
 
     async def __aexit__(self, exc_type, exc, tb) -> None:
         """Stop the heartbeat task. We have to cancel the future, since it's on an infinite loop,
-        and then wait for it to finish."""
+        and then wait for it to finish. If we lost the lock while holding it, why is raised here,
+        in place of the cancellation if we cancelled the protected block."""
+        self.__exiting = True
+
         # First, stop the heartbeat
+        if self.__scheduler is not None and self.__registration is not None:
+            self.__scheduler.unregister(self.__registration)
+            self.__registration = None
         self.future.cancel()
         try:
             await self.future
         except asyncio.CancelledError:
             pass
+        except Exception as e:  # pylint: disable=broad-except
+            self.__lose(e)
 
         # We don't have to worry about closing Redis - the Redis library manages that for us. However,
         # we do need to release the lock.
-        await self.__redis.release()
+        reason, self.__task = self.__lost_reason, None
+        if reason is None:
+            await self.__redis.release()
+            return
+
+        try:
+            await self.__redis.release()
+        except Exception:  # pylint: disable=broad-except
+            # We already know we lost it
+            pass
+        if self.__cancelled:
+            task = asyncio.current_task()
+            if task is not None and hasattr(task, "uncancel"):
+                task.uncancel()
+        raise reason
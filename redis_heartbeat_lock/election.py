@@ -0,0 +1,332 @@
+"""Leader election: one process at a time leads, and a standby takes over as soon as it can.
+
+Leadership is an :class:`~redis_heartbeat_lock.async_lock.AsyncLock` on the election's key, held
+by a :class:`~redis_heartbeat_lock.context_manager.ContextManager` for as long as we lead. Standbys
+don't poll for it. In notify mode, they're woken as soon as the leader releases it, or, with
+keyspace notifications enabled, as soon as it expires. Otherwise, they sleep until the leader's
+lease would lapse if it stopped refreshing it, checking in at least every `notify_poll_rate`
+seconds. The leader names itself in a hash next to the lock, which the heartbeat keeps alive
+along with the lock, so anyone can ask who leads without campaigning, and a dead leader's name
+expires with its lock.
+"""
+
+import asyncio
+import contextlib
+import os
+import redis
+import socket
+from typing import Any, Callable, Dict, Optional, Union
+
+from .async_lock import AsyncLock
+from .backends import Backend, from_client, from_url
+from .cluster import related_key
+from .context_manager import ContextManager
+from .heartbeat import HeartbeatScheduler
+from .notifications import get_listener
+from .pool import get_registry
+from .shared import (
+    Command,
+    DEFAULT_HEARTBEAT_PERIOD,
+    DEFAULT_LOCK_CHECK_RATE,
+    DEFAULT_LOCK_EXPIRY,
+    DEFAULT_NOTIFY_POLL_RATE,
+    LEADER_KEY_SUFFIX,
+    WAIT_MODE_NOTIFY,
+    WAIT_MODE_POLL,
+)
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class _LeadershipLock(AsyncLock):
+    """The lock that is leadership, which also refreshes the hash naming the leader."""
+
+    # The hash naming the leader
+    __leader_key: str
+
+    def __init__(self, leader_key: str, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.__leader_key = leader_key
+
+    @property
+    def batched(self) -> bool:
+        """The hash is refreshed too, so the lock's own expiration command isn't enough."""
+        return False
+
+    async def set_expiration(self) -> bool:
+        held = await super().set_expiration()
+        if held:
+            await self.backend.call("pexpire", self.__leader_key, int(self.lock_expiry * 1000))
+        return held
+
+
+class LeaderElection:
+    """Campaigns for leadership of a key, and holds it until demoted or resigning."""
+
+    # The key whose lock is leadership
+    __key: str
+
+    # The backend executing our Redis commands
+    __backend: Backend
+
+    # Who we are, as reported to anyone asking who leads
+    __identity: str
+
+    # Expiration of the leadership lock, in seconds
+    __lock_expiry: int
+
+    # Period of the heartbeat keeping leadership while we lead
+    __period: float
+
+    # Shared scheduler running the heartbeat, if any
+    __scheduler: Optional[HeartbeatScheduler]
+
+    # Whether to pace the heartbeat by refresh latency
+    __adaptive: bool
+
+    # How standbys wait for leadership to come free
+    __wait_mode: str
+
+    # Rate at which standbys check for leadership in poll mode
+    __lock_check_rate: float
+
+    # In notify mode, the longest a standby waits without checking, in case it missed a release
+    __notify_poll_rate: float
+
+    # Called when we're elected, and when we stop leading, however that happens
+    __on_elected: Optional[Callable[[], None]]
+    __on_demoted: Optional[Callable[[], None]]
+
+    # While we lead: the lock, the context manager keeping it, and what closes the latter
+    __lock: Optional[AsyncLock]
+    __manager: Optional[ContextManager]
+    __stack: Optional[contextlib.AsyncExitStack]
+
+    # Whether we lead, as far as we know
+    __leading: bool
+
+    def __init__(
+        self,
+        key: str,
+        client: Union[redis.Redis, Backend, Any],
+        identity: Optional[str] = None,
+        lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        period: float = DEFAULT_HEARTBEAT_PERIOD,
+        scheduler: Optional[HeartbeatScheduler] = None,
+        adaptive: bool = False,
+        wait_mode: str = WAIT_MODE_NOTIFY,
+        lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+        on_elected: Optional[Callable[[], None]] = None,
+        on_demoted: Optional[Callable[[], None]] = None,
+    ):
+        if wait_mode not in (WAIT_MODE_POLL, WAIT_MODE_NOTIFY):
+            raise Exception(f"Unknown wait mode {wait_mode}.")
+
+        self.__key = key
+        self.__backend = from_client(client)
+        self.__identity = identity or f"{socket.gethostname()}:{os.getpid()}"
+        self.__lock_expiry = lock_expiry
+        self.__period = period
+        self.__scheduler = scheduler
+        self.__adaptive = adaptive
+        self.__wait_mode = wait_mode
+        self.__lock_check_rate = lock_check_rate
+        self.__notify_poll_rate = notify_poll_rate
+        self.__on_elected = on_elected
+        self.__on_demoted = on_demoted
+        self.__lock = None
+        self.__manager = None
+        self.__stack = None
+        self.__leading = False
+
+    @classmethod
+    async def create(
+        cls,
+        key: str,
+        url: str,
+        backend: Optional[str] = None,
+        share_client: bool = True,
+        **kwargs: Any,
+    ) -> "LeaderElection":
+        """Asynchronously create a Redis client and initialize the election. By default, standbys
+        are woken by release notifications; on a Redis Cluster, pass `wait_mode="poll"`."""
+        if share_client:
+            client = await get_registry().get(url, backend)
+        else:
+            client = await from_url(url, backend)
+        return cls(key, client, **kwargs)
+
+    @property
+    def key(self) -> str:
+        """The key whose lock is leadership."""
+        return self.__key
+
+    @property
+    def backend(self) -> Backend:
+        """The backend executing our Redis commands."""
+        return self.__backend
+
+    @property
+    def identity(self) -> str:
+        """Who we are, e.g. `host:pid` unless told otherwise."""
+        return self.__identity
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether we lead, as far as we know. Turns false as soon as the heartbeat finds we've
+        lost leadership."""
+        return self.__leading
+
+    @property
+    def lost(self) -> Optional[asyncio.Event]:
+        """While we lead, set as soon as we lose leadership."""
+        return self.__manager.lost if self.__manager is not None else None
+
+    @property
+    def fencing_token(self) -> Optional[int]:
+        """Our term's fencing counter while we lead. Each term gets a higher one than the last."""
+        return self.__lock.fencing_token if self.__lock is not None else None
+
+    def __leader_key(self) -> str:
+        return related_key(self.__key, LEADER_KEY_SUFFIX, self.__backend.cluster)
+
+    async def leader(self) -> Optional[str]:
+        """The identity of the current leader, without campaigning. `None` if nobody leads, or
+        leadership is changing hands."""
+        token, leader = await self.__backend.pipeline(
+            [Command("get", (self.__key,)), Command("hgetall", (self.__leader_key(),))]
+        )
+        for result in (token, leader):
+            if isinstance(result, Exception):
+                raise result
+        fields: Dict[str, str] = {_decode(k): _decode(v) for k, v in (leader or {}).items()}
+        if token is None or fields.get("token") != _decode(token):
+            return None
+        return fields.get("identity")
+
+    async def campaign(self) -> None:
+        """Wait until we're elected, and start the heartbeat keeping us leader. Returns straight
+        away if we already lead."""
+        if self.__leading:
+            return
+        # Clean up after a term we were demoted from
+        await self.resign()
+        async with contextlib.AsyncExitStack() as waiting:
+            signal = None
+            if self.__wait_mode == WAIT_MODE_NOTIFY:
+                # Subscribe before first trying, so we can't miss a release in between
+                signal = await waiting.enter_async_context(
+                    get_listener(self.__backend).subscribe(self.__key)
+                )
+            while not await self.__stand():
+                delay = await self.__until_free()
+                if signal is not None:
+                    await signal.wait(delay)
+                else:
+                    await asyncio.sleep(delay)
+
+    async def __stand(self) -> bool:
+        """Try for leadership once. Returns whether we were elected."""
+        lock = _LeadershipLock(
+            self.__leader_key(),
+            self.__key,
+            self.__backend,
+            0,
+            self.__lock_check_rate,
+            self.__lock_expiry,
+        )
+        manager = ContextManager(
+            lock,
+            period=self.__period,
+            scheduler=self.__scheduler,
+            adaptive=self.__adaptive,
+            on_lost=lambda _: self.__demote(),
+        )
+        stack = contextlib.AsyncExitStack()
+        try:
+            await stack.enter_async_context(manager)
+        except asyncio.CancelledError:
+            # Before Python 3.8, cancellation is an `Exception`; don't mistake it for a failure
+            raise
+        except Exception:  # pylint: disable=broad-except
+            # Someone else leads. If Redis failed us instead, asking how long they lead raises.
+            return False
+
+        self.__lock, self.__manager, self.__stack = lock, manager, stack
+        self.__leading = True
+        try:
+            leader_key = self.__leader_key()
+            mapping = {"token": lock.token or "", "identity": self.__identity}
+            results = await self.__backend.pipeline(
+                [
+                    Command("hset", (leader_key,), {"mapping": mapping}),
+                    Command("pexpire", (leader_key, int(self.__lock_expiry * 1000))),
+                ]
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        except BaseException:
+            await self.resign()
+            raise
+        if self.__on_elected is not None:
+            self.__on_elected()
+        return True
+
+    async def __until_free(self) -> float:
+        """How long to wait before trying again: until the leader's lease would lapse if it
+        stopped refreshing it, but no longer than we'd wait between checks anyway."""
+        longest = self.__lock_check_rate
+        if self.__wait_mode == WAIT_MODE_NOTIFY:
+            longest = self.__notify_poll_rate
+        ttl = await self.__backend.call("pttl", self.__key)
+        if ttl == -2:
+            # It's already free
+            return 0.0
+        if ttl < 0:
+            return longest
+        return min(ttl / 1000, longest)
+
+    def __demote(self) -> None:
+        if not self.__leading:
+            return
+        self.__leading = False
+        if self.__on_demoted is not None:
+            self.__on_demoted()
+
+    async def resign(self) -> None:
+        """Stop leading, if we do, and hand leadership to the next standby."""
+        stack, self.__stack = self.__stack, None
+        manager, self.__manager = self.__manager, None
+        self.__lock = None
+        if stack is None:
+            return
+        lost = manager is not None and manager.lost.is_set()
+        try:
+            if not lost:
+                await self.__backend.call("delete", self.__leader_key())
+        finally:
+            self.__demote()
+            try:
+                await stack.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                if not lost:
+                    raise
+                # We'd already lost leadership, and said so
+
+    async def run(self) -> None:
+        """Campaign, lead until demoted, and campaign again, until cancelled. Then resign."""
+        try:
+            while True:
+                await self.campaign()
+                lost = self.lost
+                if lost is not None:
+                    await lost.wait()
+                await self.resign()
+        finally:
+            await self.resign()
@@ -1,14 +1,209 @@
+"""Thread pools running the synchronous `redis-py` client for the thread-pool backend.
+
+There are two pools, created on first use: heartbeats run on their own small pool, so a burst of
+acquisitions queueing for threads can't hold up the refreshes keeping held locks alive, and
+everything else runs on the default pool. Either can be resized, or replaced with any
+:class:`concurrent.futures.Executor`, e.g. one shared with the rest of an application, and a single
+lock can be given its own executor instead.
+"""
+
+import contextlib
+import threading
+import time
+import asyncio
 from asyncio import wrap_future
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
 
-executor = ThreadPoolExecutor(max_workers=4)
+from .instrumentation import Instrumentation, get_instrumentation
+from .shared import (
+    DEFAULT_HEARTBEAT_THREAD_POOL_WORKERS,
+    DEFAULT_THREAD_POOL_WORKERS,
+    THREAD_POOL_DEFAULT,
+    THREAD_POOL_HEARTBEAT,
+)
 
+T = TypeVar("T")
 
-def run_sync_in_thread_pool(func, *args, **kwargs):
-    """Run a synchronous function on a thread-pool, and return a future
-    which yields the result of the function. """
+
+class ThreadPool(Executor):
+    """A thread pool that starts its threads on first use, and counts work waiting for one."""
+
+    # Name of the pool, used to name its threads
+    __name: str
+
+    # Most threads the pool will run
+    __max_workers: int
+
+    # The underlying executor, once we've needed it
+    __executor: Optional[ThreadPoolExecutor]
+
+    # Guards the executor and the counters
+    __lock: threading.Lock
+
+    # Functions submitted, but not yet started
+    __queued: int
+
+    # Functions running
+    __running: int
+
+    def __init__(self, name: str, max_workers: int):
+        self.__name = name
+        self.__max_workers = max_workers
+        self.__executor = None
+        self.__lock = threading.Lock()
+        self.__queued = 0
+        self.__running = 0
+
+    @property
+    def name(self) -> str:
+        """Name of the pool, e.g. `heartbeat`."""
+        return self.__name
+
+    @property
+    def max_workers(self) -> int:
+        """Most threads the pool will run."""
+        return self.__max_workers
+
+    @property
+    def queue_depth(self) -> int:
+        """Functions waiting for a free thread."""
+        return self.__queued
+
+    @property
+    def running(self) -> int:
+        """Functions running on the pool's threads."""
+        return self.__running
+
+    # The leading underscores make `__fn` positional-only, as it is in `Executor.submit`
+    def submit(self, __fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        def _run() -> T:
+            with self.__lock:
+                self.__queued -= 1
+                self.__running += 1
+            try:
+                return __fn(*args, **kwargs)
+            finally:
+                with self.__lock:
+                    self.__running -= 1
+
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.__max_workers,
+                    thread_name_prefix=f"redis-heartbeat-lock-{self.__name}",
+                )
+            self.__queued += 1
+            try:
+                return self.__executor.submit(_run)
+            except BaseException:
+                self.__queued -= 1
+                raise
+
+    def resize(self, max_workers: int) -> None:
+        """Run at most `max_workers` threads from now on. Work already submitted finishes on the
+        old threads."""
+        with self.__lock:
+            self.__max_workers = max_workers
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def shutdown(self, wait: bool = True, **kwargs: Any) -> None:
+        """Stop the pool's threads. The pool starts new ones if it's used again."""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+# Pool name -> executor
+_pools: Dict[str, Executor] = {
+    THREAD_POOL_DEFAULT: ThreadPool(THREAD_POOL_DEFAULT, DEFAULT_THREAD_POOL_WORKERS),
+    THREAD_POOL_HEARTBEAT: ThreadPool(
+        THREAD_POOL_HEARTBEAT, DEFAULT_HEARTBEAT_THREAD_POOL_WORKERS
+    ),
+}
+
+# The default pool, under the name earlier releases exported it by. It isn't updated by
+# `set_executor`; use `get_executor` instead
+executor = _pools[THREAD_POOL_DEFAULT]
+
+# The pool work submitted from the current context runs on
+_current_pool: "ContextVar[str]" = ContextVar(
+    "redis_heartbeat_lock_pool", default=THREAD_POOL_DEFAULT
+)
+
+
+def get_executor(name: str = THREAD_POOL_DEFAULT) -> Executor:
+    """Get the named pool, e.g. to check its queue depth."""
+    return _pools[name]
+
+
+def set_executor(executor: Executor, name: str = THREAD_POOL_DEFAULT) -> Executor:
+    """Run the named pool's work on the given executor from now on. Returns the executor it
+    replaces, which is left running; shut it down once its work is done."""
+    if name not in _pools:
+        raise Exception(f"Unknown thread pool {name}.")
+    previous, _pools[name] = _pools[name], executor
+    return previous
+
+
+def configure(
+    max_workers: Optional[int] = None, heartbeat_max_workers: Optional[int] = None
+) -> None:
+    """Resize our own pools. Executors set with :func:`set_executor` are left alone."""
+    sizes = {THREAD_POOL_DEFAULT: max_workers, THREAD_POOL_HEARTBEAT: heartbeat_max_workers}
+    for name, size in sizes.items():
+        pool = _pools[name]
+        if size is not None and isinstance(pool, ThreadPool):
+            pool.resize(size)
+
+
+def shutdown(wait: bool = True) -> None:
+    """Stop the threads of every pool, e.g. when shutting down."""
+    for pool in _pools.values():
+        pool.shutdown(wait=wait)
+
+
+@contextlib.contextmanager
+def use_pool(name: str) -> Iterator[None]:
+    """Run work submitted from within the block, including from tasks started in it, on the named
+    pool."""
+    token = _current_pool.set(name)
+    try:
+        yield
+    finally:
+        _current_pool.reset(token)
+
+
+def run_in_executor(
+    executor: Executor, func: Callable[..., T], *args: Any, **kwargs: Any
+) -> "asyncio.Future[T]":
+    """Run a synchronous function on the given executor, and return an asyncio future which
+    yields the result of the function."""
 
     # executor.submit runs a sync function on a thread pool, as shown at:
     #     https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor-example.
     # wrap_future converts from a concurrent.futures.Future to an asyncio.Future.
-    return wrap_future(executor.submit(func, *args, **kwargs))
+    instrumentation = get_instrumentation()
+    if type(instrumentation) is Instrumentation:
+        return wrap_future(executor.submit(func, *args, **kwargs))
+
+    # Someone's listening, so time how long the function waits for a free thread
+    submitted_at = time.monotonic()
+
+    def timed() -> T:
+        instrumentation.executor_queue_delay(time.monotonic() - submitted_at)
+        return func(*args, **kwargs)
+
+    return wrap_future(executor.submit(timed))
+
+
+def run_sync_in_thread_pool(
+    func: Callable[..., T], *args: Any, **kwargs: Any
+) -> "asyncio.Future[T]":
+    """Run a synchronous function on a thread-pool, and return a future
+    which yields the result of the function. Which pool depends on :func:`use_pool`."""
+    return run_in_executor(_pools[_current_pool.get()], func, *args, **kwargs)
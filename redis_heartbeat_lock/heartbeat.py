@@ -0,0 +1,226 @@
+"""A process-wide heartbeat scheduler, refreshing many locks from a single task.
+
+Rather than each :class:`~redis_heartbeat_lock.context_manager.ContextManager` running its own
+heartbeat task and sending its own `EXPIRE`, locks register with a :class:`HeartbeatScheduler`.
+Every tick, the scheduler collects the refreshes that are due and sends them in one pipelined
+round-trip per backend. Locks that fail to refresh are reported back to their owners.
+"""
+
+import asyncio
+import logging
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+from .base_lock import BaseLock
+from .backends import Backend
+from .executor import use_pool
+from .instrumentation import get_instrumentation
+from .pacing import AdaptivePeriod
+from .shared import (
+    DEFAULT_HEARTBEAT_PERIOD,
+    DEFAULT_HEARTBEAT_TICK,
+    THREAD_POOL_HEARTBEAT,
+    monotonic,
+)
+
+_logger = logging.getLogger(__name__)
+
+
+class HeartbeatRegistration:
+    """A lock registered with a :class:`HeartbeatScheduler`."""
+
+    # The lock to refresh
+    lock: BaseLock
+
+    # Seconds between refreshes
+    period: float
+
+    # Paces refreshes by their latency instead, if the lock's heartbeat is adaptive
+    pacer: Optional[AdaptivePeriod]
+
+    # When the next refresh is due, on the monotonic clock
+    next_due: float
+
+    # Pending while the lock is refreshed. Fails with the reason if a refresh fails, and is
+    # cancelled when the lock is unregistered.
+    future: "asyncio.Future[None]"
+
+    # Called with the registration and the reason if a refresh fails
+    on_failure: Optional[Callable[["HeartbeatRegistration", Exception], None]]
+
+    def __init__(
+        self,
+        lock: BaseLock,
+        period: float,
+        future: "asyncio.Future[None]",
+        on_failure: Optional[Callable[["HeartbeatRegistration", Exception], None]],
+        pacer: Optional[AdaptivePeriod] = None,
+    ):
+        self.lock = lock
+        self.period = period
+        self.pacer = pacer
+        self.next_due = monotonic() + (period if pacer is None else pacer.period())
+        self.future = future
+        self.on_failure = on_failure
+
+    def fail(self, reason: Exception) -> None:
+        """Tell the lock's owner that it failed to refresh."""
+        if self.future.done():
+            return
+        self.future.set_exception(reason)
+        if self.on_failure is not None:
+            try:
+                self.on_failure(self, reason)
+            except Exception:  # pylint: disable=broad-except
+                # A failing callback mustn't stop the scheduler refreshing every other lock
+                _logger.exception("Heartbeat failure callback for %s raised.", self.lock.key)
+
+
+class HeartbeatScheduler:
+    """Refreshes every registered lock from one task, batching the refreshes due each tick into a
+    single pipelined round-trip per backend."""
+
+    # How often we check for due refreshes
+    __tick: float
+
+    # Registered locks, in registration order
+    __registrations: Dict[int, HeartbeatRegistration]
+
+    # The scheduling task, running while any locks are registered
+    __task: Optional["asyncio.Task[None]"]
+
+    def __init__(self, tick: float = DEFAULT_HEARTBEAT_TICK):
+        self.__tick = tick
+        self.__registrations = {}
+        self.__task = None
+
+    def __len__(self) -> int:
+        return len(self.__registrations)
+
+    def register(
+        self,
+        lock: BaseLock,
+        period: float = DEFAULT_HEARTBEAT_PERIOD,
+        on_failure: Optional[Callable[[HeartbeatRegistration, Exception], None]] = None,
+        adaptive: bool = False,
+    ) -> HeartbeatRegistration:
+        """Start refreshing the given lock every `period` seconds, or if `adaptive`, as often as
+        recent refresh latency calls for. The lock must already be held."""
+        future = asyncio.get_running_loop().create_future()
+        pacer = AdaptivePeriod(lock.lock_expiry) if adaptive else None
+        registration = HeartbeatRegistration(lock, period, future, on_failure, pacer)
+        self.__registrations[id(registration)] = registration
+        if self.__task is None or self.__task.done():
+            self.__task = asyncio.create_task(self.__run())
+        return registration
+
+    def unregister(self, registration: HeartbeatRegistration) -> None:
+        """Stop refreshing the given lock."""
+        self.__registrations.pop(id(registration), None)
+        if not registration.future.done():
+            registration.future.cancel()
+
+    async def __run(self) -> None:
+        while self.__registrations:
+            await asyncio.sleep(self.__tick)
+            await self.beat()
+
+    async def beat(self) -> None:
+        """Refresh every lock due by the next tick. Refreshing a little early lets us batch more
+        locks together, and is always safe. Locks that can't be batched are refreshed alongside
+        the batches."""
+        horizon = monotonic() + self.__tick
+        batches: Dict[int, List[HeartbeatRegistration]] = {}
+        backends: Dict[int, Backend] = {}
+        unbatched: List[HeartbeatRegistration] = []
+        for registration in list(self.__registrations.values()):
+            if registration.next_due > horizon:
+                continue
+            if not registration.lock.batched:
+                unbatched.append(registration)
+                continue
+            backend = registration.lock.backend
+            batches.setdefault(id(backend), []).append(registration)
+            backends[id(backend)] = backend
+
+        # Refreshes run on the heartbeat thread pool, so acquisitions can't hold them up
+        with use_pool(THREAD_POOL_HEARTBEAT):
+            await asyncio.gather(
+                *[self.__refresh(backends[bid], batch) for bid, batch in batches.items()],
+                *[self.__refresh(None, [registration]) for registration in unbatched],
+            )
+
+    async def __send(
+        self, backend: Optional[Backend], batch: List[HeartbeatRegistration]
+    ) -> List[Any]:
+        """Send the batch's refreshes in one round-trip, or have a lone lock that can't be batched
+        refresh itself."""
+        if backend is None:
+            return [await batch[0].lock.set_expiration()]
+        return await backend.pipeline([r.lock.expiration_command() for r in batch])
+
+    async def __refresh(
+        self, backend: Optional[Backend], batch: List[HeartbeatRegistration]
+    ) -> None:
+        sent_at = monotonic()
+        instrumentation = get_instrumentation()
+        for registration in batch:
+            instrumentation.heartbeat(registration.lock.key, sent_at - registration.next_due)
+        # Don't wait on Redis past the point where the first of these locks would lapse
+        timeout = min(r.lock.lease.refresh_timeout() for r in batch)
+        try:
+            results = await asyncio.wait_for(self.__send(backend, batch), timeout=timeout)
+        except asyncio.CancelledError:
+            # Before Python 3.8, cancellation is an `Exception`; don't mistake it for a failure
+            raise
+        except Exception:
+            # The whole round-trip failed or timed out, e.g. we lost our connection. Retry on the
+            # next tick; the locks' expiry gives us some slack. Locks that have lapsed meanwhile are
+            # lost, whether or not anyone has taken them yet.
+            for registration in batch:
+                lapsed = not registration.lock.lease.is_valid()
+                if id(registration) in self.__registrations and lapsed:
+                    key = registration.lock.key
+                    instrumentation.lock_lost(key)
+                    registration.fail(Exception(f"{key} lost lock: it expired before refreshing."))
+                    self.unregister(registration)
+            return
+
+        latency = monotonic() - sent_at
+        for registration, result in zip(batch, results):
+            if id(registration) not in self.__registrations:
+                # Unregistered while we were refreshing
+                continue
+            if registration.pacer is not None:
+                registration.pacer.observe(latency)
+                registration.next_due = sent_at + registration.pacer.period()
+            else:
+                registration.next_due = sent_at + registration.period
+            if isinstance(result, Exception):
+                instrumentation.lock_lost(registration.lock.key)
+                registration.fail(result)
+                self.unregister(registration)
+                continue
+            if backend is not None:
+                # Unbatched locks have already recorded their refresh
+                result = registration.lock.expiration_set(result, sent_at)
+            if result is not True:
+                instrumentation.lock_lost(registration.lock.key)
+                registration.fail(Exception(f"{registration.lock.key} lost lock while refreshing."))
+                self.unregister(registration)
+
+
+# Event loop -> its process-wide scheduler
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, HeartbeatScheduler]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_scheduler() -> HeartbeatScheduler:
+    """Get the process-wide heartbeat scheduler for the running event loop."""
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        scheduler = HeartbeatScheduler()
+        _schedulers[loop] = scheduler
+    return scheduler
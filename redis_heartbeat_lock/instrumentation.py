@@ -0,0 +1,233 @@
+"""Measurements of how our locks behave under load: how long acquisitions take and how many attempts
+they need, how late heartbeats fire, how long locks are held, and how long work waits for our thread
+pool.
+
+Locks report to the process-wide :class:`Instrumentation`, which by default throws everything away.
+Install an :class:`InMemoryInstrumentation` to keep per-key histograms, e.g. to find hot keys or to
+tune lock expiry and heartbeat periods.
+"""
+
+import bisect
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+# Histogram bucket upper bounds for durations, in seconds: 100us up to ~100s, doubling each time
+DURATION_BUCKETS: List[float] = [0.0001 * 2 ** i for i in range(21)]
+
+# Histogram bucket upper bounds for attempt counts
+ATTEMPT_BUCKETS: List[float] = [1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144]
+
+# Name we file measurements under once we're tracking as many keys as we're allowed
+OTHER_KEY = "<other>"
+
+
+class Instrumentation:
+    """Receives measurements from locks. Every method does nothing; subclass it to record them.
+    Methods may be called from any thread, and must be cheap."""
+
+    def acquisition(self, key: str, latency: float, attempts: int, acquired: bool) -> None:
+        """A call to `set_lock` finished after `latency` seconds and `attempts` tries."""
+
+    def heartbeat(self, key: str, lateness: float) -> None:
+        """A heartbeat fired `lateness` seconds after it was due."""
+
+    def hold(self, key: str, duration: float) -> None:
+        """A lock was released after being held for `duration` seconds, whether or not we found
+        we'd lost it by then."""
+
+    def lock_lost(self, key: str) -> None:
+        """We found out a lock we thought we held isn't ours any more."""
+
+    def executor_queue_delay(self, delay: float) -> None:
+        """A function waited `delay` seconds in our thread pool's queue before starting."""
+
+
+class HistogramSummary(NamedTuple):
+    """A snapshot of a histogram."""
+
+    samples: int
+    sum: float
+    min: float
+    max: float
+    p50: float
+    p90: float
+    p99: float
+
+
+class Histogram:
+    """A thread-safe histogram with fixed buckets. Quantiles are estimated by interpolating within
+    the bucket they fall in."""
+
+    # Upper bound of each bucket; the last bucket is unbounded
+    bounds: List[float]
+
+    # Observations in each bucket, with one more for values above the last bound
+    counts: List[int]
+
+    samples: int
+    sum: float
+    min: float
+    max: float
+
+    def __init__(self, bounds: Sequence[float] = DURATION_BUCKETS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.samples = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.__lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self.__lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.samples += 1
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    def add(self, other: "Histogram") -> None:
+        """Fold every observation of another histogram, with the same buckets, into this one."""
+        if other.bounds != self.bounds:
+            raise Exception("Can't add histograms with different buckets.")
+        with other.__lock:
+            counts, samples, total = list(other.counts), other.samples, other.sum
+            low, high = other.min, other.max
+        with self.__lock:
+            self.counts = [mine + theirs for mine, theirs in zip(self.counts, counts)]
+            self.samples += samples
+            self.sum += total
+            self.min = min(self.min, low)
+            self.max = max(self.max, high)
+
+    def quantile(self, q: float) -> float:
+        """Estimate the value below which the fraction `q` of observations fall."""
+        with self.__lock:
+            if self.samples == 0:
+                return 0.0
+            rank = q * self.samples
+            seen = 0
+            for i, bucket_count in enumerate(self.counts):
+                if bucket_count and seen + bucket_count >= rank:
+                    lower = max(self.bounds[i - 1] if i > 0 else 0.0, self.min)
+                    upper = min(self.bounds[i] if i < len(self.bounds) else self.max, self.max)
+                    return lower + (upper - lower) * (rank - seen) / bucket_count
+                seen += bucket_count
+            return self.max
+
+    def summary(self) -> HistogramSummary:
+        return HistogramSummary(
+            samples=self.samples,
+            sum=self.sum,
+            min=self.min if self.samples else 0.0,
+            max=self.max if self.samples else 0.0,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+        )
+
+
+class KeyStats:
+    """Every histogram we keep for one key."""
+
+    def __init__(self):
+        self.acquisition_latency = Histogram(DURATION_BUCKETS)
+        self.acquisition_attempts = Histogram(ATTEMPT_BUCKETS)
+        self.acquisitions = 0
+        self.failed_acquisitions = 0
+        self.heartbeat_lateness = Histogram(DURATION_BUCKETS)
+        self.hold_duration = Histogram(DURATION_BUCKETS)
+        self.locks_lost = 0
+
+    @property
+    def held(self) -> int:
+        """Acquisitions not yet released. Every release records a hold, even of a lock we'd lost."""
+        return max(self.acquisitions - self.hold_duration.samples, 0)
+
+    @property
+    def contended(self) -> int:
+        """Calls to `set_lock` that needed more than one attempt."""
+        return self.acquisition_attempts.samples - self.acquisition_attempts.counts[0]
+
+
+class InMemoryInstrumentation(Instrumentation):
+    """Keeps histograms per key, in memory. To bound memory, once `max_keys` keys are tracked, any
+    new keys are filed together under `<other>`."""
+
+    # Key -> its stats
+    keys: Dict[str, KeyStats]
+
+    # Time functions spent queued for our thread pool
+    executor_delay: Histogram
+
+    def __init__(self, max_keys: int = 1000):
+        self.keys = {}
+        self.executor_delay = Histogram(DURATION_BUCKETS)
+        self.__max_keys = max_keys
+        self.__lock = threading.Lock()
+
+    def stats(self, key: str) -> KeyStats:
+        """Get the stats we're keeping for the given key."""
+        stats = self.keys.get(key)
+        if stats is None:
+            with self.__lock:
+                if key not in self.keys and len(self.keys) >= self.__max_keys:
+                    key = OTHER_KEY
+                stats = self.keys.setdefault(key, KeyStats())
+        return stats
+
+    def acquisition(self, key: str, latency: float, attempts: int, acquired: bool) -> None:
+        stats = self.stats(key)
+        stats.acquisition_latency.observe(latency)
+        stats.acquisition_attempts.observe(attempts)
+        if acquired:
+            stats.acquisitions += 1
+        else:
+            stats.failed_acquisitions += 1
+
+    def heartbeat(self, key: str, lateness: float) -> None:
+        self.stats(key).heartbeat_lateness.observe(max(lateness, 0.0))
+
+    def hold(self, key: str, duration: float) -> None:
+        self.stats(key).hold_duration.observe(duration)
+
+    def lock_lost(self, key: str) -> None:
+        self.stats(key).locks_lost += 1
+
+    def executor_queue_delay(self, delay: float) -> None:
+        self.executor_delay.observe(delay)
+
+    def hot_keys(self, n: int = 10) -> List[str]:
+        """The `n` keys we've spent the most time acquiring."""
+        ranked = sorted(
+            self.keys.items(), key=lambda item: item[1].acquisition_latency.sum, reverse=True
+        )
+        return [key for key, _ in ranked[:n]]
+
+
+# The process-wide instrumentation locks report to
+_instrumentation: Instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    """Get the process-wide instrumentation."""
+    return _instrumentation
+
+
+def end_hold(key: str, acquired_at: Optional[float], now: float, released: bool) -> None:
+    """Record the end of a hold on a lock acquired at `acquired_at`, if we'd acquired it, on the
+    same clock as `now`, and whether we'd lost the lock before `released` it."""
+    instrumentation = get_instrumentation()
+    # Our hold ends here, even if we find we'd already lost the lock
+    if acquired_at is not None:
+        instrumentation.hold(key, now - acquired_at)
+    if not released:
+        instrumentation.lock_lost(key)
+
+
+def set_instrumentation(instrumentation: Optional[Instrumentation]) -> Instrumentation:
+    """Install the process-wide instrumentation, or the no-op default if given `None`. Returns the
+    installed instrumentation."""
+    global _instrumentation
+    _instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+    return _instrumentation
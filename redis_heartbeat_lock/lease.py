@@ -0,0 +1,66 @@
+"""Client-side estimates of how long we can still count on holding a lock.
+
+Redis expires a lock a fixed time after it last took our `SET` or refresh, on its own clock. We
+can't see that clock, but we know it can't have started counting before we sent the command, so
+timing from our send on the monotonic clock gives a safe estimate that wall-clock jumps (NTP
+corrections, VMs resuming) can't disturb. Checking a :class:`Lease` costs no round-trip, so hot
+loops can check it before every side effect.
+"""
+
+from typing import Optional
+
+from .shared import DEFAULT_LEASE_DRIFT, DEFAULT_LEASE_DRIFT_FACTOR, monotonic
+
+
+class Lease:
+    """How long we can count on holding a lock, from when we sent the commands that set it."""
+
+    # How long the lock lasts after each acquisition or refresh, in seconds
+    __expiry: float
+
+    # Allowance for Redis's clock running faster than ours, in seconds
+    __drift: float
+
+    # When we can no longer count on the lock, on the monotonic clock, if we hold it
+    __expires_at: Optional[float]
+
+    def __init__(
+        self,
+        expiry: float,
+        drift_factor: float = DEFAULT_LEASE_DRIFT_FACTOR,
+        drift: float = DEFAULT_LEASE_DRIFT,
+    ):
+        self.__expiry = expiry
+        self.__drift = expiry * drift_factor + drift
+        self.__expires_at = None
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        """When we can no longer count on the lock, on the monotonic clock, if we hold it."""
+        return self.__expires_at
+
+    def renewed(self, sent_at: float) -> None:
+        """Record that Redis took a command setting or refreshing the lock, which we sent at
+        `sent_at` on the monotonic clock."""
+        self.__expires_at = sent_at + self.__expiry - self.__drift
+
+    def end(self) -> None:
+        """Record that we no longer hold the lock."""
+        self.__expires_at = None
+
+    def remaining(self) -> float:
+        """Seconds we can still count on holding the lock, or 0 if we can't."""
+        if self.__expires_at is None:
+            return 0.0
+        return max(self.__expires_at - monotonic(), 0.0)
+
+    def is_valid(self, margin: float = 0.0) -> bool:
+        """Whether we can count on holding the lock for more than another `margin` seconds."""
+        return self.remaining() > margin
+
+    def refresh_timeout(self) -> float:
+        """How long to wait on a refresh: until the lease runs out, or if it already has, e.g.
+        because acquiring the lock was slow, a whole expiry, since Redis may yet confirm we still
+        hold the lock."""
+        remaining = self.remaining()
+        return remaining if remaining > 0 else self.__expiry
@@ -0,0 +1,125 @@
+"""Coalesces locks on the same key within a process.
+
+Without coordination, every coroutine wanting a key polls Redis for it separately, even when the
+holder is another coroutine in the same process. With `local_first=True`, an
+:class:`~redis_heartbeat_lock.async_lock.AsyncLock` first queues for its key in the process's
+:class:`LocalLockTable`, and only goes to Redis once it's at the front. So at most one acquisition,
+and one heartbeat, per key is ever in flight from a process, and local waiters take the lock in the
+order they asked for it. A task that already holds a key can take it again without touching Redis.
+"""
+
+import asyncio
+import weakref
+from typing import Dict, Optional
+
+from .backends import Backend
+from .lease import Lease
+
+
+class LocalHold:
+    """The process's claim on one key: who holds it, and who's queued behind them."""
+
+    # Acquired by whichever local lock is taking or holding the key; waiters queue on it in order
+    gate: asyncio.Lock
+
+    # The task holding the key, once it has it in Redis
+    owner: "Optional[asyncio.Task[object]]"
+
+    # The holder's owner token, fencing counter and lease, shared with re-entrant holders
+    token: Optional[str]
+    fencing_token: Optional[int]
+    lease: Optional[Lease]
+
+    # How many times the owning task holds the key
+    depth: int
+
+    # Locks waiting for or holding the key, so we know when to forget it
+    users: int
+
+    def __init__(self):
+        self.gate = asyncio.Lock()
+        self.owner = None
+        self.token = None
+        self.fencing_token = None
+        self.lease = None
+        self.depth = 0
+        self.users = 0
+
+
+class LocalLockTable:
+    """Every key a process is waiting for or holding, for one event loop."""
+
+    # Backend -> key -> the process's claim on it
+    __holds: "weakref.WeakKeyDictionary[Backend, Dict[str, LocalHold]]"
+
+    def __init__(self):
+        self.__holds = weakref.WeakKeyDictionary()
+
+    def __len__(self) -> int:
+        return sum(len(holds) for holds in self.__holds.values())
+
+    def reenter(self, backend: Backend, key: str) -> Optional[LocalHold]:
+        """If the running task already holds the key, take it again and return the hold."""
+        hold = self.__holds.get(backend, {}).get(key)
+        if hold is None or hold.owner is None or hold.owner is not asyncio.current_task():
+            return None
+        hold.depth += 1
+        return hold
+
+    async def wait(self, backend: Backend, key: str, timeout: float) -> Optional[LocalHold]:
+        """Wait up to `timeout` seconds for our turn at the key. Returns the hold, for us to take
+        the key in Redis, or `None` if we timed out."""
+        hold = self.__holds.setdefault(backend, {}).setdefault(key, LocalHold())
+        hold.users += 1
+        try:
+            await asyncio.wait_for(hold.gate.acquire(), timeout=max(timeout, 0.0))
+        except asyncio.TimeoutError:
+            self.__forget(backend, key, hold)
+            return None
+        return hold
+
+    def taken(
+        self,
+        hold: LocalHold,
+        token: Optional[str],
+        fencing_token: Optional[int],
+        lease: Optional[Lease] = None,
+    ) -> None:
+        """Record that the running task took the key in Redis."""
+        hold.owner = asyncio.current_task()
+        hold.token = token
+        hold.fencing_token = fencing_token
+        hold.lease = lease
+        hold.depth = 1
+
+    def leave(self, backend: Backend, key: str, hold: LocalHold) -> None:
+        """Give up our turn at the key, whether or not we took it, and let the next waiter go."""
+        hold.owner = None
+        hold.token = None
+        hold.fencing_token = None
+        hold.lease = None
+        hold.depth = 0
+        hold.gate.release()
+        self.__forget(backend, key, hold)
+
+    def __forget(self, backend: Backend, key: str, hold: LocalHold) -> None:
+        hold.users -= 1
+        holds = self.__holds.get(backend)
+        if hold.users == 0 and holds is not None and holds.get(key) is hold:
+            del holds[key]
+
+
+# Event loop -> its lock table
+_tables: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LocalLockTable]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_local_table() -> LocalLockTable:
+    """Get the process's lock table for the running event loop."""
+    loop = asyncio.get_running_loop()
+    table = _tables.get(loop)
+    if table is None:
+        table = LocalLockTable()
+        _tables[loop] = table
+    return table
@@ -0,0 +1,192 @@
+"""A lock over a set of keys, acquired, refreshed and released atomically in one round-trip.
+
+On a Redis Cluster, a script can only touch keys in one hash slot, so the keys must share a hash
+tag, e.g. `{dataset:1}:partition:1` and `{dataset:1}:partition:2`.
+"""
+
+import redis
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from .backends import Backend, from_client
+from .base_lock import BaseLock, retry_acquisition
+from .cluster import check_same_slot, related_key
+from .notifications import get_listener
+from .scripts import ACQUIRE_ALL, EXTEND_ALL, RELEASE_ALL
+from .shared import (
+    Command,
+    DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+    DEFAULT_LOCK_CHECK_RATE,
+    DEFAULT_LOCK_EXPIRY,
+    DEFAULT_NOTIFY_POLL_RATE,
+    FENCE_KEY_SUFFIX,
+    RELEASE_CHANNEL_PREFIX,
+    WAIT_MODE_NOTIFY,
+    WAIT_MODE_POLL,
+    monotonic,
+    new_owner_token,
+)
+
+
+class MultiAsyncLock(BaseLock):
+    """Locks every one of a set of keys, or none of them. Each operation is a single Lua script,
+    so latency doesn't grow with the number of keys."""
+
+    # The keys to lock on
+    __keys: List[str]
+
+    # Each key's fencing counter, in the same order
+    __fence_keys: List[str]
+
+    # Timeout when acquiring the lock
+    __lock_acquisition_timeout: float
+
+    # Rate at which to check lock when acquiring it
+    __lock_check_rate: float
+
+    # How we wait for held keys to be released
+    __wait_mode: str
+
+    # In notify mode, rate at which to check the lock in case we missed a release notification
+    __notify_poll_rate: float
+
+    # Key -> fencing counter for our current acquisition
+    __fencing_tokens: Dict[str, int]
+
+    # Attempts made by the current call to `set_lock`
+    __attempts: int
+
+    def __init__(
+        self,
+        keys: Sequence[str],
+        client: Union[redis.Redis, Backend, Any],
+        lock_acquisition_timeout: float,
+        lock_check_rate: float,
+        lock_expiry: int,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+    ):
+        if not keys:
+            raise Exception("Need at least one key to lock on.")
+        if wait_mode not in (WAIT_MODE_POLL, WAIT_MODE_NOTIFY):
+            raise Exception(f"Unknown wait mode {wait_mode}.")
+
+        # Sort the keys, so error messages and scripts see them in a stable order
+        self.__keys = sorted(set(keys))
+        # A name for the lock: every key, comma-separated
+        super().__init__(",".join(self.__keys), from_client(client), lock_expiry)
+        # Each key's fencing counter, shared with an `AsyncLock` on that key alone
+        self.__fence_keys = [
+            related_key(key, FENCE_KEY_SUFFIX, self.backend.cluster) for key in self.__keys
+        ]
+        if self.backend.cluster:
+            # The acquisition script also updates each key's fencing counter
+            check_same_slot(self.__keys + self.__fence_keys)
+        self.__lock_acquisition_timeout = lock_acquisition_timeout
+        self.__lock_check_rate = lock_check_rate
+        self.__wait_mode = wait_mode
+        self.__notify_poll_rate = notify_poll_rate
+        self.__fencing_tokens = {}
+        self.__attempts = 0
+
+    @classmethod
+    async def create(
+        cls,
+        keys: Sequence[str],
+        url: str,
+        lock_acquisition_timeout: float = DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+        lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
+        lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        backend: Optional[str] = None,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+        share_client: bool = True,
+    ) -> "MultiAsyncLock":
+        """Asynchronously create a Redis client and initialize the wrapper class. Takes the same
+        options as :meth:`AsyncLock.create`."""
+        return cls(
+            keys,
+            await cls._connect(url, backend, share_client),
+            lock_acquisition_timeout,
+            lock_check_rate,
+            lock_expiry,
+            wait_mode=wait_mode,
+            notify_poll_rate=notify_poll_rate,
+        )
+
+    @property
+    def keys(self) -> List[str]:
+        """The keys we lock on."""
+        return list(self.__keys)
+
+    @property
+    def fencing_tokens(self) -> Dict[str, int]:
+        """Each key's fencing counter for our current acquisition, if we've taken the keys."""
+        return dict(self.__fencing_tokens)
+
+    async def __set(self, value: Any, nx: bool) -> bool:
+        self.__attempts += 1
+        token = new_owner_token()
+        sent_at = monotonic()
+        ret = await self.backend.run_script(
+            ACQUIRE_ALL,
+            self.__keys + self.__fence_keys,
+            [token, self.lock_expiry * 1000, 1 if nx else 0],
+        )
+        if not ret:
+            return False
+
+        self._taken(token, sent_at)
+        self.__fencing_tokens = {key: int(fence) for key, fence in zip(self.__keys, ret)}
+        return True
+
+    async def set_lock(self, value: Any, nx: bool = False) -> bool:
+        """Try to set every key until we timeout. Either all keys are set, or none are. Like
+        :meth:`AsyncLock.set_lock`, every key's value is a token unique to this acquisition."""
+        started_at = monotonic()
+        self.__attempts = 0
+        timeout = self.__lock_acquisition_timeout
+        if nx and self.__wait_mode == WAIT_MODE_NOTIFY:
+            async with get_listener(self.backend).subscribe(*self.__keys) as signal:
+                set_lock = await retry_acquisition(
+                    lambda: self.__set(value, nx), timeout, lambda: self.__notify_poll_rate, signal
+                )
+        else:
+            set_lock = await retry_acquisition(
+                lambda: self.__set(value, nx), timeout, lambda: self.__lock_check_rate
+            )
+
+        self._acquired(started_at, self.__attempts, set_lock is True)
+        return set_lock
+
+    def expiration_command(self) -> Command:
+        """The command refreshing every key's expiration, so it can be batched with other locks'.
+        It only extends keys that still hold our token."""
+        self._refresh_made()
+        return EXTEND_ALL.command(self.__keys, [self.token or "", self.lock_expiry * 1000])
+
+    def _still_held(self, result: Any) -> bool:
+        """We only hold the lock while we hold every key."""
+        return result == len(self.__keys)
+
+    async def set_expiration(self) -> bool:
+        """Set the expiration on every key we still hold, in one round-trip. Returns whether we
+        still hold them all."""
+        sent_at = monotonic()
+        ret = await self.backend.run_script(
+            EXTEND_ALL, self.__keys, [self.token or "", self.lock_expiry * 1000]
+        )
+        return self.expiration_set(ret, sent_at)
+
+    async def release(self) -> None:
+        """Release every key that's still ours, and tell anyone waiting on them. Raises if we'd
+        already lost any of them."""
+        ret = await self.backend.run_script(
+            RELEASE_ALL, self.__keys, [self.token or "", RELEASE_CHANNEL_PREFIX]
+        )
+        self.__fencing_tokens = {}
+        self._released(ret == len(self.__keys))
+
+    async def exists(self) -> int:
+        """Count how many of our keys exist. Mostly for testing."""
+        ret = await self.backend.call("exists", *self.__keys)
+        return ret
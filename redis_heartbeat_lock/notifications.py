@@ -0,0 +1,232 @@
+"""Release notifications, so waiters can retry a lock as soon as it's freed instead of polling.
+
+A lock's holder publishes to the key's release channel when it releases the lock. If the server has
+keyspace notifications enabled (`notify-keyspace-events` including `Kgx`), we also hear about the key
+being deleted or expiring, which covers holders that crash without releasing. Each backend gets a
+single :class:`ReleaseListener`, multiplexing every waiting key in the process over one pub/sub
+connection.
+"""
+
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+from .backends import Backend, PubSub
+from .shared import RELEASE_CHANNEL_PREFIX
+
+# Keyspace events meaning the key is gone
+RELEASE_EVENTS = ("del", "expired", "evicted")
+
+# How long the reader blocks on the pub/sub connection before checking if it's still needed
+READ_TIMEOUT: float = 1.0
+
+# How long to wait for the server to confirm a subscription before trying the lock anyway
+SUBSCRIBE_TIMEOUT: float = 1.0
+
+
+def release_channel(key: str) -> str:
+    """The channel a lock's holder publishes to when releasing it."""
+    return f"{RELEASE_CHANNEL_PREFIX}{key}"
+
+
+def keyspace_channel(key: str, db: int = 0) -> str:
+    """The keyspace notification channel for the given key."""
+    return f"__keyspace@{db}__:{key}"
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class ReleaseSignal:
+    """Wakes a single waiter when the lock it's waiting on is released."""
+
+    # Set when we hear about a release
+    __event: asyncio.Event
+
+    def __init__(self):
+        self.__event = asyncio.Event()
+
+    def set(self) -> None:
+        self.__event.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for a release. Returns whether we were signalled."""
+        try:
+            await asyncio.wait_for(self.__event.wait(), timeout=max(timeout, 0.0))
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.__event.clear()
+        return True
+
+
+class ReleaseListener:
+    """Listens for lock releases on behalf of every waiter sharing a backend."""
+
+    # The backend to open our pub/sub connection on
+    __backend: Backend
+
+    # The database number, for keyspace notification channels
+    __db: int
+
+    # The pub/sub connection, opened on first use
+    __pubsub: Optional[PubSub]
+
+    # The task reading from the pub/sub connection
+    __reader: Optional["asyncio.Task[None]"]
+
+    # Key -> signals for the waiters on that key
+    __waiters: Dict[str, Set[ReleaseSignal]]
+
+    # Channel -> the key it reports on
+    __channels: Dict[str, str]
+
+    # Channel -> future resolved when the server confirms our subscription
+    __confirmations: Dict[str, "asyncio.Future[None]"]
+
+    def __init__(self, backend: Backend):
+        self.__backend = backend
+        pool = getattr(backend.client, "connection_pool", None)
+        self.__db = int(getattr(pool, "connection_kwargs", {}).get("db", 0))
+        self.__pubsub = None
+        self.__reader = None
+        self.__waiters = {}
+        self.__channels = {}
+        self.__confirmations = {}
+
+    def __channels_for(self, key: str) -> List[str]:
+        return [release_channel(key), keyspace_channel(key, self.__db)]
+
+    @asynccontextmanager
+    async def subscribe(self, *keys: str) -> AsyncIterator[ReleaseSignal]:
+        """Subscribe to releases of the given keys, for as long as the context is open. The
+        subscriptions are confirmed by the time we yield, so a release that happens after that
+        point can't be missed."""
+        signal = ReleaseSignal()
+        try:
+            for key in keys:
+                waiters = self.__waiters.setdefault(key, set())
+                waiters.add(signal)
+                if len(waiters) == 1:
+                    await self.__subscribe(key)
+                else:
+                    confirmation = self.__confirmations.get(release_channel(key))
+                    if confirmation is not None:
+                        await asyncio.wait({confirmation}, timeout=SUBSCRIBE_TIMEOUT)
+            yield signal
+        finally:
+            for key in keys:
+                waiters = self.__waiters.get(key, set())
+                waiters.discard(signal)
+                if not waiters and key in self.__waiters:
+                    del self.__waiters[key]
+                    await self.__unsubscribe(key)
+
+    async def __subscribe(self, key: str) -> None:
+        if self.__pubsub is None:
+            self.__pubsub = self.__backend.pubsub()
+        channels = self.__channels_for(key)
+        loop = asyncio.get_running_loop()
+        for channel in channels:
+            self.__channels[channel] = key
+            self.__confirmations[channel] = loop.create_future()
+        await self.__pubsub.subscribe(*channels)
+        if self.__reader is None or self.__reader.done():
+            self.__reader = asyncio.create_task(self.__read())
+        await asyncio.wait({self.__confirmations[channels[0]]}, timeout=SUBSCRIBE_TIMEOUT)
+
+    async def __unsubscribe(self, key: str) -> None:
+        channels = self.__channels_for(key)
+        for channel in channels:
+            self.__channels.pop(channel, None)
+            self.__confirmations.pop(channel, None)
+        if self.__pubsub is not None:
+            try:
+                await self.__pubsub.unsubscribe(*channels)
+            except Exception:
+                # The connection is broken; the reader will reset it.
+                pass
+
+    async def __read(self) -> None:
+        """Dispatch messages until nobody is waiting any more."""
+        while self.__channels:
+            pubsub = self.__pubsub
+            if pubsub is None:
+                return
+            try:
+                message = await pubsub.get_message(timeout=READ_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await self.__reset()
+                continue
+            if message is not None:
+                self.__dispatch(message)
+
+    def __dispatch(self, message: Dict[str, Any]) -> None:
+        channel = _decode(message["channel"])
+        if message["type"] == "subscribe":
+            confirmation = self.__confirmations.get(channel)
+            if confirmation is not None and not confirmation.done():
+                confirmation.set_result(None)
+            return
+        if message["type"] != "message":
+            return
+
+        key = self.__channels.get(channel)
+        if key is None:
+            return
+        if channel.startswith("__keyspace@") and _decode(message["data"]) not in RELEASE_EVENTS:
+            return
+        for signal in self.__waiters.get(key, ()):
+            signal.set()
+
+    async def __reset(self) -> None:
+        """Our connection broke. Wake every waiter, so they retry in case they missed a release
+        while we were down, then resubscribe on a fresh connection."""
+        for waiters in self.__waiters.values():
+            for signal in waiters:
+                signal.set()
+
+        pubsub, self.__pubsub = self.__pubsub, None
+        if pubsub is not None:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+
+        await asyncio.sleep(READ_TIMEOUT / 10)
+        if self.__channels and self.__pubsub is None:
+            self.__pubsub = self.__backend.pubsub()
+            try:
+                await self.__pubsub.subscribe(*self.__channels)
+            except Exception:
+                pass
+
+    async def close(self) -> None:
+        """Stop listening and close our connection."""
+        if self.__reader is not None:
+            self.__reader.cancel()
+            try:
+                await self.__reader
+            except asyncio.CancelledError:
+                pass
+            self.__reader = None
+        if self.__pubsub is not None:
+            await self.__pubsub.close()
+            self.__pubsub = None
+
+
+# Backend -> its listener
+_listeners: "weakref.WeakKeyDictionary[Backend, ReleaseListener]" = weakref.WeakKeyDictionary()
+
+
+def get_listener(backend: Backend) -> ReleaseListener:
+    """Get the release listener shared by every lock on the given backend."""
+    listener = _listeners.get(backend)
+    if listener is None:
+        listener = ReleaseListener(backend)
+        _listeners[backend] = listener
+    return listener
@@ -0,0 +1,74 @@
+"""Adaptive heartbeat periods, paced by how long refreshes actually take.
+
+A fixed heartbeat period has to be short enough for the slowest Redis we'll ever see, so it wastes
+round-trips when Redis is fast, and can still let a lock lapse when Redis is slower than expected.
+An :class:`AdaptivePeriod` instead tracks recent refresh latency, smoothed like TCP's round-trip
+estimate, and waits as long as it can while still leaving a safety margin on the lock when the next
+refresh lands. It refreshes sooner as Redis slows down, and less often while Redis is fast.
+"""
+
+from typing import Optional
+
+from .shared import DEFAULT_HEARTBEAT_MIN_PERIOD, DEFAULT_HEARTBEAT_SAFETY_MARGIN
+
+
+class AdaptivePeriod:
+    """Picks how long to wait between refreshes of a lock, from its expiry and recent latency."""
+
+    # How long the lock lasts after each refresh, in seconds
+    __expiry: float
+
+    # The least fraction of the expiry to leave on the lock when a refresh lands
+    __safety_margin: float
+
+    # Shortest time between refreshes, in seconds
+    __min_period: float
+
+    # Smoothed refresh latency, and its mean deviation, once we've seen a refresh
+    __smoothed: Optional[float]
+    __deviation: float
+
+    # Latency of the last refresh, so a sudden spike counts straight away
+    __latest: float
+
+    def __init__(
+        self,
+        expiry: float,
+        safety_margin: float = DEFAULT_HEARTBEAT_SAFETY_MARGIN,
+        min_period: float = DEFAULT_HEARTBEAT_MIN_PERIOD,
+    ):
+        if not 0 < safety_margin < 1:
+            raise Exception(f"Safety margin must be between 0 and 1, not {safety_margin}.")
+        self.__expiry = expiry
+        self.__safety_margin = safety_margin
+        self.__min_period = min_period
+        self.__smoothed = None
+        self.__deviation = 0.0
+        self.__latest = 0.0
+
+    @property
+    def latency_bound(self) -> float:
+        """How long we expect a refresh could take: the smoothed latency plus four deviations."""
+        if self.__smoothed is None:
+            return 0.0
+        return max(self.__smoothed + 4 * self.__deviation, self.__latest)
+
+    def observe(self, latency: float) -> None:
+        """Record how long a refresh took, from sending it to hearing back, in seconds."""
+        if self.__smoothed is None:
+            self.__smoothed = latency
+            self.__deviation = latency / 2
+        else:
+            self.__deviation = 0.75 * self.__deviation + 0.25 * abs(latency - self.__smoothed)
+            self.__smoothed = 0.875 * self.__smoothed + 0.125 * latency
+        self.__latest = latency
+
+    def period(self) -> float:
+        """How long after sending a refresh to send the next one. Until we've seen a refresh, half
+        the expiry. After that, as long as possible while the next refresh, taking as long as the
+        latency bound, still lands with the safety margin (at least one latency bound) left."""
+        if self.__smoothed is None:
+            return max(self.__min_period, self.__expiry / 2)
+        bound = self.latency_bound
+        margin = max(self.__expiry * self.__safety_margin, bound)
+        return max(self.__min_period, self.__expiry - bound - margin)
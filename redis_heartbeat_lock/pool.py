@@ -0,0 +1,323 @@
+"""A shared registry of Redis clients, so locks on the same server reuse one connection pool.
+
+Creating a client per lock means a new pool, and new TCP (and TLS) handshakes, for every lock.
+Instead, :meth:`AsyncLock.create` asks the registry for a client, keyed by URL and backend. Pools
+are bounded: once `max_connections` are in use, callers wait up to `pool_timeout` seconds for one to
+be returned, and we count those waits so pool pressure shows up in :meth:`ClientRegistry.stats`.
+Redis Cluster clients keep a pool per node themselves, so they're shared, but not tracked.
+"""
+
+import asyncio
+import redis
+import threading
+import weakref
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from .backends import (
+    Backend,
+    SyncClient,
+    cluster_client_class,
+    from_client,
+    from_url,
+    native_backend_available,
+)
+from .cluster import split_cluster_url
+from .executor import run_sync_in_thread_pool
+from .shared import (
+    BACKEND_NATIVE,
+    BACKEND_THREAD_POOL,
+    DEFAULT_HEALTH_CHECK_INTERVAL,
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_POOL_TIMEOUT,
+)
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis-py < 4.2
+    aioredis = None  # type: ignore
+
+
+class PoolStats(NamedTuple):
+    """A snapshot of one shared connection pool."""
+
+    # The server's URL, without credentials
+    url: str
+
+    # The backend using the pool
+    backend: str
+
+    # Most connections the pool will open
+    max_connections: int
+
+    # Connections checked out right now
+    in_use: int
+
+    # Connections open, but not checked out
+    idle: int
+
+    # Times a caller found every connection in use, and had to wait for one
+    waits: int
+
+
+class _PoolCounters:
+    """Counts connections checked out of a pool, and callers that had to wait for one."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Callers holding or waiting for a connection
+        self.requested = 0
+        self.in_use = 0
+        self.waits = 0
+
+    def checking_out(self, max_connections: int) -> None:
+        with self.lock:
+            self.requested += 1
+            if self.requested > max_connections:
+                self.waits += 1
+
+    def checked_out(self) -> None:
+        with self.lock:
+            self.in_use += 1
+
+    def gave_up(self) -> None:
+        with self.lock:
+            self.requested = max(self.requested - 1, 0)
+
+    def checked_in(self) -> None:
+        with self.lock:
+            self.requested = max(self.requested - 1, 0)
+            self.in_use = max(self.in_use - 1, 0)
+
+
+class TrackedBlockingConnectionPool(redis.BlockingConnectionPool):
+    """A blocking pool for the synchronous client, which counts its connections and waits."""
+
+    def __init__(self, *args, **kwargs):
+        self.counters = _PoolCounters()
+        super().__init__(*args, **kwargs)
+
+    def get_connection(self, *args, **kwargs):
+        self.counters.checking_out(self.max_connections)
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except BaseException:
+            self.counters.gave_up()
+            raise
+        self.counters.checked_out()
+        return connection
+
+    def release(self, connection) -> None:
+        super().release(connection)
+        self.counters.checked_in()
+
+    def created_connections(self) -> int:
+        return len([c for c in getattr(self, "_connections", []) if c is not None])
+
+
+if aioredis is not None:
+
+    class TrackedAsyncBlockingConnectionPool(aioredis.BlockingConnectionPool):
+        """A blocking pool for the asyncio client, which counts its connections and waits."""
+
+        def __init__(self, *args, **kwargs):
+            self.counters = _PoolCounters()
+            super().__init__(*args, **kwargs)
+
+        async def get_connection(self, *args, **kwargs):
+            self.counters.checking_out(self.max_connections)
+            try:
+                connection = await super().get_connection(*args, **kwargs)
+            except BaseException:
+                self.counters.gave_up()
+                raise
+            self.counters.checked_out()
+            return connection
+
+        async def release(self, connection) -> None:
+            await super().release(connection)
+            self.counters.checked_in()
+
+        def created_connections(self) -> int:
+            available = getattr(self, "_available_connections", [])
+            return len(available) + self.counters.in_use
+
+
+def _redact(url: str) -> str:
+    """Strip credentials from a URL, so it's safe to report."""
+    parts = urlsplit(url)
+    if parts.password is None:
+        return url
+    netloc = parts.netloc.rsplit("@", 1)[-1]
+    return urlunsplit((parts.scheme, netloc, parts.path, parts.query, parts.fragment))
+
+
+class ClientRegistry:
+    """Hands out one shared client per URL and backend. Asyncio clients can't be shared between
+    event loops, so native clients are also keyed by the running loop."""
+
+    # Most connections each pool will open
+    __max_connections: int
+
+    # Seconds to wait for a free connection before giving up
+    __pool_timeout: float
+
+    # Seconds a connection can sit idle before we check it's still alive before using it
+    __health_check_interval: float
+
+    # (URL, backend) -> shared backend, for the thread-pool backend
+    __shared: Dict[Tuple[str, str], Backend]
+
+    # Guards `__shared`, which synchronous locks use from any thread
+    __shared_lock: threading.Lock
+
+    # Event loop -> (URL, backend) -> shared backend, for the native backend
+    __per_loop: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], Backend]]"
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        pool_timeout: float = DEFAULT_POOL_TIMEOUT,
+        health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL,
+    ):
+        self.__max_connections = max_connections
+        self.__pool_timeout = pool_timeout
+        self.__health_check_interval = health_check_interval
+        self.__shared = {}
+        self.__shared_lock = threading.Lock()
+        self.__per_loop = weakref.WeakKeyDictionary()
+
+    def configure(
+        self,
+        max_connections: Optional[int] = None,
+        pool_timeout: Optional[float] = None,
+        health_check_interval: Optional[float] = None,
+    ) -> None:
+        """Change the settings used for pools created from now on."""
+        if max_connections is not None:
+            self.__max_connections = max_connections
+        if pool_timeout is not None:
+            self.__pool_timeout = pool_timeout
+        if health_check_interval is not None:
+            self.__health_check_interval = health_check_interval
+
+    def __pool_options(self) -> Dict[str, Any]:
+        return {
+            "max_connections": self.__max_connections,
+            "timeout": self.__pool_timeout,
+            "health_check_interval": self.__health_check_interval,
+        }
+
+    async def get(self, url: str, backend: Optional[str] = None) -> Backend:
+        """Get the shared backend for the given URL, creating it on first use."""
+        if backend is None:
+            backend = BACKEND_NATIVE if native_backend_available() else BACKEND_THREAD_POOL
+        cluster, _ = split_cluster_url(url)
+
+        if backend == BACKEND_NATIVE:
+            if aioredis is None:
+                raise Exception(f"The {BACKEND_NATIVE} backend requires redis-py 4.2 or later.")
+            clients = self.__per_loop.setdefault(asyncio.get_running_loop(), {})
+            shared = clients.get((url, backend))
+            if shared is None and cluster:
+                shared = clients[(url, backend)] = await from_url(url, backend)
+            elif shared is None:
+                pool = TrackedAsyncBlockingConnectionPool.from_url(url, **self.__pool_options())
+                shared = from_client(aioredis.Redis(connection_pool=pool))
+                clients[(url, backend)] = shared
+            return shared
+
+        if backend == BACKEND_THREAD_POOL:
+            shared = self.__shared.get((url, backend))
+            if shared is None and cluster:
+                shared = await run_sync_in_thread_pool(self.__shared_sync, url)
+            elif shared is None:
+                shared = self.__shared_sync(url)
+            return shared
+
+        raise Exception(f"Unknown backend {backend}.")
+
+    async def warm_up(
+        self, url: str, backend: Optional[str] = None, connections: int = 1
+    ) -> Backend:
+        """Get the shared backend for the given URL, open up to `connections` connections in its
+        pool and load our scripts, e.g. while a worker starts, so its first locks don't pay for
+        either. Returns the backend."""
+        shared = await self.get(url, backend)
+        await shared.warm_up(connections)
+        return shared
+
+    def __shared_sync(self, url: str) -> Backend:
+        """The shared thread-pool backend for the given URL, creating it on first use. Building a
+        client doesn't do any I/O, except that a cluster client asks for the cluster's layout."""
+        with self.__shared_lock:
+            shared = self.__shared.get((url, BACKEND_THREAD_POOL))
+            if shared is None:
+                cluster, plain_url = split_cluster_url(url)
+                client: SyncClient
+                if cluster:
+                    client = cluster_client_class(BACKEND_THREAD_POOL).from_url(plain_url)
+                else:
+                    pool = TrackedBlockingConnectionPool.from_url(url, **self.__pool_options())
+                    client = redis.Redis(connection_pool=pool)
+                shared = self.__shared[(url, BACKEND_THREAD_POOL)] = from_client(client)
+        return shared
+
+    def sync_client(self, url: str) -> Any:
+        """Get the shared synchronous client for the given URL, e.g. for a :class:`SyncLock`. It's
+        the one the thread-pool backend uses."""
+        return self.__shared_sync(url).client
+
+    def __entries(self) -> List[Tuple[str, str, Backend]]:
+        entries = [(url, name, shared) for (url, name), shared in self.__shared.items()]
+        for clients in list(self.__per_loop.values()):
+            entries.extend((url, name, shared) for (url, name), shared in clients.items())
+        return entries
+
+    def stats(self) -> List[PoolStats]:
+        """A snapshot of every shared pool, except those of cluster clients."""
+        snapshots = []
+        for url, name, shared in self.__entries():
+            if shared.cluster:
+                continue
+            pool = shared.client.connection_pool
+            in_use = pool.counters.in_use
+            snapshots.append(
+                PoolStats(
+                    url=_redact(url),
+                    backend=name,
+                    max_connections=pool.max_connections,
+                    in_use=in_use,
+                    idle=max(pool.created_connections() - in_use, 0),
+                    waits=pool.counters.waits,
+                )
+            )
+        return snapshots
+
+    async def close(self) -> None:
+        """Close every shared client and its connections, e.g. when shutting down. Clients for
+        other event loops than the running one are dropped without closing their connections,
+        since they can only be closed from their own loop."""
+        shared, self.__shared = self.__shared, {}
+        for backend in shared.values():
+            await backend.close()
+            if backend.cluster:
+                continue
+            await run_sync_in_thread_pool(backend.client.connection_pool.disconnect)
+
+        clients = self.__per_loop.pop(asyncio.get_running_loop(), {})
+        self.__per_loop = weakref.WeakKeyDictionary()
+        for backend in clients.values():
+            await backend.close()
+            if backend.cluster:
+                continue
+            await backend.client.connection_pool.disconnect()
+
+
+# The process-wide registry used by `AsyncLock.create`
+_registry = ClientRegistry()
+
+
+def get_registry() -> ClientRegistry:
+    """Get the process-wide client registry."""
+    return _registry
@@ -0,0 +1,220 @@
+"""Serve our locks' measurements to Prometheus, from a small HTTP server in the process.
+
+The exporter reads the process-wide in-memory instrumentation when scraped, and renders it in the
+Prometheus text exposition format: locks held, acquisitions and contended acquisitions (for rates
+and the contention ratio), histograms of acquisition latency, heartbeat lateness and hold
+durations (for percentiles), lost locks, and our thread pools' queues. Locks only pay for the
+in-memory instrumentation's counters; rendering happens on the server's own thread, on scrape. It
+needs nothing outside the standard library.
+
+By default, every lock's measurements are added up into one series per metric, since each label
+value is a series of its own for Prometheus to store. Pass `key_labels=True` to label them by key
+instead; the in-memory instrumentation's `max_keys` then bounds how many series there are.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .executor import ThreadPool, get_executor
+from .instrumentation import (
+    DURATION_BUCKETS,
+    Histogram,
+    InMemoryInstrumentation,
+    get_instrumentation,
+    set_instrumentation,
+)
+from .shared import (
+    DEFAULT_METRICS_HOST,
+    DEFAULT_METRICS_PORT,
+    METRICS_PREFIX,
+    THREAD_POOL_DEFAULT,
+    THREAD_POOL_HEARTBEAT,
+)
+
+# Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _total(histograms: Iterable[Histogram]) -> Histogram:
+    total = Histogram(DURATION_BUCKETS)
+    for histogram in histograms:
+        total.add(histogram)
+    return total
+
+
+class _Family:
+    """One metric and its samples, rendered with its help and type."""
+
+    def __init__(self, name: str, type_: str, help_: str):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.type = type_
+        self.help = help_
+        self.samples: List[Tuple[str, Dict[str, str], float]] = []
+
+    def add(self, labels: Dict[str, str], value: float, suffix: str = "") -> None:
+        self.samples.append((suffix, labels, value))
+
+    def add_histogram(self, labels: Dict[str, str], histogram: Histogram) -> None:
+        # Read the buckets once, so the cumulative counts agree with the total
+        counts = list(histogram.counts)
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + [float("inf")], counts):
+            cumulative += count
+            self.add({**labels, "le": _number(bound)}, cumulative, "_bucket")
+        self.add(labels, histogram.sum, "_sum")
+        self.add(labels, cumulative, "_count")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples:
+            lines.append(f"{self.name}{suffix}{_labels(labels)} {_number(value)}")
+        return lines
+
+
+def render(instrumentation: InMemoryInstrumentation, key_labels: bool = False) -> str:
+    """Render the instrumentation's measurements in the Prometheus text exposition format. With
+    `key_labels`, each key gets series of its own; otherwise, every key's are added up."""
+    held = _Family("locks_held", "gauge", "Locks acquired and not yet released.")
+    acquisitions = _Family("acquisitions_total", "counter", "Calls to set_lock, by result.")
+    contended = _Family(
+        "contended_acquisitions_total", "counter", "Calls to set_lock needing more than 1 attempt."
+    )
+    latency = _Family(
+        "acquisition_latency_seconds", "histogram", "Time spent in set_lock, in seconds."
+    )
+    lateness = _Family(
+        "heartbeat_lateness_seconds", "histogram", "How late heartbeats fired, in seconds."
+    )
+    holds = _Family("hold_duration_seconds", "histogram", "How long locks were held, in seconds.")
+    lost = _Family("locks_lost_total", "counter", "Times we found a lock we held wasn't ours.")
+
+    if key_labels:
+        groups = {key: [stats] for key, stats in sorted(instrumentation.keys.items())}
+    else:
+        groups = {"": list(instrumentation.keys.values())}
+    for key, group in groups.items():
+        labels = {"key": key} if key_labels else {}
+        held.add(labels, sum(stats.held for stats in group))
+        acquired = sum(stats.acquisitions for stats in group)
+        acquisitions.add({**labels, "result": "acquired"}, acquired)
+        failed = sum(stats.failed_acquisitions for stats in group)
+        acquisitions.add({**labels, "result": "failed"}, failed)
+        contended.add(labels, sum(stats.contended for stats in group))
+        latency.add_histogram(labels, _total(stats.acquisition_latency for stats in group))
+        lateness.add_histogram(labels, _total(stats.heartbeat_lateness for stats in group))
+        holds.add_histogram(labels, _total(stats.hold_duration for stats in group))
+        lost.add(labels, sum(stats.locks_lost for stats in group))
+
+    queue_delay = _Family(
+        "thread_pool_queue_delay_seconds",
+        "histogram",
+        "Time work waited for a thread in our thread pools, in seconds.",
+    )
+    queue_delay.add_histogram({}, instrumentation.executor_delay)
+    queue_depth = _Family("thread_pool_queue_depth", "gauge", "Work waiting for a thread, by pool.")
+    for name in (THREAD_POOL_DEFAULT, THREAD_POOL_HEARTBEAT):
+        pool = get_executor(name)
+        if isinstance(pool, ThreadPool):
+            queue_depth.add({"pool": name}, pool.queue_depth)
+
+    families = [held, acquisitions, contended, latency, lateness, holds, lost, queue_delay]
+    lines = [line for family in families + [queue_depth] for line in family.render()]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the rendered measurements at `/metrics` from a daemon thread."""
+
+    # The HTTP server
+    __server: ThreadingHTTPServer
+
+    # The thread serving requests
+    __thread: threading.Thread
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        source: Callable[[], InMemoryInstrumentation],
+        key_labels: bool = False,
+    ):
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = render(source(), key_labels).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+                # Scrapes are frequent; don't write each one to stderr
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), _Handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, name="redis-heartbeat-lock-metrics", daemon=True
+        )
+        self.__thread.start()
+
+    @property
+    def port(self) -> int:
+        """The port we're listening on, e.g. if we were asked for any free port with 0."""
+        return self.__server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        host = self.__server.socket.getsockname()[0]
+        return f"http://{host}:{self.port}/metrics"
+
+    def stop(self) -> None:
+        """Stop serving, and close the listening socket."""
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+
+def start_http_server(
+    port: int = DEFAULT_METRICS_PORT,
+    host: str = DEFAULT_METRICS_HOST,
+    instrumentation: Optional[InMemoryInstrumentation] = None,
+    key_labels: bool = False,
+) -> MetricsServer:
+    """Start serving measurements at `http://host:port/metrics`. Without an `instrumentation`,
+    serve whatever in-memory instrumentation is installed when scraped, installing one first if
+    there isn't one. Pass `key_labels=True` to label measurements by lock key."""
+    if instrumentation is None and not isinstance(get_instrumentation(), InMemoryInstrumentation):
+        set_instrumentation(InMemoryInstrumentation())
+
+    def _source() -> InMemoryInstrumentation:
+        if instrumentation is not None:
+            return instrumentation
+        current = get_instrumentation()
+        if isinstance(current, InMemoryInstrumentation):
+            return current
+        return InMemoryInstrumentation()
+
+    return MetricsServer(host, port, _source, key_labels)
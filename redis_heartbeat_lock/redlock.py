@@ -0,0 +1,210 @@
+"""A lock held across several independent Redis nodes, following the Redlock algorithm.
+
+An :class:`~redis_heartbeat_lock.async_lock.AsyncLock` lives on one Redis, so if that Redis fails
+over, its locks can be lost, and every lock waits on that one node. A :class:`RedLock` takes the
+same key on every one of N independent nodes at once, and holds the lock if a majority of them
+gave it the key quickly enough that it still has time left on it. That time, the lock's validity,
+is the expiry less how long acquiring took and an allowance for clock drift. Refreshing and
+releasing also go to every node at once, so one slow node doesn't slow the lock down.
+"""
+
+import asyncio
+import random
+import redis
+from typing import Any, List, Optional, Sequence, Union
+
+from .backends import Backend, from_client
+from .base_lock import BaseLock, retry_acquisition
+from .notifications import release_channel
+from .scripts import ACQUIRE, EXTEND, RELEASE, Script
+from .shared import (
+    Command,
+    DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+    DEFAULT_LOCK_CHECK_RATE,
+    DEFAULT_LOCK_EXPIRY,
+    DEFAULT_NODE_TIMEOUT,
+    FENCE_KEY_SUFFIX,
+    monotonic,
+    new_owner_token,
+)
+
+
+class RedLock(BaseLock):
+    """Holds a key on a majority of several independent Redis nodes."""
+
+    # The backends executing our Redis commands, one per node
+    __backends: List[Backend]
+
+    # Timeout when acquiring the lock
+    __lock_acquisition_timeout: float
+
+    # Rate at which to retry the lock when acquiring it; we wait up to twice as long, at random
+    __lock_check_rate: float
+
+    # How long to wait on each node
+    __node_timeout: float
+
+    # Attempts made by the current call to `set_lock`
+    __attempts: int
+
+    def __init__(
+        self,
+        key: str,
+        clients: Sequence[Union[redis.Redis, Backend, Any]],
+        lock_acquisition_timeout: float,
+        lock_check_rate: float,
+        lock_expiry: int,
+        node_timeout: float = DEFAULT_NODE_TIMEOUT,
+    ):
+        if not clients:
+            raise Exception("A RedLock needs at least one node.")
+
+        self.__backends = [from_client(client) for client in clients]
+        # Our backend is the first node's. Our lease runs from when we sent the commands that took
+        # or refreshed a majority of nodes.
+        super().__init__(key, self.__backends[0], lock_expiry)
+        self.__lock_acquisition_timeout = lock_acquisition_timeout
+        self.__lock_check_rate = lock_check_rate
+        self.__node_timeout = node_timeout
+        self.__attempts = 0
+
+    @classmethod
+    async def create(
+        cls,
+        key: str,
+        urls: Sequence[str],
+        lock_acquisition_timeout: float = DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+        lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
+        lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        node_timeout: float = DEFAULT_NODE_TIMEOUT,
+        backend: Optional[str] = None,
+        share_client: bool = True,
+    ) -> "RedLock":
+        """Asynchronously create a Redis client for every node, and initialize the lock. Each URL
+        should point at an independent Redis, not a replica of another. Takes the same options as
+        :meth:`AsyncLock.create`, plus how long to wait on each node."""
+        clients = [await cls._connect(url, backend, share_client) for url in urls]
+        return cls(
+            key,
+            clients,
+            lock_acquisition_timeout,
+            lock_check_rate,
+            lock_expiry,
+            node_timeout=node_timeout,
+        )
+
+    @property
+    def backends(self) -> List[Backend]:
+        """The backends executing our Redis commands, one per node."""
+        return list(self.__backends)
+
+    @property
+    def quorum(self) -> int:
+        """How many nodes must hold our key for us to hold the lock."""
+        return len(self.__backends) // 2 + 1
+
+    @property
+    def batched(self) -> bool:
+        """Refreshing the lock takes a round-trip to every node, so it can't be batched."""
+        return False
+
+    async def __on_node(self, backend: Backend, script: Script, keys: List[str], args: List[Any]):
+        """Run a script on one node, giving up after the node timeout. Returns `None` if the node
+        failed or was too slow."""
+        try:
+            return await asyncio.wait_for(
+                backend.run_script(script, keys, args), timeout=self.__node_timeout
+            )
+        except asyncio.CancelledError:
+            # Before Python 3.8, cancellation is an `Exception`; don't mistake it for a failure
+            raise
+        except Exception:  # pylint: disable=broad-except
+            return None
+
+    async def __on_every_node(self, script: Script, keys: List[str], args: List[Any]) -> List[Any]:
+        return await asyncio.gather(
+            *[self.__on_node(backend, script, keys, args) for backend in self.__backends]
+        )
+
+    async def __release_everywhere(self, token: str) -> int:
+        """Release our key on every node, including any that didn't answer in time, in case they
+        took it anyway. Returns how many nodes still held it."""
+        results = await self.__on_every_node(
+            RELEASE, [self.key], [token, release_channel(self.key)]
+        )
+        return sum(1 for result in results if result == 1)
+
+    async def __set(self) -> bool:
+        """Try to take the key on every node at once. We hold the lock if a majority took it, and
+        there's still time left on it; otherwise, we let go of whatever nodes we took."""
+        self.__attempts += 1
+        token = new_owner_token()
+        sent_at = monotonic()
+        results = await self.__on_every_node(
+            ACQUIRE,
+            [self.key, f"{self.key}{FENCE_KEY_SUFFIX}"],
+            [token, self.lock_expiry * 1000, 1],
+        )
+        self.lease.renewed(sent_at)
+        taken = sum(1 for result in results if result is not None)
+        if taken >= self.quorum and self.lease.is_valid():
+            self._taken(token, sent_at)
+            return True
+
+        self.lease.end()
+        await self.__release_everywhere(token)
+        return False
+
+    async def set_lock(self, value: Any, nx: bool = True) -> bool:
+        """Try to take the lock until we timeout, retrying after a random delay so contending
+        clients don't keep splitting the nodes between them. `value` and `nx` are accepted for
+        compatibility with the other locks, but the lock is never taken over."""
+        started_at = monotonic()
+        self.__attempts = 0
+        set_lock = await retry_acquisition(
+            self.__set,
+            self.__lock_acquisition_timeout,
+            lambda: self.__lock_check_rate * random.uniform(1.0, 2.0),
+        )
+
+        self._acquired(started_at, self.__attempts, set_lock is True)
+        return set_lock
+
+    def expiration_command(self) -> Command:
+        """The lock spans several nodes, so it has no single expiration command."""
+        raise Exception(f"{self.key} spans several nodes; refresh it with set_expiration.")
+
+    def expiration_set(self, result: Any, sent_at: Optional[float] = None) -> bool:
+        """Record how many nodes a refresh sent at `sent_at` extended. Returns whether we still
+        hold the lock on a majority of them, with time left on it."""
+        if sent_at is not None and super().expiration_set(result, sent_at):
+            if self.lease.is_valid():
+                return True
+        self.lease.end()
+        return False
+
+    def _still_held(self, result: Any) -> bool:
+        """We hold the lock while a majority of nodes hold our key."""
+        return result >= self.quorum
+
+    async def set_expiration(self) -> bool:
+        """Extend our key on every node at once. Returns whether a majority still held it."""
+        sent_at = monotonic()
+        results = await self.__on_every_node(
+            EXTEND, [self.key], [self.token or "", self.lock_expiry * 1000]
+        )
+        return self.expiration_set(sum(1 for result in results if result == 1), sent_at)
+
+    async def release(self) -> None:
+        """Release our key on every node, and tell anyone waiting on it. Raises if a majority of
+        nodes no longer held it."""
+        released = await self.__release_everywhere(self.token or "")
+        self._released(released >= self.quorum)
+
+    async def exists(self) -> int:
+        """Count the nodes holding the key. Mostly for testing."""
+        results = await asyncio.gather(
+            *[backend.call("exists", self.key) for backend in self.__backends],
+            return_exceptions=True,
+        )
+        return sum(1 for result in results if result == 1)
@@ -0,0 +1,227 @@
+"""A read/write lock: any number of readers can hold a key at once, or a single writer.
+
+The writer holds the key itself, like an :class:`~redis_heartbeat_lock.async_lock.AsyncLock`.
+Readers hold leases in a sorted set next to it, scored by when each lease expires, so a reader that
+dies without releasing only blocks writers until its lease lapses. Writers waiting for readers to
+drain are recorded too, and keep new readers out, so a steady stream of readers can't starve them.
+Every operation is a single script, so refreshing a reader's lease is one round-trip.
+"""
+
+import redis
+from typing import Any, List, Optional, Union
+
+from .backends import Backend, from_client
+from .base_lock import BaseLock, retry_acquisition
+from .cluster import related_key
+from .notifications import get_listener, release_channel
+from .scripts import ACQUIRE_READ, ACQUIRE_WRITE, EXTEND, EXTEND_LEASE, RELEASE, RELEASE_READ
+from .shared import (
+    Command,
+    DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+    DEFAULT_LOCK_CHECK_RATE,
+    DEFAULT_LOCK_EXPIRY,
+    DEFAULT_NOTIFY_POLL_RATE,
+    DEFAULT_QUEUE_WAITER_TTL,
+    FENCE_KEY_SUFFIX,
+    MODE_READ,
+    MODE_WRITE,
+    READERS_KEY_SUFFIX,
+    WAIT_MODE_NOTIFY,
+    WAIT_MODE_POLL,
+    WRITERS_KEY_SUFFIX,
+    monotonic,
+    new_owner_token,
+)
+
+
+class ReadWriteLock(BaseLock):
+    """Holds a key either shared, as one of many readers, or exclusively, as its only writer."""
+
+    # Whether we lock for reading or writing
+    __mode: str
+
+    # Timeout when acquiring the lock
+    __lock_acquisition_timeout: float
+
+    # Rate at which to check lock when acquiring it
+    __lock_check_rate: float
+
+    # How we wait for the lock to be released
+    __wait_mode: str
+
+    # In notify mode, rate at which to check the lock in case we missed a release notification
+    __notify_poll_rate: float
+
+    # Fencing counter for a writer's current acquisition
+    __fencing_token: Optional[int]
+
+    # Attempts made by the current call to `set_lock`
+    __attempts: int
+
+    def __init__(
+        self,
+        key: str,
+        client: Union[redis.Redis, Backend, Any],
+        lock_acquisition_timeout: float,
+        lock_check_rate: float,
+        lock_expiry: int,
+        mode: str = MODE_WRITE,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+    ):
+        if mode not in (MODE_READ, MODE_WRITE):
+            raise Exception(f"Unknown mode {mode}.")
+        if wait_mode not in (WAIT_MODE_POLL, WAIT_MODE_NOTIFY):
+            raise Exception(f"Unknown wait mode {wait_mode}.")
+
+        # A writer's expiry is the key's, and a reader's is its lease's
+        super().__init__(key, from_client(client), lock_expiry)
+        self.__mode = mode
+        self.__lock_acquisition_timeout = lock_acquisition_timeout
+        self.__lock_check_rate = lock_check_rate
+        self.__wait_mode = wait_mode
+        self.__notify_poll_rate = notify_poll_rate
+        self.__fencing_token = None
+        self.__attempts = 0
+
+    @classmethod
+    async def create(
+        cls,
+        key: str,
+        url: str,
+        mode: str = MODE_WRITE,
+        lock_acquisition_timeout: float = DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+        lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
+        lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        backend: Optional[str] = None,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+        share_client: bool = True,
+    ) -> "ReadWriteLock":
+        """Asynchronously create a Redis client and initialize the lock, for reading with
+        `mode="read"`, or writing with `mode="write"`. Takes the same options as
+        :meth:`AsyncLock.create`."""
+        return cls(
+            key,
+            await cls._connect(url, backend, share_client),
+            lock_acquisition_timeout,
+            lock_check_rate,
+            lock_expiry,
+            mode=mode,
+            wait_mode=wait_mode,
+            notify_poll_rate=notify_poll_rate,
+        )
+
+    @property
+    def mode(self) -> str:
+        """Whether we lock for reading or writing."""
+        return self.__mode
+
+    @property
+    def fencing_token(self) -> Optional[int]:
+        """The fencing counter for a writer's current acquisition, if it's taken the lock. Readers
+        don't get one, since they don't write."""
+        return self.__fencing_token
+
+    def __related_key(self, suffix: str) -> str:
+        """A key holding some of the lock's state; on a cluster, in the lock key's hash slot."""
+        return related_key(self.key, suffix, self.backend.cluster)
+
+    def __keys(self) -> List[str]:
+        return [
+            self.key,
+            self.__related_key(READERS_KEY_SUFFIX),
+            self.__related_key(WRITERS_KEY_SUFFIX),
+            self.__related_key(FENCE_KEY_SUFFIX),
+        ]
+
+    def __waiter_ttl(self) -> float:
+        """How long a waiting writer keeps readers out between attempts."""
+        interval = self.__lock_check_rate
+        if self.__wait_mode == WAIT_MODE_NOTIFY:
+            interval = self.__notify_poll_rate
+        return max(DEFAULT_QUEUE_WAITER_TTL, 3 * interval)
+
+    async def __set(self, token: str) -> bool:
+        self.__attempts += 1
+        sent_at = monotonic()
+        if self.__mode == MODE_READ:
+            ret = await self.backend.run_script(
+                ACQUIRE_READ, self.__keys()[:3], [token, self.lock_expiry * 1000]
+            )
+            if ret != 1:
+                return False
+        else:
+            ret = await self.backend.run_script(
+                ACQUIRE_WRITE,
+                self.__keys(),
+                [token, self.lock_expiry * 1000, int(self.__waiter_ttl() * 1000)],
+            )
+            if ret is None:
+                return False
+            self.__fencing_token = int(ret)
+
+        self._taken(token, sent_at)
+        return True
+
+    async def set_lock(self, value: Any, nx: bool = True) -> bool:
+        """Try to take the lock until we timeout. Readers wait while a writer holds the lock or is
+        waiting for it; writers wait for every reader to leave. `value` and `nx` are accepted for
+        compatibility with the other locks, but the lock is never taken over."""
+        started_at = monotonic()
+        self.__attempts = 0
+        timeout = self.__lock_acquisition_timeout
+        # Our token is the same across attempts, so a waiting writer keeps its single entry
+        token = new_owner_token()
+        if self.__wait_mode == WAIT_MODE_NOTIFY:
+            async with get_listener(self.backend).subscribe(self.key) as signal:
+                set_lock = await retry_acquisition(
+                    lambda: self.__set(token), timeout, lambda: self.__notify_poll_rate, signal
+                )
+        else:
+            set_lock = await retry_acquisition(
+                lambda: self.__set(token), timeout, lambda: self.__lock_check_rate
+            )
+
+        if set_lock is not True and self.__mode == MODE_WRITE:
+            # Stop keeping readers out
+            await self.backend.call("zrem", self.__keys()[2], token)
+
+        self._acquired(started_at, self.__attempts, set_lock is True)
+        return set_lock
+
+    def expiration_command(self) -> Command:
+        """The command refreshing our hold on the lock, so it can be batched with other locks':
+        a reader's lease, or the writer's key. Either is a single script."""
+        self._refresh_made()
+        args = [self.token or "", self.lock_expiry * 1000]
+        if self.__mode == MODE_READ:
+            return EXTEND_LEASE.command(self.__keys()[1:2], args)
+        return EXTEND.command([self.key], args)
+
+    async def set_expiration(self) -> bool:
+        """Refresh our hold on the lock, if we still have it. Returns whether we do."""
+        sent_at = monotonic()
+        args = [self.token or "", self.lock_expiry * 1000]
+        if self.__mode == MODE_READ:
+            ret = await self.backend.run_script(EXTEND_LEASE, self.__keys()[1:2], args)
+        else:
+            ret = await self.backend.run_script(EXTEND, [self.key], args)
+        return self.expiration_set(ret, sent_at)
+
+    async def release(self) -> None:
+        """Release our hold on the lock. Releasing the last reader or the writer tells anyone
+        waiting on the lock that it's free. Raises if we'd already lost the lock."""
+        args = [self.token or "", release_channel(self.key)]
+        if self.__mode == MODE_READ:
+            ret = await self.backend.run_script(RELEASE_READ, self.__keys()[:2], args)
+        else:
+            ret = await self.backend.run_script(RELEASE, [self.key], args)
+        self.__fencing_token = None
+        self._released(ret == 1)
+
+    async def exists(self) -> int:
+        """Count the lock's holders: the writer, or every reader. Mostly for testing."""
+        if self.__mode == MODE_READ:
+            return await self.backend.call("zcard", self.__keys()[1])
+        return await self.backend.call("exists", self.key)
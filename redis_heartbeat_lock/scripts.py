@@ -0,0 +1,305 @@
+"""Lua scripts run server-side, so multi-step lock operations happen atomically in one round-trip.
+
+Scripts are sent by SHA1 with `EVALSHA`. Each backend loads a script with `SCRIPT LOAD` the first
+time it needs it, and again if the server has since forgotten it, e.g. after a restart.
+"""
+
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence
+
+from .shared import Command
+
+
+class Script:
+    """A Lua script, identified by the SHA1 of its source."""
+
+    # The Lua source
+    source: str
+
+    # SHA1 of the source, as returned by `SCRIPT LOAD`
+    sha: str
+
+    # SHA1 -> every script we've defined
+    __registry: Dict[str, "Script"] = {}
+
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+        Script.__registry[self.sha] = self
+
+    def command(self, keys: Sequence[str], args: Sequence[Any] = ()) -> Command:
+        """The `EVALSHA` command running this script, e.g. to queue in a pipeline."""
+        return Command("evalsha", (self.sha, len(keys), *keys, *args))
+
+    @classmethod
+    def by_sha(cls, sha: str) -> Optional["Script"]:
+        """Look up a script we defined by its SHA1."""
+        return cls.__registry.get(sha)
+
+    @classmethod
+    def all(cls) -> List["Script"]:
+        """Every script we've defined, e.g. to load them all ahead of time."""
+        return list(cls.__registry.values())
+
+
+# Set KEYS[1] to the owner token ARGV[1] with a TTL of ARGV[2] milliseconds, if it isn't set. With
+# ARGV[3] == "0", set it regardless. On success, bump the fencing counter at KEYS[2] and return it;
+# otherwise return nil.
+ACQUIRE = Script(
+    """
+if ARGV[3] ~= "0" then
+    if not redis.call("set", KEYS[1], ARGV[1], "px", ARGV[2], "nx") then
+        return false
+    end
+else
+    redis.call("set", KEYS[1], ARGV[1], "px", ARGV[2])
+end
+return redis.call("incr", KEYS[2])
+"""
+)
+
+# Take KEYS[1] in turn. KEYS[3] is a queue of waiters' owner tokens, scored by arrival, and KEYS[4]
+# scores each waiter by when it'll be dropped from the queue unless it calls again. Queue the owner
+# token ARGV[1] if it isn't already. If it's at the head of the queue and the lock is free, set the
+# lock to it with a TTL of ARGV[2] milliseconds, leave the queue, and bump and return the fencing
+# counter at KEYS[2]. Otherwise, keep our place for another ARGV[3] milliseconds and return nil.
+ACQUIRE_FAIR = Script(
+    """
+local time = redis.call("time")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+for _, waiter in ipairs(redis.call("zrangebyscore", KEYS[4], "-inf", now)) do
+    redis.call("zrem", KEYS[3], waiter)
+    redis.call("zrem", KEYS[4], waiter)
+end
+if not redis.call("zscore", KEYS[3], ARGV[1]) then
+    local last = redis.call("zrange", KEYS[3], -1, -1, "withscores")
+    local ticket = 1
+    if last[2] then
+        ticket = tonumber(last[2]) + 1
+    end
+    redis.call("zadd", KEYS[3], ticket, ARGV[1])
+end
+if redis.call("zrange", KEYS[3], 0, 0)[1] == ARGV[1] then
+    if redis.call("set", KEYS[1], ARGV[1], "px", ARGV[2], "nx") then
+        redis.call("zrem", KEYS[3], ARGV[1])
+        redis.call("zrem", KEYS[4], ARGV[1])
+        return redis.call("incr", KEYS[2])
+    end
+end
+redis.call("zadd", KEYS[4], now + tonumber(ARGV[3]), ARGV[1])
+redis.call("pexpire", KEYS[3], ARGV[3])
+redis.call("pexpire", KEYS[4], ARGV[3])
+return false
+"""
+)
+
+# If KEYS[1] still holds our owner token ARGV[1], set a TTL of ARGV[2] milliseconds on it. Returns 1
+# if we extended the lock, 0 if it isn't ours any more.
+EXTEND = Script(
+    """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+)
+
+# If KEYS[1] still holds our owner token ARGV[1], delete it and publish a release to the channel
+# ARGV[2]. Returns 1 if we released the lock, 0 if it isn't ours any more.
+RELEASE = Script(
+    """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("del", KEYS[1])
+    redis.call("publish", ARGV[2], "released")
+    return 1
+end
+return 0
+"""
+)
+
+# Set the first half of KEYS to the owner token ARGV[1] with a TTL of ARGV[2] milliseconds, if none
+# of them are set. With ARGV[3] == "0", set them regardless. The second half of KEYS holds each
+# key's fencing counter, in the same order. On success, bump every counter and return them, in key
+# order; otherwise return an empty list.
+ACQUIRE_ALL = Script(
+    """
+local count = #KEYS / 2
+local nx = ARGV[3] ~= "0"
+if nx then
+    for i = 1, count do
+        if redis.call("exists", KEYS[i]) == 1 then
+            return {}
+        end
+    end
+end
+local fences = {}
+for i = 1, count do
+    redis.call("set", KEYS[i], ARGV[1], "px", ARGV[2])
+    fences[i] = redis.call("incr", KEYS[count + i])
+end
+return fences
+"""
+)
+
+# Set a TTL of ARGV[2] milliseconds on every key still holding our owner token ARGV[1]. Returns the
+# number of keys we extended.
+EXTEND_ALL = Script(
+    """
+local extended = 0
+for _, key in ipairs(KEYS) do
+    if redis.call("get", key) == ARGV[1] then
+        extended = extended + redis.call("pexpire", key, ARGV[2])
+    end
+end
+return extended
+"""
+)
+
+# Delete every key still holding our owner token ARGV[1], and publish a release to each of their
+# channels, prefixed by ARGV[2]. Returns the number of keys we released.
+RELEASE_ALL = Script(
+    """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call("get", key) == ARGV[1] then
+        released = released + redis.call("del", key)
+        redis.call("publish", ARGV[2] .. key, "released")
+    end
+end
+return released
+"""
+)
+
+# Take a shared (read) lock. KEYS[1] is the exclusive (write) lock, KEYS[2] a sorted set of readers'
+# owner tokens scored by when their leases expire, and KEYS[3] a sorted set of writers waiting for
+# the lock, scored likewise. Drop lapsed readers and writers, then give the owner token ARGV[1] a
+# lease of ARGV[2] milliseconds, unless a writer holds the lock or is waiting for it. Returns 1 if
+# we took the lock, 0 otherwise.
+ACQUIRE_READ = Script(
+    """
+local time = redis.call("time")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call("zremrangebyscore", KEYS[2], "-inf", now)
+redis.call("zremrangebyscore", KEYS[3], "-inf", now)
+if redis.call("exists", KEYS[1]) == 1 or redis.call("zcard", KEYS[3]) > 0 then
+    return 0
+end
+redis.call("zadd", KEYS[2], now + tonumber(ARGV[2]), ARGV[1])
+if redis.call("pttl", KEYS[2]) < tonumber(ARGV[2]) then
+    redis.call("pexpire", KEYS[2], ARGV[2])
+end
+return 1
+"""
+)
+
+# Extend the lease with owner token ARGV[1] in the sorted set of leases KEYS[1], scored by expiry,
+# to ARGV[2] milliseconds from now. Returns 1 if we extended it, 0 if it lapsed.
+EXTEND_LEASE = Script(
+    """
+local time = redis.call("time")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local lease = redis.call("zscore", KEYS[1], ARGV[1])
+if not lease or tonumber(lease) <= now then
+    return 0
+end
+redis.call("zadd", KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+if redis.call("pttl", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 1
+"""
+)
+
+# Drop the reader with owner token ARGV[1] from KEYS[2]. If it was the last reader, publish a
+# release to the channel ARGV[2], so waiting writers try again. Returns 1 if we were still a
+# reader, 0 otherwise.
+RELEASE_READ = Script(
+    """
+local released = redis.call("zrem", KEYS[2], ARGV[1])
+if released == 1 and redis.call("zcard", KEYS[2]) == 0 then
+    redis.call("publish", ARGV[2], "released")
+end
+return released
+"""
+)
+
+# Take an exclusive (write) lock, with the same keys as ACQUIRE_READ, and the fencing counter at
+# KEYS[4]. Drop lapsed readers and writers. If nobody holds the lock, set KEYS[1] to the owner
+# token ARGV[1] with a TTL of ARGV[2] milliseconds, and bump and return the fencing counter.
+# Otherwise, wait in KEYS[3] for another ARGV[3] milliseconds, so no new readers get in, and return
+# nil.
+ACQUIRE_WRITE = Script(
+    """
+local time = redis.call("time")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call("zremrangebyscore", KEYS[2], "-inf", now)
+redis.call("zremrangebyscore", KEYS[3], "-inf", now)
+if redis.call("zcard", KEYS[2]) == 0 then
+    if redis.call("set", KEYS[1], ARGV[1], "px", ARGV[2], "nx") then
+        redis.call("zrem", KEYS[3], ARGV[1])
+        return redis.call("incr", KEYS[4])
+    end
+end
+redis.call("zadd", KEYS[3], now + tonumber(ARGV[3]), ARGV[1])
+if redis.call("pttl", KEYS[3]) < tonumber(ARGV[3]) then
+    redis.call("pexpire", KEYS[3], ARGV[3])
+end
+return false
+"""
+)
+
+# Take one of ARGV[3] slots of a semaphore. KEYS[1] is a sorted set of leases' owner tokens, scored
+# by when they expire. Drop lapsed leases, then if there's a free slot, add a lease for the owner
+# token ARGV[1] lasting ARGV[2] milliseconds. Returns 1 if we took a slot, 0 otherwise.
+ACQUIRE_SEMAPHORE = Script(
+    """
+local time = redis.call("time")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call("zremrangebyscore", KEYS[1], "-inf", now)
+if redis.call("zcard", KEYS[1]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call("zadd", KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+if redis.call("pttl", KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 1
+"""
+)
+
+# Drop the lease with owner token ARGV[1] from the semaphore KEYS[1], and publish a release to the
+# channel ARGV[2], so waiters try again. Returns 1 if we still held the lease, 0 otherwise.
+RELEASE_SEMAPHORE = Script(
+    """
+local released = redis.call("zrem", KEYS[1], ARGV[1])
+if released == 1 then
+    redis.call("publish", ARGV[2], "released")
+end
+return released
+"""
+)
+
+# If the lock KEYS[1] still holds our owner token ARGV[1], set KEYS[2] to the result ARGV[2] with a
+# TTL of ARGV[3] milliseconds. Returns 1 if we published the result, 0 if the lock isn't ours any
+# more.
+PUBLISH_RESULT = Script(
+    """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("set", KEYS[2], ARGV[2], "px", ARGV[3])
+    return 1
+end
+return 0
+"""
+)
+
+# Delete KEYS[1], whoever holds it, and if it was held, publish a release to the channel ARGV[1].
+# Returns 1 if we released the lock, 0 if it wasn't held.
+FORCE_RELEASE = Script(
+    """
+local released = redis.call("del", KEYS[1])
+if released == 1 then
+    redis.call("publish", ARGV[1], "released")
+end
+return released
+"""
+)
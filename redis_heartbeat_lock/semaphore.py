@@ -0,0 +1,163 @@
+"""A distributed counting semaphore: at most `limit` holders of a key at once.
+
+The key is a sorted set of leases, each an owner token scored by when it expires. Taking a slot,
+refreshing a lease and releasing it are each a single script. Lapsed leases, left by holders that
+died without releasing, are dropped whenever someone next tries to take a slot, so they never need
+a sweeper. Like the other locks, a semaphore is held with a
+:class:`~redis_heartbeat_lock.context_manager.ContextManager`, which keeps its lease alive.
+"""
+
+import redis
+from typing import Any, Optional, Union
+
+from .backends import Backend, from_client
+from .base_lock import BaseLock, retry_acquisition
+from .notifications import get_listener, release_channel
+from .scripts import ACQUIRE_SEMAPHORE, EXTEND_LEASE, RELEASE_SEMAPHORE
+from .shared import (
+    Command,
+    DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+    DEFAULT_LOCK_CHECK_RATE,
+    DEFAULT_LOCK_EXPIRY,
+    DEFAULT_NOTIFY_POLL_RATE,
+    WAIT_MODE_NOTIFY,
+    WAIT_MODE_POLL,
+    monotonic,
+    new_owner_token,
+)
+
+
+class AsyncSemaphore(BaseLock):
+    """Takes one of `limit` slots on a key, held as a lease that the heartbeat refreshes."""
+
+    # Most leases held at once
+    __limit: int
+
+    # Timeout when acquiring a slot
+    __lock_acquisition_timeout: float
+
+    # Rate at which to check for a free slot when acquiring one
+    __lock_check_rate: float
+
+    # How we wait for a slot to be released
+    __wait_mode: str
+
+    # In notify mode, rate at which to check for a slot in case we missed a release notification
+    __notify_poll_rate: float
+
+    # Attempts made by the current call to `set_lock`
+    __attempts: int
+
+    def __init__(
+        self,
+        key: str,
+        limit: int,
+        client: Union[redis.Redis, Backend, Any],
+        lock_acquisition_timeout: float,
+        lock_check_rate: float,
+        lock_expiry: int,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+    ):
+        if limit < 1:
+            raise Exception(f"Semaphore limit must be at least 1, not {limit}.")
+        if wait_mode not in (WAIT_MODE_POLL, WAIT_MODE_NOTIFY):
+            raise Exception(f"Unknown wait mode {wait_mode}.")
+
+        # The key holds the leases, and our token identifies ours
+        super().__init__(key, from_client(client), lock_expiry)
+        self.__limit = limit
+        self.__lock_acquisition_timeout = lock_acquisition_timeout
+        self.__lock_check_rate = lock_check_rate
+        self.__wait_mode = wait_mode
+        self.__notify_poll_rate = notify_poll_rate
+        self.__attempts = 0
+
+    @classmethod
+    async def create(
+        cls,
+        key: str,
+        url: str,
+        limit: int,
+        lock_acquisition_timeout: float = DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+        lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
+        lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        backend: Optional[str] = None,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+        share_client: bool = True,
+    ) -> "AsyncSemaphore":
+        """Asynchronously create a Redis client and initialize the semaphore, allowing `limit`
+        holders at once. Takes the same options as :meth:`AsyncLock.create`."""
+        return cls(
+            key,
+            limit,
+            await cls._connect(url, backend, share_client),
+            lock_acquisition_timeout,
+            lock_check_rate,
+            lock_expiry,
+            wait_mode=wait_mode,
+            notify_poll_rate=notify_poll_rate,
+        )
+
+    @property
+    def limit(self) -> int:
+        """Most holders at once."""
+        return self.__limit
+
+    async def __set(self, token: str) -> bool:
+        self.__attempts += 1
+        sent_at = monotonic()
+        ret = await self.backend.run_script(
+            ACQUIRE_SEMAPHORE, [self.key], [token, self.lock_expiry * 1000, self.__limit]
+        )
+        if ret != 1:
+            return False
+        self._taken(token, sent_at)
+        return True
+
+    async def set_lock(self, value: Any, nx: bool = True) -> bool:
+        """Try to take a slot until we timeout. `value` and `nx` are accepted for compatibility
+        with the other locks."""
+        started_at = monotonic()
+        self.__attempts = 0
+        timeout = self.__lock_acquisition_timeout
+        token = new_owner_token()
+        if self.__wait_mode == WAIT_MODE_NOTIFY:
+            async with get_listener(self.backend).subscribe(self.key) as signal:
+                set_lock = await retry_acquisition(
+                    lambda: self.__set(token), timeout, lambda: self.__notify_poll_rate, signal
+                )
+        else:
+            set_lock = await retry_acquisition(
+                lambda: self.__set(token), timeout, lambda: self.__lock_check_rate
+            )
+
+        self._acquired(started_at, self.__attempts, set_lock is True)
+        return set_lock
+
+    def expiration_command(self) -> Command:
+        """The command refreshing our lease, so it can be batched with other locks'."""
+        self._refresh_made()
+        return EXTEND_LEASE.command([self.key], [self.token or "", self.lock_expiry * 1000])
+
+    async def set_expiration(self) -> bool:
+        """Refresh our lease, if we still hold it. Returns whether we do."""
+        sent_at = monotonic()
+        ret = await self.backend.run_script(
+            EXTEND_LEASE, [self.key], [self.token or "", self.lock_expiry * 1000]
+        )
+        return self.expiration_set(ret, sent_at)
+
+    async def release(self) -> None:
+        """Give up our slot, and tell anyone waiting for one. Raises if our lease had lapsed."""
+        ret = await self.backend.run_script(
+            RELEASE_SEMAPHORE, [self.key], [self.token or "", release_channel(self.key)]
+        )
+        self._released(ret == 1)
+
+    async def exists(self) -> int:
+        """Count the leases on the key, including any lapsed ones not yet dropped. Mostly for
+        testing."""
+        ret = await self.backend.call("zcard", self.key)
+        return ret
@@ -1,6 +1,146 @@
 """ Shared functions and constants used throughout the package. """
 
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, NamedTuple, Tuple
+
 DEFAULT_LOCK_ACQUISITION_TIMEOUT: float = 8.0
 DEFAULT_LOCK_CHECK_RATE: float = 0.2
 DEFAULT_LOCK_EXPIRY: int = 8
 DEFAULT_HEARTBEAT_PERIOD: int = DEFAULT_LOCK_EXPIRY / 2
+
+# Names of the backends that execute Redis commands for a lock
+BACKEND_NATIVE: str = "native"
+BACKEND_THREAD_POOL: str = "thread_pool"
+
+# URL schemes for a Redis Cluster, and the plain schemes `redis-py` expects in their place. Locks
+# created from such a URL route each key to the node serving its hash slot.
+CLUSTER_URL_SCHEMES: Dict[str, str] = {"redis+cluster": "redis", "rediss+cluster": "rediss"}
+
+# Hash slots in a Redis Cluster
+CLUSTER_SLOTS: int = 16384
+
+# Thread pools running the synchronous client: one for heartbeats, so they can't be held up behind
+# other work, and one for everything else. Each starts its threads on first use.
+THREAD_POOL_DEFAULT: str = "default"
+THREAD_POOL_HEARTBEAT: str = "heartbeat"
+DEFAULT_THREAD_POOL_WORKERS: int = 4
+DEFAULT_HEARTBEAT_THREAD_POOL_WORKERS: int = 2
+
+# How waiters find out a held lock was released: by polling, or by listening for release
+# notifications (with polling kept as a safety net)
+WAIT_MODE_POLL: str = "poll"
+WAIT_MODE_NOTIFY: str = "notify"
+
+# In notify mode, how often waiters poll anyway, in case a notification was missed
+DEFAULT_NOTIFY_POLL_RATE: float = 1.0
+
+# Prefix of the channels holders publish to when releasing a lock
+RELEASE_CHANNEL_PREFIX: str = "redis_heartbeat_lock:released:"
+
+# How often the shared heartbeat scheduler checks for due refreshes, in seconds
+DEFAULT_HEARTBEAT_TICK: float = 0.1
+
+# Adaptive heartbeats: the least fraction of a lock's expiry left on it when a refresh lands, and
+# the shortest time between refreshes, in seconds, however slow Redis gets
+DEFAULT_HEARTBEAT_SAFETY_MARGIN: float = 0.25
+DEFAULT_HEARTBEAT_MIN_PERIOD: float = 0.05
+
+# Allowance for Redis's clock running faster than ours when estimating how long we hold a lock: a
+# fraction of the lock's expiry, plus a fixed amount in seconds
+DEFAULT_LEASE_DRIFT_FACTOR: float = 0.01
+DEFAULT_LEASE_DRIFT: float = 0.002
+
+# Shared connection pools: most connections per pool, seconds to wait for a free connection, and
+# seconds a connection can idle before we check it's alive before using it
+DEFAULT_MAX_CONNECTIONS: int = 50
+DEFAULT_POOL_TIMEOUT: float = 5.0
+DEFAULT_HEALTH_CHECK_INTERVAL: float = 30.0
+
+# Where the Prometheus exporter listens by default, and the prefix of its metric names
+DEFAULT_METRICS_HOST: str = "127.0.0.1"
+DEFAULT_METRICS_PORT: int = 9464
+METRICS_PREFIX: str = "redis_heartbeat_lock"
+
+# Suffix of the key holding a lock's fencing counter
+FENCE_KEY_SUFFIX: str = ":fence"
+
+# How waiters retry a contended lock: on a fixed period, with decorrelated jitter, or in a fair
+# queue, taking the lock in the order they asked for it
+STRATEGY_FIXED: str = "fixed"
+STRATEGY_JITTER: str = "jitter"
+STRATEGY_FAIR: str = "fair"
+
+# With jittered retries, the smallest and largest delay between attempts, in seconds
+DEFAULT_BACKOFF_BASE: float = 0.02
+DEFAULT_BACKOFF_CAP: float = 1.0
+
+# Suffixes of the keys holding a lock's fair queue: waiters in arrival order, and when each waiter
+# will be dropped from the queue if it stops checking in
+QUEUE_KEY_SUFFIX: str = ":queue"
+QUEUE_DEADLINES_KEY_SUFFIX: str = ":queue:deadlines"
+
+# Least time, in seconds, a waiter in a fair queue keeps its place without checking in
+DEFAULT_QUEUE_WAITER_TTL: float = 2.0
+
+# With a lock across several independent Redis nodes, how long to wait on each node, in seconds.
+# Kept short next to the lock's expiry, so a node that's down doesn't eat into it.
+DEFAULT_NODE_TIMEOUT: float = 0.25
+
+# Suffix of the key a single-flight computation publishes its result to
+RESULT_KEY_SUFFIX: str = ":result"
+
+# Single-flight results: how long they're kept, in seconds, and how many we cache in memory
+DEFAULT_RESULT_TTL: float = 60.0
+DEFAULT_RESULT_CACHE_SIZE: int = 1024
+
+# Suffix of the key naming a leader election's current leader
+LEADER_KEY_SUFFIX: str = ":leader"
+
+# How many keys an admin scan asks Redis to look at per `SCAN` call, and so per pipelined batch
+# of lookups. Small enough that no single call keeps Redis busy for long.
+DEFAULT_SCAN_COUNT: int = 1000
+
+# Seconds a simulated client waits for a reply before giving up, so dropped replies time out
+# rather than hanging the simulation
+DEFAULT_SIMULATION_SOCKET_TIMEOUT: float = 1.0
+
+# Modes of a read/write lock: shared between readers, or exclusive to one writer
+MODE_READ: str = "read"
+MODE_WRITE: str = "write"
+
+# Suffixes of the keys holding a read/write lock's readers, and the writers waiting for it
+READERS_KEY_SUFFIX: str = ":readers"
+WRITERS_KEY_SUFFIX: str = ":writers"
+
+
+class Command(NamedTuple):
+    """A single `redis-py` client method call, e.g. queued in a pipeline."""
+
+    # Name of the client method, e.g. `expire`
+    name: str
+
+    # Positional arguments
+    args: Tuple = ()
+
+    # Keyword arguments
+    kwargs: Dict[str, Any] = {}
+
+
+def monotonic() -> float:
+    """The running event loop's clock, or `time.monotonic` outside of one. They're the same clock,
+    unless the loop keeps virtual time, e.g. in a simulation."""
+    try:
+        return asyncio.get_running_loop().time()
+    except RuntimeError:
+        return time.monotonic()
+
+
+def new_owner_token() -> str:
+    """A token identifying a single acquisition of a lock: who took it, a random part so no two
+    acquisitions ever share a token, and when it was made, in milliseconds since the epoch, so
+    anyone inspecting the lock can tell how long it's been held."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}@{int(time.time() * 1000)}"
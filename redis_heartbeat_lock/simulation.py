@@ -0,0 +1,226 @@
+"""Deterministic simulation: run locks against an in-process Redis on a virtual clock.
+
+A :class:`SimulatedEventLoop` keeps virtual time. Whenever every task is waiting on a timer, it
+jumps straight to the next one instead of sleeping, so a minute of heartbeats takes milliseconds,
+and a scenario plays out the same way every time it's run with the same seed. A
+:class:`Simulation` runs a :class:`~redis_heartbeat_lock.testing.FakeRedis` on that clock, and
+hands out clients that talk to it over in-memory connections, so no sockets or threads are
+involved. Faults are injected by the scenario: latency and dropped replies, dropped connections,
+stalls of the whole process, and failovers to a replica that missed the latest writes. Keys
+expire on the virtual clock too.
+"""
+
+import asyncio
+import random
+import selectors
+from typing import Any, Awaitable, List, Optional, TypeVar
+
+from .backends import Backend, from_client
+from .shared import DEFAULT_SIMULATION_SOCKET_TIMEOUT
+from .testing import FakeRedis, FakeRedisServer, Keyspace
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis-py < 4.2
+    aioredis = None  # type: ignore
+
+T = TypeVar("T")
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    """Wraps the loop's real selector, and advances the virtual clock instead of waiting."""
+
+    # Virtual time, in seconds
+    now: float
+
+    def __init__(self, start: float):
+        self.now = start
+        self.__selector = selectors.DefaultSelector()
+
+    def register(self, fileobj, events, data=None):
+        return self.__selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self.__selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self.__selector.modify(fileobj, events, data)
+
+    def get_map(self):
+        return self.__selector.get_map()
+
+    def close(self) -> None:
+        self.__selector.close()
+
+    def select(self, timeout: Optional[float] = None):
+        ready = self.__selector.select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            raise Exception("The simulation is stuck: every task is waiting, and no timer is set.")
+        self.now += timeout
+        return []
+
+
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+    """An event loop on a virtual clock, which jumps to the next timer whenever nothing is ready
+    to run. Only suits code that doesn't wait on real I/O or other threads."""
+
+    # The selector keeping our virtual time
+    __selector: _VirtualSelector
+
+    def __init__(self, start: float = 0.0):
+        self.__selector = _VirtualSelector(start)
+        super().__init__(self.__selector)
+
+    def time(self) -> float:
+        return self.__selector.now
+
+    def stall(self, seconds: float) -> None:
+        """Move the clock forward without running anything, as if the whole process had been
+        paused, e.g. by a long garbage collection or a VM migration."""
+        self.__selector.now += seconds
+
+
+if aioredis is not None:
+
+    class SimulatedConnection(aioredis.Connection):
+        """A `redis-py` connection to a simulation's server, over an in-memory stream."""
+
+        def __init__(self, *, simulation: "Simulation", **kwargs: Any):
+            self.simulation = simulation
+            super().__init__(**kwargs)
+
+        async def _connect(self) -> None:
+            if not self.simulation.reachable:
+                raise ConnectionRefusedError("The simulated Redis is unreachable.")
+            self._reader, self._writer = await self.simulation.server.connect()
+
+        def repr_pieces(self):
+            return [("simulation", self.simulation.seed)]
+
+        def _host_error(self) -> str:
+            return "simulation"
+
+
+class Simulation:
+    """A simulated Redis on a virtual clock, and the event loop to run a scenario against it."""
+
+    # Seeds `random` while the scenario runs, and the server's dropped replies
+    seed: int
+
+    # Random numbers for the scenario's own choices, seeded with `seed`
+    random: random.Random
+
+    # The loop the scenario runs on
+    loop: SimulatedEventLoop
+
+    # The server clients connect to
+    server: FakeRedisServer
+
+    # Whether clients can connect; existing connections are unaffected
+    reachable: bool
+
+    # Seconds clients wait for a reply before giving up
+    __socket_timeout: float
+
+    # Clients handed out, to close when the scenario ends
+    __clients: List[Backend]
+
+    # The keyspace as the replica last saw it, if it's been replicated to
+    __replica: Optional[Keyspace]
+
+    def __init__(
+        self,
+        seed: int = 0,
+        latency: Any = 0.0,
+        drop_rate: float = 0.0,
+        socket_timeout: float = DEFAULT_SIMULATION_SOCKET_TIMEOUT,
+    ):
+        if aioredis is None:
+            raise Exception("Simulations require redis-py 4.2 or later.")
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.loop = SimulatedEventLoop()
+        self.server = FakeRedisServer(
+            FakeRedis(clock=self.loop.time), latency=latency, drop_rate=drop_rate, seed=seed
+        )
+        self.reachable = True
+        self.__socket_timeout = socket_timeout
+        self.__clients = []
+        self.__replica = None
+
+    @property
+    def engine(self) -> FakeRedis:
+        """The simulated Redis's keyspace."""
+        return self.server.engine
+
+    def client(self) -> Backend:
+        """A new client of the simulated Redis, with its own connection pool."""
+        pool = aioredis.ConnectionPool(
+            connection_class=SimulatedConnection,
+            simulation=self,
+            socket_timeout=self.__socket_timeout,
+        )
+        backend = from_client(aioredis.Redis(connection_pool=pool))
+        self.__clients.append(backend)
+        return backend
+
+    def now(self) -> float:
+        """Virtual time, in seconds since the simulation started."""
+        return self.loop.time()
+
+    def get(self, key: str) -> Optional[str]:
+        """A string key's value right now, read straight from the keyspace, without taking any
+        simulated time, e.g. to check an invariant."""
+        value = self.engine.execute([b"GET", key.encode()])
+        return value.decode() if isinstance(value, bytes) else None
+
+    def stall(self, seconds: float) -> None:
+        """Pause the whole process for `seconds` of virtual time: nothing runs, but keys expire."""
+        self.loop.stall(seconds)
+
+    def disconnect(self) -> None:
+        """Drop every client connection, as a network blip would."""
+        self.server.disconnect_all()
+
+    def replicate(self) -> None:
+        """Bring the replica up to date with every write made so far."""
+        self.__replica = self.engine.snapshot()
+
+    def fail_over(self) -> None:
+        """Promote the replica, losing every write made since it was last brought up to date, and
+        drop every client connection."""
+        if self.__replica is None:
+            self.engine.flushall()
+        else:
+            self.engine.restore(self.__replica)
+        self.disconnect()
+
+    def run(self, main: Awaitable[T]) -> T:
+        """Run a scenario to completion on virtual time, and return its result. `random` is seeded
+        with `seed` while it runs, so jittered retries play out the same way each time. Tasks
+        still running when the scenario returns are cancelled, and the loop is closed."""
+        state = random.getstate()
+        random.seed(self.seed)
+        loop = self.loop
+        try:
+            loop.run_until_complete(self.server.start(listen=False))
+            return loop.run_until_complete(main)
+        finally:
+            try:
+                loop.run_until_complete(self.__shut_down())
+                loop.run_until_complete(loop.shutdown_asyncgens())
+            finally:
+                loop.close()
+                random.setstate(state)
+
+    async def __shut_down(self) -> None:
+        for backend in self.__clients:
+            await backend.close()
+            await backend.client.connection_pool.disconnect()
+        await self.server.stop()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,307 @@
+"""Single-flight computation: however many workers want a result at once, only one computes it.
+
+The first worker to take the key's :class:`~redis_heartbeat_lock.async_lock.AsyncLock` computes
+the result under a :class:`~redis_heartbeat_lock.context_manager.ContextManager`, and publishes it
+to a result key next to the lock, for `ttl` seconds, before releasing the lock. Everyone else
+waits for the result to appear rather than failing to get the lock, and reads it when it does. If
+the holder fails or dies without publishing, the next waiter takes the lock and computes it
+instead. Within a process, callers wanting the same key share one fetch, and results are kept in a
+local cache, bounded in size and never kept past their TTL in Redis.
+"""
+
+import asyncio
+import contextlib
+import json
+import redis
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from .async_lock import AsyncLock
+from .backends import Backend, from_client, from_url
+from .cluster import related_key
+from .context_manager import ContextManager
+from .heartbeat import HeartbeatScheduler
+from .notifications import get_listener
+from .pool import get_registry
+from .scripts import PUBLISH_RESULT
+from .shared import (
+    Command,
+    DEFAULT_HEARTBEAT_PERIOD,
+    DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+    DEFAULT_LOCK_CHECK_RATE,
+    DEFAULT_LOCK_EXPIRY,
+    DEFAULT_NOTIFY_POLL_RATE,
+    DEFAULT_RESULT_CACHE_SIZE,
+    DEFAULT_RESULT_TTL,
+    RESULT_KEY_SUFFIX,
+    WAIT_MODE_NOTIFY,
+    WAIT_MODE_POLL,
+    monotonic,
+)
+
+# Stands in for a result we don't have, since `None` is a valid result
+_MISSING = object()
+
+
+class ResultCache:
+    """Results kept in memory until they expire. Beyond `max_size` results, the least recently
+    used is dropped."""
+
+    # Key -> (when it expires, on the monotonic clock; the result), least recently used first
+    __entries: "OrderedDict[str, Tuple[float, Any]]"
+
+    # Most results we keep
+    __max_size: int
+
+    def __init__(self, max_size: int = DEFAULT_RESULT_CACHE_SIZE):
+        self.__entries = OrderedDict()
+        self.__max_size = max_size
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """The key's result, or `default` if we don't have it or it's expired."""
+        entry = self.__entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= monotonic():
+            del self.__entries[key]
+            return default
+        self.__entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        """Keep the key's result for `ttl` seconds."""
+        if self.__max_size <= 0 or ttl <= 0:
+            return
+        self.__entries[key] = (monotonic() + ttl, value)
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        self.__entries.pop(key, None)
+
+
+class SingleFlight:
+    """Computes each key's result once across every worker sharing Redis, and caches it."""
+
+    # The backend executing our Redis commands
+    __backend: Backend
+
+    # How long a published result lasts, in seconds
+    __ttl: float
+
+    # How long to wait for someone else's result before giving up, in seconds
+    __timeout: float
+
+    # Rate at which to check for a result while waiting for one
+    __lock_check_rate: float
+
+    # Expiration of the lock held while computing, in seconds
+    __lock_expiry: int
+
+    # Period of the heartbeat keeping the lock alive while computing
+    __period: float
+
+    # Shared scheduler running the heartbeat, if any
+    __scheduler: Optional[HeartbeatScheduler]
+
+    # How we wait for a result: polling, or woken when the computing worker releases the lock
+    __wait_mode: str
+
+    # In notify mode, rate at which to check for a result in case we missed a release notification
+    __notify_poll_rate: float
+
+    # Turn a result into the string or bytes we store in Redis, and back
+    __dumps: Callable[[Any], Union[str, bytes]]
+    __loads: Callable[[Union[str, bytes]], Any]
+
+    # Results we've seen recently
+    __cache: ResultCache
+
+    # Key -> the fetch under way in this process, for other callers to share
+    __flights: "Dict[str, asyncio.Future[Any]]"
+
+    def __init__(
+        self,
+        client: Union[redis.Redis, Backend, Any],
+        ttl: float = DEFAULT_RESULT_TTL,
+        max_size: int = DEFAULT_RESULT_CACHE_SIZE,
+        timeout: float = DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+        lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
+        lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        period: float = DEFAULT_HEARTBEAT_PERIOD,
+        scheduler: Optional[HeartbeatScheduler] = None,
+        wait_mode: str = WAIT_MODE_POLL,
+        notify_poll_rate: float = DEFAULT_NOTIFY_POLL_RATE,
+        dumps: Callable[[Any], Union[str, bytes]] = json.dumps,
+        loads: Callable[[Union[str, bytes]], Any] = json.loads,
+    ):
+        if wait_mode not in (WAIT_MODE_POLL, WAIT_MODE_NOTIFY):
+            raise Exception(f"Unknown wait mode {wait_mode}.")
+
+        self.__backend = from_client(client)
+        self.__ttl = ttl
+        self.__timeout = timeout
+        self.__lock_check_rate = lock_check_rate
+        self.__lock_expiry = lock_expiry
+        self.__period = period
+        self.__scheduler = scheduler
+        self.__wait_mode = wait_mode
+        self.__notify_poll_rate = notify_poll_rate
+        self.__dumps = dumps
+        self.__loads = loads
+        self.__cache = ResultCache(max_size)
+        self.__flights = {}
+
+    @classmethod
+    async def create(
+        cls,
+        url: str,
+        backend: Optional[str] = None,
+        share_client: bool = True,
+        **kwargs: Any,
+    ) -> "SingleFlight":
+        """Asynchronously create a Redis client and initialize the helper. Results are kept for
+        `ttl` seconds, and up to `max_size` of them in memory. Waiters give up after `timeout`
+        seconds; in notify mode, they check for the result as soon as the computing worker
+        releases the lock. Results are stored as JSON, unless given other `dumps` and `loads`."""
+        if share_client:
+            client = await get_registry().get(url, backend)
+        else:
+            client = await from_url(url, backend)
+        return cls(client, **kwargs)
+
+    @property
+    def cache(self) -> ResultCache:
+        """The results kept in memory."""
+        return self.__cache
+
+    def __result_key(self, key: str) -> str:
+        return related_key(key, RESULT_KEY_SUFFIX, self.__backend.cluster)
+
+    async def get(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Get the key's result: from memory, from Redis if another worker computed it, or by
+        computing it with `compute` while holding the key's lock. Raises whatever `compute` raises,
+        to every caller in this process waiting on it, or if no result turns up in time."""
+        while True:
+            value = self.__cache.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+            flight = self.__flights.get(key)
+            if flight is None:
+                break
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # The caller fetching it was cancelled, not us; try again
+
+        flight = asyncio.get_running_loop().create_future()
+        self.__flights[key] = flight
+        try:
+            value = await self.__fetch(key, compute)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            # Nobody else may be waiting on it; don't have asyncio warn the error went unseen
+            flight.exception()
+            raise
+        finally:
+            del self.__flights[key]
+        flight.set_result(value)
+        return value
+
+    async def __read(self, key: str) -> Any:
+        """Read the key's published result from Redis, and cache it for as long as it lasts."""
+        value, ttl = await self.__backend.pipeline(
+            [Command("get", (self.__result_key(key),)), Command("pttl", (self.__result_key(key),))]
+        )
+        for result in (value, ttl):
+            if isinstance(result, Exception):
+                raise result
+        if value is None:
+            return _MISSING
+        value = self.__loads(value)
+        self.__cache.put(key, value, self.__ttl if ttl < 0 else min(self.__ttl, ttl / 1000))
+        return value
+
+    async def __fetch(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Read the result, or take the lock and compute it, or wait for whoever has the lock to
+        publish it. In notify mode, we subscribe to the lock's releases before first trying it, so
+        we can't miss one between a failed attempt and starting to wait."""
+        value = await self.__read(key)
+        if value is not _MISSING:
+            return value
+
+        started_at = monotonic()
+        async with contextlib.AsyncExitStack() as stack:
+            signal = None
+            if self.__wait_mode == WAIT_MODE_NOTIFY:
+                signal = await stack.enter_async_context(
+                    get_listener(self.__backend).subscribe(key)
+                )
+            while True:
+                value = await self.__compute(key, compute)
+                if value is not _MISSING:
+                    return value
+
+                remaining = self.__timeout - (monotonic() - started_at)
+                if remaining <= 0:
+                    raise Exception(f"{key} timed out waiting for its result.")
+                if signal is not None:
+                    await signal.wait(min(self.__notify_poll_rate, remaining))
+                else:
+                    await asyncio.sleep(min(self.__lock_check_rate, remaining))
+
+                value = await self.__read(key)
+                if value is not _MISSING:
+                    return value
+
+    async def __compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Try the lock once. If we get it, compute and publish the result before releasing it.
+        Returns `_MISSING` if someone else holds the lock."""
+        lock = AsyncLock(key, self.__backend, 0, self.__lock_check_rate, self.__lock_expiry)
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                await stack.enter_async_context(
+                    ContextManager(lock, period=self.__period, scheduler=self.__scheduler)
+                )
+            except asyncio.CancelledError:
+                # Before Python 3.8, cancellation is an `Exception`; don't mistake it for a failure
+                raise
+            except Exception:  # pylint: disable=broad-except
+                # Someone else is computing it. If Redis failed us instead, our next read raises.
+                return _MISSING
+
+            # Someone may have published it between our last read and taking the lock
+            value = await self.__read(key)
+            if value is not _MISSING:
+                return value
+
+            encoded = self.__dumps(await compute())
+            published = await self.__backend.run_script(
+                PUBLISH_RESULT,
+                [key, self.__result_key(key)],
+                [lock.token or "", encoded, int(self.__ttl * 1000)],
+            )
+            if published != 1:
+                raise Exception(f"{key} lost lock before publishing its result.")
+
+        # Hand back what everyone else will read, e.g. lists in place of tuples with JSON
+        value = self.__loads(encoded)
+        self.__cache.put(key, value, self.__ttl)
+        return value
+
+    async def invalidate(self, key: str) -> None:
+        """Forget the key's result, here and in Redis, so the next caller computes it again.
+        Other processes may serve it from memory until it expires there."""
+        self.__cache.discard(key)
+        await self.__backend.call("delete", self.__result_key(key))
@@ -0,0 +1,473 @@
+"""A lock for synchronous code, e.g. batch jobs that don't run an event loop.
+
+A :class:`SyncLock` calls the synchronous `redis-py` client directly, so it needs neither an event
+loop nor our thread pools. Held locks are refreshed by one process-wide daemon thread, however
+many locks are held, which batches the refreshes due each tick into one pipelined round-trip per
+client. The lock uses the same keys, scripts and owner tokens as an
+:class:`~redis_heartbeat_lock.async_lock.AsyncLock`, so sync and async holders of a key exclude
+each other.
+"""
+
+import logging
+import redis
+import threading
+import time
+from redis.exceptions import NoScriptError
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .backends import RedisCluster, queue_command
+from .base_lock import finish_release
+from .cluster import related_key
+from .instrumentation import get_instrumentation
+from .lease import Lease
+from .notifications import release_channel
+from .pool import get_registry
+from .scripts import ACQUIRE, EXTEND, RELEASE, Script
+from .shared import (
+    Command,
+    DEFAULT_HEARTBEAT_PERIOD,
+    DEFAULT_HEARTBEAT_TICK,
+    DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+    DEFAULT_LOCK_CHECK_RATE,
+    DEFAULT_LOCK_EXPIRY,
+    FENCE_KEY_SUFFIX,
+    monotonic,
+    new_owner_token,
+)
+
+_logger = logging.getLogger(__name__)
+
+
+def _run_script(client: Any, script: Script, keys: Sequence[str], args: Sequence[Any] = ()) -> Any:
+    """Run a script by SHA1, loading it first if the server doesn't know it yet."""
+    command = script.command(keys, args)
+    try:
+        return getattr(client, command.name)(*command.args)
+    except NoScriptError:
+        client.script_load(script.source)
+        return getattr(client, command.name)(*command.args)
+
+
+def _pipeline(client: Any, commands: Sequence[Command]) -> List[Any]:
+    """Send the given commands in a single round-trip, without a transaction, returning errors in
+    place of results. Scripts the server doesn't know are loaded, and their commands resent."""
+
+    def _execute(batch: Sequence[Command]) -> List[Any]:
+        pipe = client.pipeline(transaction=False)
+        for command in batch:
+            queue_command(pipe, command)
+        return pipe.execute(raise_on_error=False)
+
+    results = _execute(commands)
+    missing = [i for i, result in enumerate(results) if isinstance(result, NoScriptError)]
+    if missing:
+        for sha in {commands[i].args[0] for i in missing}:
+            script = Script.by_sha(sha)
+            if script is not None:
+                client.script_load(script.source)
+        for i, result in zip(missing, _execute([commands[i] for i in missing])):
+            results[i] = result
+    return results
+
+
+class SyncLock:
+    """Holds a key in Redis from synchronous code. Use it in a `with` block, which takes the lock,
+    has the shared heartbeat thread keep it alive, and releases it afterwards."""
+
+    # The key to lock on
+    __key: str
+
+    # The synchronous Redis client
+    __client: Any
+
+    # Timeout when acquiring the lock
+    __lock_acquisition_timeout: float
+
+    # Rate at which to check lock when acquiring it
+    __lock_check_rate: float
+
+    # Expiration of the lock, in seconds
+    __lock_expiry: int
+
+    # Seconds between refreshes while held in a `with` block
+    __period: float
+
+    # Called with the reason, from the heartbeat thread, as soon as we find we've lost the lock
+    __on_lost: Optional[Callable[[Exception], None]]
+
+    # How long we can count on holding the lock, from when we last set or refreshed it
+    __lease: Lease
+
+    # When we last made our expiration command, on the monotonic clock
+    __refresh_made_at: float
+
+    # Token identifying our current acquisition, stored as the lock's value
+    __token: Optional[str]
+
+    # Fencing counter for our current acquisition
+    __fencing_token: Optional[int]
+
+    # Attempts made by the current call to `set_lock`
+    __attempts: int
+
+    # When we took the lock, on the monotonic clock, if we hold it
+    __acquired_at: Optional[float]
+
+    # Our registration with the heartbeat thread, while held in a `with` block
+    __registration: Optional["SyncHeartbeatRegistration"]
+
+    # Set as soon as the heartbeat finds we've lost the lock
+    lost: threading.Event
+
+    def __init__(
+        self,
+        key: str,
+        client: Any,
+        lock_acquisition_timeout: float,
+        lock_check_rate: float,
+        lock_expiry: int,
+        period: float = DEFAULT_HEARTBEAT_PERIOD,
+        on_lost: Optional[Callable[[Exception], None]] = None,
+    ):
+        self.__key = key
+        self.__client = client
+        self.__lock_acquisition_timeout = lock_acquisition_timeout
+        self.__lock_check_rate = lock_check_rate
+        self.__lock_expiry = lock_expiry
+        self.__period = period
+        self.__on_lost = on_lost
+        self.__lease = Lease(lock_expiry)
+        self.__refresh_made_at = 0.0
+        self.__token = None
+        self.__fencing_token = None
+        self.__attempts = 0
+        self.__acquired_at = None
+        self.__registration = None
+        self.lost = threading.Event()
+
+    @classmethod
+    def create(
+        cls,
+        key: str,
+        url: str,
+        lock_acquisition_timeout: float = DEFAULT_LOCK_ACQUISITION_TIMEOUT,
+        lock_check_rate: float = DEFAULT_LOCK_CHECK_RATE,
+        lock_expiry: int = DEFAULT_LOCK_EXPIRY,
+        period: float = DEFAULT_HEARTBEAT_PERIOD,
+        on_lost: Optional[Callable[[Exception], None]] = None,
+        share_client: bool = True,
+    ) -> "SyncLock":
+        """Create a Redis client and initialize the lock. Takes the same options as
+        :meth:`AsyncLock.create`, plus the heartbeat's `period` and `on_lost` callback. Locks on
+        the same URL share the client the thread-pool backend uses; pass `share_client=False` to
+        give this lock a client of its own."""
+        if share_client:
+            client = get_registry().sync_client(url)
+        else:
+            client = redis.Redis.from_url(url=url)
+        return cls(
+            key,
+            client,
+            lock_acquisition_timeout,
+            lock_check_rate,
+            lock_expiry,
+            period=period,
+            on_lost=on_lost,
+        )
+
+    @property
+    def key(self) -> str:
+        """The key we lock on."""
+        return self.__key
+
+    @property
+    def client(self) -> Any:
+        """The synchronous Redis client."""
+        return self.__client
+
+    @property
+    def lock_expiry(self) -> float:
+        """How long the lock lasts after each refresh, in seconds."""
+        return self.__lock_expiry
+
+    @property
+    def lease(self) -> Lease:
+        """Our lease on the lock, to check how long we can count on holding it without asking
+        Redis."""
+        return self.__lease
+
+    @property
+    def token(self) -> Optional[str]:
+        """The token identifying our current acquisition of the lock, if we've taken it."""
+        return self.__token
+
+    @property
+    def fencing_token(self) -> Optional[int]:
+        """The fencing counter for our current acquisition of the lock, if we've taken it."""
+        return self.__fencing_token
+
+    def __set(self, nx: bool) -> bool:
+        self.__attempts += 1
+        cluster = RedisCluster is not None and isinstance(self.__client, RedisCluster)
+        token = new_owner_token()
+        sent_at = monotonic()
+        ret = _run_script(
+            self.__client,
+            ACQUIRE,
+            [self.__key, related_key(self.__key, FENCE_KEY_SUFFIX, cluster)],
+            [token, self.__lock_expiry * 1000, 1 if nx else 0],
+        )
+        if ret is None:
+            return False
+
+        self.__token = token
+        self.__fencing_token = int(ret)
+        self.__lease.renewed(sent_at)
+        return True
+
+    def set_lock(self, value: Any = True, nx: bool = True) -> bool:
+        """Try to set the key until we timeout, checking every `lock_check_rate` seconds. Like
+        :meth:`AsyncLock.set_lock`, the key's value is a token unique to this acquisition."""
+        started_at = monotonic()
+        self.__attempts = 0
+        set_lock = self.__set(nx)
+        while set_lock is not True and (
+            (monotonic() - started_at) < self.__lock_acquisition_timeout
+        ):
+            time.sleep(self.__lock_check_rate)
+            set_lock = self.__set(nx)
+
+        if set_lock is True:
+            self.__acquired_at = monotonic()
+
+        get_instrumentation().acquisition(
+            self.__key, monotonic() - started_at, self.__attempts, set_lock is True
+        )
+        return set_lock
+
+    def expiration_command(self) -> Command:
+        """The command refreshing the lock's expiration, so it can be batched with other locks'.
+        It only extends the lock if it still holds our token."""
+        self.__refresh_made_at = monotonic()
+        return EXTEND.command([self.__key], [self.__token or "", self.__lock_expiry * 1000])
+
+    def expiration_set(self, result: Any, sent_at: Optional[float] = None) -> bool:
+        """Record the result of our expiration command. Returns whether we still hold the lock."""
+        if result == 1:
+            self.__lease.renewed(self.__refresh_made_at if sent_at is None else sent_at)
+            return True
+        self.__lease.end()
+        return False
+
+    def set_expiration(self) -> bool:
+        """Extend the lock, if we still hold it. Returns whether we do."""
+        sent_at = monotonic()
+        ret = _run_script(
+            self.__client, EXTEND, [self.__key], [self.__token or "", self.__lock_expiry * 1000]
+        )
+        return self.expiration_set(ret, sent_at)
+
+    def release(self) -> None:
+        """Release the lock, if it's still ours, and tell anyone waiting on it that it's free.
+        Raises if we'd already lost the lock."""
+        ret = _run_script(
+            self.__client, RELEASE, [self.__key], [self.__token or "", release_channel(self.__key)]
+        )
+        self.__token = None
+        self.__fencing_token = None
+        self.__lease.end()
+        acquired_at, self.__acquired_at = self.__acquired_at, None
+        finish_release(self.__key, acquired_at, ret == 1)
+
+    def exists(self) -> int:
+        """Check whether the key exists. Mostly for testing."""
+        return self.__client.exists(self.__key)
+
+    def __lose(self, reason: Exception) -> None:
+        self.lost.set()
+        if self.__on_lost is not None:
+            self.__on_lost(reason)
+
+    def __enter__(self) -> "SyncLock":
+        """Take the lock, and have the shared heartbeat thread refresh it every period."""
+        if self.set_lock(True, True) is not True:
+            raise Exception("Failed to get lock.")
+        self.lost = threading.Event()
+        self.__registration = get_heartbeat_thread().register(
+            self, self.__period, on_failure=self.__lose
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        """Stop refreshing the lock and release it. If we lost the lock while holding it, why is
+        raised here."""
+        registration, self.__registration = self.__registration, None
+        if registration is not None:
+            get_heartbeat_thread().unregister(registration)
+        reason = registration.reason if registration is not None else None
+        if reason is None:
+            self.release()
+            return
+
+        try:
+            self.release()
+        except Exception:  # pylint: disable=broad-except
+            # We already know we lost it
+            pass
+        raise reason
+
+
+class SyncHeartbeatRegistration:
+    """A lock registered with the :class:`SyncHeartbeatThread`."""
+
+    # The lock to refresh
+    lock: SyncLock
+
+    # Seconds between refreshes
+    period: float
+
+    # When the next refresh is due, on the monotonic clock
+    next_due: float
+
+    # Why the lock failed to refresh, if it did
+    reason: Optional[Exception]
+
+    # Called with the reason if a refresh fails
+    on_failure: Optional[Callable[[Exception], None]]
+
+    def __init__(
+        self,
+        lock: SyncLock,
+        period: float,
+        on_failure: Optional[Callable[[Exception], None]],
+    ):
+        self.lock = lock
+        self.period = period
+        self.next_due = monotonic() + period
+        self.reason = None
+        self.on_failure = on_failure
+
+    def fail(self, reason: Exception) -> None:
+        """Tell the lock's owner that it failed to refresh."""
+        get_instrumentation().lock_lost(self.lock.key)
+        self.reason = reason
+        if self.on_failure is not None:
+            try:
+                self.on_failure(reason)
+            except Exception:  # pylint: disable=broad-except
+                # A failing callback mustn't stop the thread refreshing every other lock
+                _logger.exception("Heartbeat failure callback for %s raised.", self.lock.key)
+
+
+class SyncHeartbeatThread:
+    """Refreshes every held :class:`SyncLock` from one daemon thread, batching the refreshes due
+    each tick into a single pipelined round-trip per client."""
+
+    # How often we check for due refreshes, at most
+    __tick: float
+
+    # Registered locks, in registration order
+    __registrations: Dict[int, SyncHeartbeatRegistration]
+
+    # Guards the registrations, and wakes the thread when locks are registered
+    __condition: threading.Condition
+
+    # The heartbeat thread, once started
+    __thread: Optional[threading.Thread]
+
+    def __init__(self, tick: float = DEFAULT_HEARTBEAT_TICK):
+        self.__tick = tick
+        self.__registrations = {}
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+    def __len__(self) -> int:
+        return len(self.__registrations)
+
+    def register(
+        self,
+        lock: SyncLock,
+        period: float = DEFAULT_HEARTBEAT_PERIOD,
+        on_failure: Optional[Callable[[Exception], None]] = None,
+    ) -> SyncHeartbeatRegistration:
+        """Start refreshing the given lock every `period` seconds, starting the thread if needed."""
+        registration = SyncHeartbeatRegistration(lock, period, on_failure)
+        with self.__condition:
+            self.__registrations[id(registration)] = registration
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    target=self.__run, name="redis-heartbeat-lock-heartbeat", daemon=True
+                )
+                self.__thread.start()
+            self.__condition.notify()
+        return registration
+
+    def unregister(self, registration: SyncHeartbeatRegistration) -> None:
+        """Stop refreshing the given lock."""
+        with self.__condition:
+            self.__registrations.pop(id(registration), None)
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__registrations:
+                    self.__condition.wait()
+                horizon = monotonic() + self.__tick
+                due = [r for r in self.__registrations.values() if r.next_due <= horizon]
+                if not due:
+                    next_due = min(r.next_due for r in self.__registrations.values())
+                    self.__condition.wait(max(next_due - horizon, 0.0) + self.__tick / 2)
+                    continue
+            self.beat(due)
+
+    def beat(self, due: Optional[List[SyncHeartbeatRegistration]] = None) -> None:
+        """Refresh the given locks, or every registered lock, one pipeline per client."""
+        if due is None:
+            with self.__condition:
+                due = list(self.__registrations.values())
+        batches: Dict[int, List[SyncHeartbeatRegistration]] = {}
+        for registration in due:
+            batches.setdefault(id(registration.lock.client), []).append(registration)
+        for batch in batches.values():
+            self.__refresh(batch)
+
+    def __refresh(self, batch: List[SyncHeartbeatRegistration]) -> None:
+        sent_at = monotonic()
+        for registration in batch:
+            get_instrumentation().heartbeat(registration.lock.key, sent_at - registration.next_due)
+        try:
+            results: List[Any] = _pipeline(
+                batch[0].lock.client, [r.lock.expiration_command() for r in batch]
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            results = [e] * len(batch)
+
+        for registration, result in zip(batch, results):
+            lock = registration.lock
+            if isinstance(result, Exception):
+                # We couldn't reach Redis. Keep trying until the lock would have lapsed.
+                if lock.lease.is_valid():
+                    registration.next_due = sent_at + min(
+                        registration.period, lock.lease.remaining()
+                    )
+                    continue
+                reason = Exception(f"{lock.key} lost lock: it expired before refreshing.")
+            elif lock.expiration_set(result, sent_at):
+                registration.next_due = sent_at + registration.period
+                continue
+            else:
+                reason = Exception(f"{lock.key} lost lock while refreshing.")
+
+            with self.__condition:
+                registered = self.__registrations.pop(id(registration), None) is not None
+            if registered:
+                registration.fail(reason)
+
+
+# The process-wide heartbeat thread used by `SyncLock`
+_heartbeat_thread = SyncHeartbeatThread()
+
+
+def get_heartbeat_thread() -> SyncHeartbeatThread:
+    """Get the process-wide heartbeat thread."""
+    return _heartbeat_thread
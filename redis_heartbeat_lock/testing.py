@@ -0,0 +1,1414 @@
+"""In-process stand-in for a Redis server, used by the benchmarks and the test harness.
+
+:class:`FakeRedis` is an in-memory command engine implementing the subset of Redis this package
+relies on (strings, hashes, sorted sets, lists, pub/sub, keyspace notifications and expiry).
+:class:`FakeRedisServer` exposes an engine over RESP on a loopback port, so the real `redis-py`
+clients can talk to it, or over in-memory connections, as :mod:`~redis_heartbeat_lock.simulation`
+does. :class:`FakeRedisCluster` serves one engine from several such nodes, redirecting commands
+for keys in another node's hash slots the way Redis Cluster does. Lua is not available, so scripts
+are emulated: each Lua script shipped by this package has a Python twin registered by source, and
+`EVAL`/`EVALSHA` dispatch to it.
+"""
+
+import asyncio
+import fnmatch
+import hashlib
+import random
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from . import scripts as _scripts
+from .cluster import key_slot
+from .shared import CLUSTER_SLOTS
+
+
+class SimpleString(str):
+    """A RESP simple string reply, e.g. `+OK`."""
+
+
+class ErrorReply(Exception):
+    """A RESP error reply, e.g. `-ERR unknown command`."""
+
+
+class MapReply(dict):
+    """A map reply: a flat array under RESP2, a map under RESP3."""
+
+
+class ScoredReply(list):
+    """A list of (member, score) pairs: flat under RESP2, nested pairs of a bulk and a double under
+    RESP3."""
+
+
+OK = SimpleString("OK")
+
+# Signature of an emulated script: (call, keys, args) -> reply
+ScriptFunc = Callable[[Callable[..., Any], List[bytes], List[bytes]], Any]
+
+# A copy of an engine's keyspace: key -> value, key -> type name, and key -> expiry
+Keyspace = Tuple[Dict[bytes, Any], Dict[bytes, str], Dict[bytes, float]]
+
+# Python twins of the Lua scripts shipped with the package, keyed by Lua source.
+EMULATED_SCRIPTS: Dict[str, ScriptFunc] = {}
+
+
+def _b(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float):
+        return repr(value).encode()
+    return str(value).encode()
+
+
+def _int(value: bytes) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise ErrorReply("ERR value is not an integer or out of range")
+
+
+def _float(value: bytes) -> float:
+    text = value.decode().lower()
+    if text in ("-inf", "+inf", "inf"):
+        return float(text)
+    try:
+        return float(text)
+    except ValueError:
+        raise ErrorReply("ERR value is not a valid float")
+
+
+def _format_score(score: float) -> bytes:
+    if score == int(score):
+        return str(int(score)).encode()
+    return repr(score).encode()
+
+
+def _copy(value: Any) -> Any:
+    """A copy of a stored value that's safe to change without changing the original."""
+    return value.copy() if isinstance(value, (dict, list)) else value
+
+
+def _scan_hash(key: bytes) -> int:
+    """Where a key falls in the order `SCAN` walks the keyspace in. Never 0, the final cursor."""
+    return zlib.crc32(key) + 1
+
+
+class FakeRedis:
+    """An in-memory Redis command engine. Not thread-safe: drive it from a single event loop."""
+
+    # Current time, in seconds. Overridable so simulations can run on a virtual clock.
+    clock: Callable[[], float]
+
+    # Key -> value. Values are bytes, dicts (hashes), lists or dicts of member -> score (zsets).
+    __data: Dict[bytes, Any]
+
+    # Key -> type name
+    __types: Dict[bytes, str]
+
+    # Key -> absolute expiry, per `clock`
+    __expires: Dict[bytes, float]
+
+    # Loaded scripts, by SHA1
+    __scripts: Dict[str, ScriptFunc]
+
+    # Channel -> subscribed sinks, and pattern -> subscribed sinks, in the order they subscribed,
+    # so messages are delivered in the same order every run
+    __channels: Dict[bytes, Dict["Subscriber", None]]
+    __patterns: Dict[bytes, Dict["Subscriber", None]]
+
+    # Value of `notify-keyspace-events`
+    notify_keyspace_events: str
+
+    # Total commands processed, by name
+    command_counts: Dict[str, int]
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.__data = {}
+        self.__types = {}
+        self.__expires = {}
+        self.__scripts = {}
+        self.__channels = {}
+        self.__patterns = {}
+        self.notify_keyspace_events = ""
+        self.command_counts = {}
+
+    # --- Keyspace helpers ---------------------------------------------------------------------
+
+    def __alive(self, key: bytes) -> bool:
+        expiry = self.__expires.get(key)
+        if expiry is not None and expiry <= self.clock():
+            self.__remove(key)
+            self.__notify(key, "expired", "x")
+            return False
+        return key in self.__data
+
+    def __remove(self, key: bytes) -> None:
+        self.__data.pop(key, None)
+        self.__types.pop(key, None)
+        self.__expires.pop(key, None)
+
+    def __get(self, key: bytes, type_: str) -> Any:
+        if not self.__alive(key):
+            return None
+        if self.__types[key] != type_:
+            raise ErrorReply("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return self.__data[key]
+
+    def __put(self, key: bytes, type_: str, value: Any) -> None:
+        if key not in self.__data:
+            self.__types[key] = type_
+        self.__data[key] = value
+
+    def __drop_if_empty(self, key: bytes) -> None:
+        if key in self.__data and not self.__data[key]:
+            self.__remove(key)
+
+    def __notify(self, key: bytes, event: str, class_: str) -> None:
+        flags = self.notify_keyspace_events
+        if not flags or (class_ not in flags and "A" not in flags):
+            return
+        if "K" in flags:
+            self.publish(b"__keyspace@0__:" + key, event.encode())
+        if "E" in flags:
+            self.publish(b"__keyevent@0__:" + event.encode(), key)
+
+    def expire_sweep(self) -> int:
+        """Actively expire keys, as Redis's periodic expire cycle does. Returns the number expired."""
+        now = self.clock()
+        expired = [key for key, at in self.__expires.items() if at <= now]
+        for key in expired:
+            self.__alive(key)
+        return len(expired)
+
+    def flushall(self) -> None:
+        """Drop every key, e.g. to simulate failing over to a replica that never saw the writes."""
+        self.__data.clear()
+        self.__types.clear()
+        self.__expires.clear()
+
+    def snapshot(self) -> "Keyspace":
+        """A copy of every key, its type and its expiry, as a replica would have it."""
+        data = {key: _copy(value) for key, value in self.__data.items()}
+        return data, dict(self.__types), dict(self.__expires)
+
+    def restore(self, snapshot: "Keyspace") -> None:
+        """Replace every key with those in a snapshot, e.g. to simulate failing over to a replica
+        that only saw the writes made before it."""
+        data, types, expires = snapshot
+        self.__data = {key: _copy(value) for key, value in data.items()}
+        self.__types = dict(types)
+        self.__expires = dict(expires)
+
+    def keys(self) -> List[bytes]:
+        """Every live key."""
+        return [key for key in list(self.__data) if self.__alive(key)]
+
+    # --- Pub/sub ------------------------------------------------------------------------------
+
+    def subscribe(self, sink: "Subscriber", channel: bytes, pattern: bool = False) -> None:
+        table = self.__patterns if pattern else self.__channels
+        table.setdefault(channel, {})[sink] = None
+
+    def unsubscribe(self, sink: "Subscriber", channel: bytes, pattern: bool = False) -> None:
+        table = self.__patterns if pattern else self.__channels
+        sinks = table.get(channel)
+        if sinks is not None:
+            sinks.pop(sink, None)
+            if not sinks:
+                del table[channel]
+
+    def publish(self, channel: bytes, message: bytes) -> int:
+        receivers = 0
+        for sink in list(self.__channels.get(channel, ())):
+            sink.push([b"message", channel, message])
+            receivers += 1
+        for pattern, sinks in list(self.__patterns.items()):
+            if fnmatch.fnmatchcase(channel.decode(errors="replace"), pattern.decode()):
+                for sink in list(sinks):
+                    sink.push([b"pmessage", pattern, channel, message])
+                    receivers += 1
+        return receivers
+
+    # --- Scripting ----------------------------------------------------------------------------
+
+    def load_script(self, source: bytes) -> str:
+        text = source.decode()
+        func = EMULATED_SCRIPTS.get(text)
+        if func is None:
+            raise ErrorReply("ERR Error compiling script (Lua is not available in FakeRedis)")
+        sha = hashlib.sha1(source).hexdigest()
+        self.__scripts[sha] = func
+        return sha
+
+    def __run_script(self, sha: str, argv: List[bytes]) -> Any:
+        func = self.__scripts.get(sha.lower())
+        if func is None:
+            raise ErrorReply("NOSCRIPT No matching script. Please use EVAL.")
+        numkeys = _int(argv[0])
+        keys, args = argv[1 : 1 + numkeys], argv[1 + numkeys :]
+
+        def call(*command: Any) -> Any:
+            reply = self.execute([_b(part) for part in command])
+            if isinstance(reply, ErrorReply):
+                raise reply
+            if isinstance(reply, SimpleString):
+                return {"ok": str(reply)}
+            return _flatten(reply)
+
+        reply = func(call, keys, args)
+        return _lua_to_resp(reply)
+
+    # --- Dispatch -----------------------------------------------------------------------------
+
+    def execute(self, command: List[bytes]) -> Any:
+        """Execute one command, returning its reply. Errors are returned as `ErrorReply` objects."""
+        if not command:
+            return ErrorReply("ERR empty command")
+        name = command[0].decode().upper()
+        self.command_counts[name] = self.command_counts.get(name, 0) + 1
+        handler = getattr(self, f"_cmd_{name.lower()}", None)
+        if handler is None:
+            return ErrorReply(f"ERR unknown command '{name}'")
+        try:
+            return handler(command[1:])
+        except ErrorReply as e:
+            return e
+        except (IndexError, ValueError):
+            return ErrorReply(f"ERR wrong number of arguments for '{name.lower()}' command")
+
+    # --- Connection / server ------------------------------------------------------------------
+
+    def _cmd_ping(self, argv):
+        return argv[0] if argv else SimpleString("PONG")
+
+    def _cmd_echo(self, argv):
+        return argv[0]
+
+    def _cmd_select(self, argv):
+        return OK
+
+    def _cmd_client(self, argv):
+        if argv and argv[0].upper() == b"ID":
+            return id(self) % 100000
+        return OK
+
+    def _cmd_info(self, argv):
+        return b"# Server\r\nredis_version:7.0.0\r\nredis_mode:standalone\r\n"
+
+    def _cmd_config(self, argv):
+        sub = argv[0].upper()
+        if sub == b"SET":
+            if argv[1].lower() == b"notify-keyspace-events":
+                self.notify_keyspace_events = argv[2].decode()
+            return OK
+        if sub == b"GET":
+            if argv[1].lower() == b"notify-keyspace-events":
+                return MapReply({argv[1]: self.notify_keyspace_events.encode()})
+            return MapReply()
+        return OK
+
+    def _cmd_flushall(self, argv):
+        self.flushall()
+        return OK
+
+    _cmd_flushdb = _cmd_flushall
+
+    def _cmd_dbsize(self, argv):
+        return len(self.keys())
+
+    def _cmd_time(self, argv):
+        now = self.clock()
+        return [str(int(now)).encode(), str(int((now % 1) * 1_000_000)).encode()]
+
+    # --- Generic keyspace ---------------------------------------------------------------------
+
+    def _cmd_del(self, argv):
+        removed = 0
+        for key in argv:
+            if self.__alive(key):
+                self.__remove(key)
+                self.__notify(key, "del", "g")
+                removed += 1
+        return removed
+
+    _cmd_unlink = _cmd_del
+
+    def _cmd_exists(self, argv):
+        return sum(1 for key in argv if self.__alive(key))
+
+    def _cmd_type(self, argv):
+        key = argv[0]
+        return SimpleString(self.__types[key] if self.__alive(key) else "none")
+
+    def __set_expiry(self, key: bytes, seconds: float) -> int:
+        if not self.__alive(key):
+            return 0
+        if seconds <= 0:
+            self.__remove(key)
+            self.__notify(key, "del", "g")
+            return 1
+        self.__expires[key] = self.clock() + seconds
+        self.__notify(key, "expire", "g")
+        return 1
+
+    def _cmd_expire(self, argv):
+        return self.__set_expiry(argv[0], _int(argv[1]))
+
+    def _cmd_pexpire(self, argv):
+        return self.__set_expiry(argv[0], _int(argv[1]) / 1000.0)
+
+    def _cmd_persist(self, argv):
+        return 1 if self.__alive(argv[0]) and self.__expires.pop(argv[0], None) is not None else 0
+
+    def __ttl(self, key: bytes, scale: float) -> int:
+        if not self.__alive(key):
+            return -2
+        expiry = self.__expires.get(key)
+        if expiry is None:
+            return -1
+        return int(round((expiry - self.clock()) * scale))
+
+    def _cmd_ttl(self, argv):
+        return self.__ttl(argv[0], 1)
+
+    def _cmd_pttl(self, argv):
+        return self.__ttl(argv[0], 1000)
+
+    def _cmd_keys(self, argv):
+        pattern = argv[0].decode()
+        return [key for key in self.keys() if fnmatch.fnmatchcase(key.decode(errors="replace"), pattern)]
+
+    def _cmd_scan(self, argv):
+        cursor = _int(argv[0])
+        pattern, count, type_ = "*", 10, None
+        options = argv[1:]
+        for i in range(0, len(options), 2):
+            option = options[i].upper()
+            if option == b"MATCH":
+                pattern = options[i + 1].decode()
+            elif option == b"COUNT":
+                count = _int(options[i + 1])
+            elif option == b"TYPE":
+                type_ = options[i + 1].decode()
+        # Like Redis, walk keys in hash order, and resume from the next key's hash, so keys
+        # deleted mid-scan don't make us skip others.
+        keys = sorted((_scan_hash(key), key) for key in self.keys() if _scan_hash(key) >= cursor)
+        while count < len(keys) and keys[count][0] == keys[count - 1][0]:
+            count += 1
+        batch = [key for _, key in keys[:count]]
+        next_cursor = keys[count][0] if count < len(keys) else 0
+        found = [
+            key
+            for key in batch
+            if fnmatch.fnmatchcase(key.decode(errors="replace"), pattern)
+            and (type_ is None or self.__types[key] == type_)
+        ]
+        return [str(next_cursor).encode(), found]
+
+    # --- Strings ------------------------------------------------------------------------------
+
+    def _cmd_get(self, argv):
+        return self.__get(argv[0], "string")
+
+    def _cmd_mget(self, argv):
+        return [self.__get(key, "string") if self.__types.get(key) in (None, "string") else None for key in argv]
+
+    def _cmd_set(self, argv):
+        key, value = argv[0], argv[1]
+        ttl: Optional[float] = None
+        nx = xx = get = keepttl = False
+        i = 2
+        while i < len(argv):
+            option = argv[i].upper()
+            if option == b"EX":
+                ttl = _int(argv[i + 1])
+                i += 1
+            elif option == b"PX":
+                ttl = _int(argv[i + 1]) / 1000.0
+                i += 1
+            elif option == b"NX":
+                nx = True
+            elif option == b"XX":
+                xx = True
+            elif option == b"GET":
+                get = True
+            elif option == b"KEEPTTL":
+                keepttl = True
+            else:
+                raise ErrorReply("ERR syntax error")
+            i += 1
+        exists = self.__alive(key)
+        previous = self.__get(key, "string") if get else None
+        if (nx and exists) or (xx and not exists):
+            return previous if get else None
+        expiry = self.__expires.get(key) if keepttl else None
+        self.__remove(key)
+        self.__put(key, "string", value)
+        if ttl is not None:
+            self.__expires[key] = self.clock() + ttl
+        elif expiry is not None:
+            self.__expires[key] = expiry
+        self.__notify(key, "set", "$")
+        return previous if get else OK
+
+    def _cmd_incrby(self, argv):
+        key = argv[0]
+        value = self.__get(key, "string")
+        result = (_int(value) if value is not None else 0) + _int(argv[1])
+        self.__put(key, "string", str(result).encode())
+        return result
+
+    def _cmd_incr(self, argv):
+        return self._cmd_incrby([argv[0], b"1"])
+
+    # --- Hashes -------------------------------------------------------------------------------
+
+    def _cmd_hset(self, argv):
+        key = argv[0]
+        table = self.__get(key, "hash") or {}
+        added = 0
+        for i in range(1, len(argv), 2):
+            added += 0 if argv[i] in table else 1
+            table[argv[i]] = argv[i + 1]
+        self.__put(key, "hash", table)
+        return added
+
+    def _cmd_hget(self, argv):
+        return (self.__get(argv[0], "hash") or {}).get(argv[1])
+
+    def _cmd_hdel(self, argv):
+        table = self.__get(argv[0], "hash") or {}
+        removed = sum(1 for field in argv[1:] if table.pop(field, None) is not None)
+        self.__drop_if_empty(argv[0])
+        return removed
+
+    def _cmd_hgetall(self, argv):
+        return MapReply(self.__get(argv[0], "hash") or {})
+
+    def _cmd_hlen(self, argv):
+        return len(self.__get(argv[0], "hash") or {})
+
+    def _cmd_hexists(self, argv):
+        return 1 if argv[1] in (self.__get(argv[0], "hash") or {}) else 0
+
+    # --- Lists --------------------------------------------------------------------------------
+
+    def _cmd_rpush(self, argv):
+        items = self.__get(argv[0], "list") or []
+        items.extend(argv[1:])
+        self.__put(argv[0], "list", items)
+        return len(items)
+
+    def _cmd_lpush(self, argv):
+        items = self.__get(argv[0], "list") or []
+        for value in argv[1:]:
+            items.insert(0, value)
+        self.__put(argv[0], "list", items)
+        return len(items)
+
+    def _cmd_lpop(self, argv):
+        items = self.__get(argv[0], "list")
+        if not items:
+            return None
+        value = items.pop(0)
+        self.__drop_if_empty(argv[0])
+        return value
+
+    def _cmd_llen(self, argv):
+        return len(self.__get(argv[0], "list") or [])
+
+    def _cmd_lindex(self, argv):
+        items = self.__get(argv[0], "list") or []
+        index = _int(argv[1])
+        return items[index] if -len(items) <= index < len(items) else None
+
+    def _cmd_lrange(self, argv):
+        items = self.__get(argv[0], "list") or []
+        start, stop = _int(argv[1]), _int(argv[2])
+        stop = len(items) if stop == -1 else stop + 1
+        return items[start:stop]
+
+    def _cmd_lrem(self, argv):
+        items = self.__get(argv[0], "list") or []
+        count, value = _int(argv[1]), argv[2]
+        removed = 0
+        for i in range(len(items) - 1, -1, -1) if count < 0 else range(len(items)):
+            if items[i] == value and (count == 0 or removed < abs(count)):
+                items[i] = None
+                removed += 1
+        items[:] = [item for item in items if item is not None]
+        self.__drop_if_empty(argv[0])
+        return removed
+
+    # --- Sorted sets --------------------------------------------------------------------------
+
+    def __sorted(self, key: bytes) -> List[Tuple[bytes, float]]:
+        members = self.__get(key, "zset") or {}
+        return sorted(members.items(), key=lambda item: (item[1], item[0]))
+
+    def _cmd_zadd(self, argv):
+        key = argv[0]
+        members = self.__get(key, "zset") or {}
+        i, nx, xx = 1, False, False
+        while argv[i].upper() in (b"NX", b"XX", b"CH", b"GT", b"LT"):
+            nx = nx or argv[i].upper() == b"NX"
+            xx = xx or argv[i].upper() == b"XX"
+            i += 1
+        added = 0
+        for j in range(i, len(argv), 2):
+            score, member = _float(argv[j]), argv[j + 1]
+            if (nx and member in members) or (xx and member not in members):
+                continue
+            added += 0 if member in members else 1
+            members[member] = score
+        self.__put(key, "zset", members)
+        self.__drop_if_empty(key)
+        return added
+
+    def _cmd_zrem(self, argv):
+        members = self.__get(argv[0], "zset") or {}
+        removed = sum(1 for member in argv[1:] if members.pop(member, None) is not None)
+        self.__drop_if_empty(argv[0])
+        return removed
+
+    def _cmd_zcard(self, argv):
+        return len(self.__get(argv[0], "zset") or {})
+
+    def _cmd_zscore(self, argv):
+        score = (self.__get(argv[0], "zset") or {}).get(argv[1])
+        return None if score is None else _format_score(score)
+
+    def _cmd_zrank(self, argv):
+        for rank, (member, _) in enumerate(self.__sorted(argv[0])):
+            if member == argv[1]:
+                return rank
+        return None
+
+    def __range_reply(self, items: List[Tuple[bytes, float]], withscores: bool) -> Any:
+        if withscores:
+            return ScoredReply(items)
+        return [member for member, _ in items]
+
+    def _cmd_zrange(self, argv):
+        items = self.__sorted(argv[0])
+        start, stop = _int(argv[1]), _int(argv[2])
+        stop = len(items) if stop == -1 else stop + 1
+        withscores = any(arg.upper() == b"WITHSCORES" for arg in argv[3:])
+        return self.__range_reply(items[start:stop], withscores)
+
+    @staticmethod
+    def __score_bound(raw: bytes) -> Tuple[float, bool]:
+        if raw.startswith(b"("):
+            return _float(raw[1:]), True
+        return _float(raw), False
+
+    def __by_score(self, key: bytes, low: bytes, high: bytes) -> List[Tuple[bytes, float]]:
+        (lo, lo_open), (hi, hi_open) = self.__score_bound(low), self.__score_bound(high)
+        return [
+            (member, score)
+            for member, score in self.__sorted(key)
+            if (score > lo if lo_open else score >= lo) and (score < hi if hi_open else score <= hi)
+        ]
+
+    def _cmd_zrangebyscore(self, argv):
+        withscores = any(arg.upper() == b"WITHSCORES" for arg in argv[3:])
+        return self.__range_reply(self.__by_score(argv[0], argv[1], argv[2]), withscores)
+
+    def _cmd_zcount(self, argv):
+        return len(self.__by_score(argv[0], argv[1], argv[2]))
+
+    def _cmd_zremrangebyscore(self, argv):
+        doomed = self.__by_score(argv[0], argv[1], argv[2])
+        return self._cmd_zrem([argv[0]] + [member for member, _ in doomed]) if doomed else 0
+
+    # --- Pub/sub & scripting ------------------------------------------------------------------
+
+    def _cmd_publish(self, argv):
+        return self.publish(argv[0], argv[1])
+
+    def _cmd_script(self, argv):
+        sub = argv[0].upper()
+        if sub == b"LOAD":
+            return self.load_script(argv[1]).encode()
+        if sub == b"EXISTS":
+            return [1 if sha.decode().lower() in self.__scripts else 0 for sha in argv[1:]]
+        if sub == b"FLUSH":
+            self.__scripts.clear()
+            return OK
+        raise ErrorReply("ERR unknown SCRIPT subcommand")
+
+    def _cmd_evalsha(self, argv):
+        return self.__run_script(argv[0].decode(), argv[1:])
+
+    def _cmd_eval(self, argv):
+        return self.__run_script(self.load_script(argv[0]), argv[1:])
+
+
+def _lua_to_resp(value: Any) -> Any:
+    """Convert a script's return value the way Redis converts Lua values to RESP."""
+    if value is None or value is False:
+        return None
+    if value is True:
+        return 1
+    if isinstance(value, dict) and "ok" in value:
+        return SimpleString(value["ok"])
+    if isinstance(value, dict) and "err" in value:
+        return ErrorReply(value["err"])
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, (list, tuple)):
+        converted = []
+        for item in value:
+            # Lua arrays stop at the first nil
+            if item is None:
+                break
+            converted.append(_lua_to_resp(item))
+        return converted
+    return value
+
+
+def _flatten(reply: Any) -> Any:
+    if isinstance(reply, MapReply):
+        return [part for item in reply.items() for part in item]
+    if isinstance(reply, ScoredReply):
+        return [part for member, score in reply for part in (member, _format_score(score))]
+    return reply
+
+
+def emulates(source: str) -> Callable[[ScriptFunc], ScriptFunc]:
+    """Register a Python twin for the given Lua script source."""
+
+    def _inner(func: ScriptFunc) -> ScriptFunc:
+        EMULATED_SCRIPTS[source] = func
+        return func
+
+    return _inner
+
+
+# --- RESP server ------------------------------------------------------------------------------
+
+
+def _encode(reply: Any, protocol: int = 2) -> bytes:
+    if isinstance(reply, SimpleString):
+        return b"+" + reply.encode() + b"\r\n"
+    if isinstance(reply, ErrorReply):
+        return b"-" + str(reply).encode() + b"\r\n"
+    if reply is None:
+        return b"_\r\n" if protocol == 3 else b"$-1\r\n"
+    if isinstance(reply, float):
+        return b"," + repr(reply).encode() + b"\r\n"
+    if protocol == 3 and isinstance(reply, MapReply):
+        parts = b"".join(_encode(part, protocol) for item in reply.items() for part in item)
+        return b"%" + str(len(reply)).encode() + b"\r\n" + parts
+    if protocol == 3 and isinstance(reply, ScoredReply):
+        return _encode([[member, float(score)] for member, score in reply], protocol)
+    if isinstance(reply, (MapReply, ScoredReply)):
+        return _encode(_flatten(reply), protocol)
+    if isinstance(reply, bool):
+        return b":" + (b"1" if reply else b"0") + b"\r\n"
+    if isinstance(reply, int):
+        return b":" + str(reply).encode() + b"\r\n"
+    if isinstance(reply, (bytes, str)):
+        data = _b(reply)
+        return b"$" + str(len(data)).encode() + b"\r\n" + data + b"\r\n"
+    if isinstance(reply, (list, tuple)):
+        items = b"".join(_encode(item, protocol) for item in reply)
+        return b"*" + str(len(reply)).encode() + b"\r\n" + items
+    raise TypeError(f"Cannot encode {reply!r}")
+
+
+async def _read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. from telnet
+        return line.strip().split()
+    command = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        length = int(header[1:])
+        data = await reader.readexactly(length + 2)
+        command.append(data[:-2])
+    return command
+
+
+class Subscriber:
+    """A connection in subscribed state; receives published messages."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.protocol = 2
+        self.channels: Set[bytes] = set()
+        self.patterns: Set[bytes] = set()
+
+    def push(self, message: List[Any]) -> None:
+        if self.writer.is_closing():
+            return
+        if self.protocol == 3:
+            data = _encode(message, 3)
+            self.writer.write(b">" + data[1:])
+        else:
+            self.writer.write(_encode(message))
+
+    @property
+    def count(self) -> int:
+        return len(self.channels) + len(self.patterns)
+
+
+class _MemoryTransport(asyncio.Transport):
+    """One end of an in-memory connection. Writes reach the other end on the loop's next turn,
+    in order, and closing either end closes both once everything written has arrived."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, protocol: asyncio.Protocol):
+        super().__init__()
+        self.peer: Optional["_MemoryTransport"] = None
+        self.__loop = loop
+        self.__protocol = protocol
+        self.__closing = False
+        self.__lost = False
+
+    def write(self, data: Any) -> None:
+        if self.__closing or self.peer is None or not data:
+            return
+        self.__loop.call_soon(self.peer.receive, bytes(data))
+
+    def receive(self, data: bytes) -> None:
+        if not self.__lost:
+            self.__protocol.data_received(data)
+
+    def close(self) -> None:
+        if self.__closing:
+            return
+        self.__closing = True
+        self.__loop.call_soon(self.__lose)
+        if self.peer is not None:
+            self.__loop.call_soon(self.peer.close)
+
+    def abort(self) -> None:
+        self.close()
+
+    def __lose(self) -> None:
+        self.__lost = True
+        self.__protocol.connection_lost(None)
+
+    def is_closing(self) -> bool:
+        return self.__closing
+
+    def can_write_eof(self) -> bool:
+        return False
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return default
+
+    def pause_reading(self) -> None:
+        pass
+
+    def resume_reading(self) -> None:
+        pass
+
+
+class FakeRedisServer:
+    """Serve a :class:`FakeRedis` engine over RESP on a loopback port.
+
+    Faults can be injected while the server is running: `latency` delays every reply (a callable
+    is called per command for jittered latency), and `drop_rate` is the probability of never
+    answering a command, which the client observes as a timeout."""
+
+    engine: FakeRedis
+    host: str
+    port: int
+
+    # Seconds to delay each reply, or a callable returning that delay
+    latency: Any
+
+    # Probability of silently dropping a reply
+    drop_rate: float
+
+    # Active expire cycles per second
+    hz: int
+
+    # Commands received from clients, not counting those run by scripts
+    commands_received: int
+
+    # The cluster this server is a node of, if any
+    cluster: Optional["FakeRedisCluster"]
+
+    def __init__(
+        self,
+        engine: Optional[FakeRedis] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: Any = 0.0,
+        drop_rate: float = 0.0,
+        hz: int = 10,
+        seed: Optional[int] = None,
+    ):
+        self.engine = engine if engine is not None else FakeRedis()
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.hz = hz
+        self.commands_received = 0
+        self.cluster = None
+        self.__random = random.Random(seed)
+        self.__server: Optional[asyncio.AbstractServer] = None
+        self.__expire_task: Optional["asyncio.Task[None]"] = None
+        # Open connections, in the order they were opened
+        self.__writers: Dict[asyncio.StreamWriter, None] = {}
+        # Tasks serving open connections
+        self.__handlers: Set["asyncio.Task[None]"] = set()
+        self.__thread: Optional[threading.Thread] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}"
+
+    async def start(self, listen: bool = True) -> "FakeRedisServer":
+        """Start serving on the running event loop. With `listen=False`, only serve connections
+        opened with :meth:`connect`."""
+        if listen:
+            self.__server = await asyncio.start_server(self.__handle, self.host, self.port)
+            self.port = self.__server.sockets[0].getsockname()[1]
+        self.__expire_task = asyncio.ensure_future(self.__expire_cycle())
+        return self
+
+    async def stop(self) -> None:
+        """Stop serving and drop every open connection."""
+        tasks = list(self.__handlers)
+        if self.__expire_task is not None:
+            tasks.append(self.__expire_task)
+            self.__expire_task = None
+        for writer in list(self.__writers):
+            writer.close()
+        # Wait for every task to finish cancelling, so none is left to fail once the loop closes
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+    async def connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open a connection to the server over an in-memory stream rather than a socket, e.g. on
+        a simulated event loop. Returns the client's end."""
+        loop = asyncio.get_running_loop()
+        ends = []
+        transports = []
+        for _ in range(2):
+            reader = asyncio.StreamReader()
+            protocol = asyncio.StreamReaderProtocol(reader)
+            transport = _MemoryTransport(loop, protocol)
+            protocol.connection_made(transport)
+            ends.append((reader, asyncio.StreamWriter(transport, protocol, reader, loop)))
+            transports.append(transport)
+        (client_reader, client_writer), (server_reader, server_writer) = ends
+        transports[0].peer, transports[1].peer = transports[1], transports[0]
+        asyncio.ensure_future(self.__handle(server_reader, server_writer))
+        return client_reader, client_writer
+
+    def disconnect_all(self) -> None:
+        """Drop every client connection, without stopping the server."""
+        for writer in list(self.__writers):
+            writer.close()
+
+    async def __aenter__(self) -> "FakeRedisServer":
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.stop()
+
+    def start_in_thread(self) -> "FakeRedisServer":
+        """Start serving from a daemon thread with its own event loop, e.g. for synchronous clients."""
+        started = threading.Event()
+
+        def _run() -> None:
+            loop = asyncio.new_event_loop()
+            self.__loop = loop
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self.__thread = threading.Thread(target=_run, name="fake-redis", daemon=True)
+        self.__thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        """Stop a server started with :meth:`start_in_thread`."""
+        if self.__loop is not None and self.__thread is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+            self.__thread = None
+
+    async def __expire_cycle(self) -> None:
+        while True:
+            await asyncio.sleep(1.0 / self.hz)
+            self.engine.expire_sweep()
+
+    def __delay(self) -> float:
+        return self.latency() if callable(self.latency) else self.latency
+
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self.__handlers.add(task)
+        self.__writers[writer] = None
+        subscriber = Subscriber(writer)
+        # Whether the client sent `ASKING`, letting its next command into an importing slot
+        asking = False
+        try:
+            while True:
+                try:
+                    command = await _read_command(reader)
+                except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                    break
+                if command is None:
+                    break
+                if not command:
+                    continue
+                self.commands_received += 1
+                delay = self.__delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self.drop_rate and self.__random.random() < self.drop_rate:
+                    continue
+                name = command[0].upper()
+                redirect = None
+                if self.cluster is not None:
+                    redirect = self.cluster.route(self, command, asking)
+                    asking = name == b"ASKING"
+                if redirect is not None:
+                    writer.write(_encode(redirect, subscriber.protocol))
+                elif name in (b"SUBSCRIBE", b"PSUBSCRIBE", b"UNSUBSCRIBE", b"PUNSUBSCRIBE"):
+                    self.__pubsub(subscriber, name, command[1:])
+                elif name == b"QUIT":
+                    writer.write(_encode(OK))
+                    break
+                elif name == b"HELLO":
+                    writer.write(_encode(self.__hello(subscriber, command[1:]), subscriber.protocol))
+                elif subscriber.count and name == b"PING" and subscriber.protocol == 2:
+                    writer.write(_encode([b"pong", command[1] if len(command) > 1 else b""]))
+                else:
+                    writer.write(_encode(self.engine.execute(command), subscriber.protocol))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for channel in subscriber.channels:
+                self.engine.unsubscribe(subscriber, channel)
+            for pattern in subscriber.patterns:
+                self.engine.unsubscribe(subscriber, pattern, pattern=True)
+            self.__writers.pop(writer, None)
+            if task is not None:
+                self.__handlers.discard(task)
+            writer.close()
+
+    def __hello(self, subscriber: Subscriber, argv: List[bytes]) -> Any:
+        if argv:
+            protocol = _int(argv[0])
+            if protocol not in (2, 3):
+                return ErrorReply("NOPROTO unsupported protocol version")
+            subscriber.protocol = protocol
+        return MapReply(
+            {
+                b"server": b"redis",
+                b"version": b"7.0.0",
+                b"proto": subscriber.protocol,
+                b"id": id(subscriber) % 100000,
+                b"mode": b"standalone" if self.cluster is None else b"cluster",
+                b"role": b"master",
+                b"modules": [],
+            }
+        )
+
+    def __pubsub(self, subscriber: Subscriber, name: bytes, channels: List[bytes]) -> None:
+        pattern = name.startswith(b"P")
+        table = subscriber.patterns if pattern else subscriber.channels
+        kind = name.lower()
+        if name.endswith(b"UNSUBSCRIBE"):
+            for channel in channels or list(table):
+                table.discard(channel)
+                self.engine.unsubscribe(subscriber, channel, pattern=pattern)
+                subscriber.push([kind, channel, subscriber.count])
+            if not channels and not table:
+                subscriber.push([kind, None, subscriber.count])
+            return
+        for channel in channels:
+            table.add(channel)
+            self.engine.subscribe(subscriber, channel, pattern=pattern)
+            subscriber.push([kind, channel, subscriber.count])
+
+
+# Commands' key positions, as `COMMAND` reports them: first key, last key (negative counts from the
+# end), and step. Commands not listed here take no keys; `EVAL` and `EVALSHA` say how many they
+# take.
+_KEY_POSITIONS: Dict[str, Tuple[int, int, int]] = {
+    **{name: (1, -1, 1) for name in ("del", "exists", "mget")},
+    **{
+        name: (1, 1, 1)
+        for name in (
+            "get set incr incrby type expire pexpire persist ttl pttl hset hget hdel hgetall hlen "
+            "hexists rpush lpush lpop llen lindex lrange lrem zadd zrem zcard zscore zrank zrange "
+            "zrangebyscore zcount zremrangebyscore"
+        ).split()
+    },
+}
+
+
+def _command_keys(command: List[bytes]) -> List[bytes]:
+    """The keys a command touches."""
+    name = command[0].decode().lower()
+    if name in ("eval", "evalsha"):
+        return command[3 : 3 + _int(command[2])] if len(command) > 2 else []
+    if name not in _KEY_POSITIONS:
+        return []
+    first, last, step = _KEY_POSITIONS[name]
+    if last < 0:
+        last = len(command) + last
+    return command[first : last + 1 : step]
+
+
+class FakeRedisCluster:
+    """Serve one :class:`FakeRedis` engine from several nodes, each owning an equal share of the
+    hash slots. A node answers `MOVED` for keys in another node's slots, and slots can be moved
+    between nodes while running: while a slot migrates, its old owner answers `ASK`, and the new
+    owner only serves it to clients that sent `ASKING` first. Since the nodes share an engine, a
+    key is never lost in a move, and published messages reach subscribers on every node."""
+
+    engine: FakeRedis
+
+    # The nodes
+    servers: List[FakeRedisServer]
+
+    # Slot -> index of the node owning it
+    __owners: List[int]
+
+    # Slot -> index of the node it's migrating to
+    __migrating: Dict[int, int]
+
+    # The event loop the nodes run on, when started with `start_in_thread`
+    __loop: Optional[asyncio.AbstractEventLoop]
+
+    # Thread running that loop
+    __thread: Optional[threading.Thread]
+
+    def __init__(self, nodes: int = 3, engine: Optional[FakeRedis] = None, host: str = "127.0.0.1"):
+        self.engine = engine if engine is not None else FakeRedis()
+        self.servers = [FakeRedisServer(self.engine, host=host) for _ in range(nodes)]
+        for server in self.servers:
+            server.cluster = self
+        self.__owners = [slot * nodes // CLUSTER_SLOTS for slot in range(CLUSTER_SLOTS)]
+        self.__migrating = {}
+        self.__loop = None
+        self.__thread = None
+
+    @property
+    def url(self) -> str:
+        """A cluster URL for the first node; clients find the other nodes from it."""
+        return f"redis+cluster://{self.servers[0].host}:{self.servers[0].port}"
+
+    def owner(self, slot: int) -> FakeRedisServer:
+        """The node owning the given slot."""
+        return self.servers[self.__owners[slot]]
+
+    def migrate(self, slot: int, to: int) -> None:
+        """Start moving a slot to the node at index `to`: its owner starts answering `ASK`."""
+        self.__migrating[slot] = to
+
+    def finish_migration(self, slot: int) -> None:
+        """Finish moving a slot: the new owner serves it, and the old one answers `MOVED`."""
+        self.__owners[slot] = self.__migrating.pop(slot)
+
+    def move(self, slot: int, to: int) -> None:
+        """Move a slot to the node at index `to` at once, e.g. as if the cluster resharded."""
+        self.migrate(slot, to)
+        self.finish_migration(slot)
+
+    def __address(self, index: int) -> str:
+        server = self.servers[index]
+        return f"{server.host}:{server.port}"
+
+    def __slots_reply(self) -> List[Any]:
+        ranges: List[Any] = []
+        for slot, owner in enumerate(self.__owners):
+            if ranges and ranges[-1][2] == owner and ranges[-1][1] == slot - 1:
+                ranges[-1][1] = slot
+            else:
+                ranges.append([slot, slot, owner])
+        return [
+            [
+                start,
+                end,
+                [
+                    self.servers[owner].host.encode(),
+                    self.servers[owner].port,
+                    f"{owner:040x}".encode(),
+                ],
+            ]
+            for start, end, owner in ranges
+        ]
+
+    @staticmethod
+    def __command_reply() -> List[Any]:
+        reply = []
+        for name in FakeRedis.__dict__:
+            if not name.startswith("_cmd_"):
+                continue
+            command = name[len("_cmd_") :]
+            if command in ("eval", "evalsha"):
+                reply.append([command.encode(), -3, [b"noscript", b"movablekeys"], 0, 0, 0])
+            else:
+                first, last, step = _KEY_POSITIONS.get(command, (0, 0, 0))
+                reply.append([command.encode(), -1, [], first, last, step])
+        return reply
+
+    def route(self, server: FakeRedisServer, command: List[bytes], asking: bool) -> Any:
+        """Answer cluster commands, and redirect commands for keys the node doesn't serve. Returns
+        `None` to let the node run the command."""
+        name = command[0].upper()
+        if name == b"ASKING" or name == b"READONLY":
+            return OK
+        if name == b"CLUSTER" and len(command) > 1 and command[1].upper() == b"SLOTS":
+            return self.__slots_reply()
+        if name == b"COMMAND" and len(command) > 1 and command[1].upper() == b"GETKEYS":
+            return _command_keys(command[2:]) or ErrorReply("ERR The command has no key arguments")
+        if name == b"COMMAND":
+            return self.__command_reply()
+
+        keys = _command_keys(command)
+        if not keys:
+            return None
+        slots = {key_slot(key.decode()) for key in keys}
+        if len(slots) > 1:
+            return ErrorReply("CROSSSLOT Keys in request don't hash to the same slot")
+        slot = slots.pop()
+        index = self.servers.index(server)
+        target = self.__migrating.get(slot)
+        if self.__owners[slot] == index:
+            if target is not None:
+                return ErrorReply(f"ASK {slot} {self.__address(target)}")
+            return None
+        if target == index and asking:
+            return None
+        return ErrorReply(f"MOVED {slot} {self.__address(self.__owners[slot])}")
+
+    async def start(self) -> "FakeRedisCluster":
+        """Start serving every node on the running event loop."""
+        for server in self.servers:
+            await server.start()
+        return self
+
+    async def stop(self) -> None:
+        """Stop serving every node."""
+        for server in self.servers:
+            await server.stop()
+
+    def start_in_thread(self) -> "FakeRedisCluster":
+        """Start serving every node from one daemon thread, since the nodes share an engine."""
+        started = threading.Event()
+
+        def _run() -> None:
+            loop = asyncio.new_event_loop()
+            self.__loop = loop
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self.__thread = threading.Thread(target=_run, name="fake-redis-cluster", daemon=True)
+        self.__thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self) -> None:
+        """Stop a cluster started with :meth:`start_in_thread`."""
+        if self.__loop is not None and self.__thread is not None:
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+            self.__thread = None
+
+
+# --- Python twins of the package's Lua scripts ---------------------------------------------------
+
+def _now_ms(call):
+    seconds, micros = call("time")
+    return int(seconds) * 1000 + int(micros) // 1000
+
+
+
+@emulates(_scripts.ACQUIRE.source)
+def _acquire(call, keys, args):
+    if args[2] != b"0":
+        if call("set", keys[0], args[0], "px", args[1], "nx") is None:
+            return None
+    else:
+        call("set", keys[0], args[0], "px", args[1])
+    return call("incr", keys[1])
+
+
+@emulates(_scripts.ACQUIRE_FAIR.source)
+def _acquire_fair(call, keys, args):
+    now = _now_ms(call)
+    for waiter in call("zrangebyscore", keys[3], "-inf", now):
+        call("zrem", keys[2], waiter)
+        call("zrem", keys[3], waiter)
+    if call("zscore", keys[2], args[0]) is None:
+        last = call("zrange", keys[2], -1, -1, "withscores")
+        ticket = float(last[1]) + 1 if last else 1
+        call("zadd", keys[2], ticket, args[0])
+    if call("zrange", keys[2], 0, 0)[0] == args[0]:
+        if call("set", keys[0], args[0], "px", args[1], "nx") is not None:
+            call("zrem", keys[2], args[0])
+            call("zrem", keys[3], args[0])
+            return call("incr", keys[1])
+    call("zadd", keys[3], now + int(args[2]), args[0])
+    call("pexpire", keys[2], args[2])
+    call("pexpire", keys[3], args[2])
+    return None
+
+
+@emulates(_scripts.EXTEND.source)
+def _extend(call, keys, args):
+    if call("get", keys[0]) == args[0]:
+        return call("pexpire", keys[0], args[1])
+    return 0
+
+
+@emulates(_scripts.RELEASE.source)
+def _release(call, keys, args):
+    if call("get", keys[0]) == args[0]:
+        call("del", keys[0])
+        call("publish", args[1], "released")
+        return 1
+    return 0
+
+
+@emulates(_scripts.ACQUIRE_ALL.source)
+def _acquire_all(call, keys, args):
+    locks, fences = keys[: len(keys) // 2], keys[len(keys) // 2 :]
+    if args[2] != b"0":
+        for key in locks:
+            if call("exists", key) == 1:
+                return []
+    for key in locks:
+        call("set", key, args[0], "px", args[1])
+    return [call("incr", fence) for fence in fences]
+
+
+@emulates(_scripts.EXTEND_ALL.source)
+def _extend_all(call, keys, args):
+    extended = 0
+    for key in keys:
+        if call("get", key) == args[0]:
+            extended += call("pexpire", key, args[1])
+    return extended
+
+
+@emulates(_scripts.RELEASE_ALL.source)
+def _release_all(call, keys, args):
+    released = 0
+    for key in keys:
+        if call("get", key) == args[0]:
+            released += call("del", key)
+            call("publish", args[1] + key, "released")
+    return released
+
+
+@emulates(_scripts.ACQUIRE_READ.source)
+def _acquire_read(call, keys, args):
+    now = _now_ms(call)
+    call("zremrangebyscore", keys[1], "-inf", now)
+    call("zremrangebyscore", keys[2], "-inf", now)
+    if call("exists", keys[0]) == 1 or call("zcard", keys[2]) > 0:
+        return 0
+    call("zadd", keys[1], now + int(args[1]), args[0])
+    if call("pttl", keys[1]) < int(args[1]):
+        call("pexpire", keys[1], args[1])
+    return 1
+
+
+@emulates(_scripts.EXTEND_LEASE.source)
+def _extend_lease(call, keys, args):
+    now = _now_ms(call)
+    lease = call("zscore", keys[0], args[0])
+    if lease is None or float(lease) <= now:
+        return 0
+    call("zadd", keys[0], now + int(args[1]), args[0])
+    if call("pttl", keys[0]) < int(args[1]):
+        call("pexpire", keys[0], args[1])
+    return 1
+
+
+@emulates(_scripts.RELEASE_READ.source)
+def _release_read(call, keys, args):
+    released = call("zrem", keys[1], args[0])
+    if released == 1 and call("zcard", keys[1]) == 0:
+        call("publish", args[1], "released")
+    return released
+
+
+@emulates(_scripts.ACQUIRE_WRITE.source)
+def _acquire_write(call, keys, args):
+    now = _now_ms(call)
+    call("zremrangebyscore", keys[1], "-inf", now)
+    call("zremrangebyscore", keys[2], "-inf", now)
+    if call("zcard", keys[1]) == 0:
+        if call("set", keys[0], args[0], "px", args[1], "nx") is not None:
+            call("zrem", keys[2], args[0])
+            return call("incr", keys[3])
+    call("zadd", keys[2], now + int(args[2]), args[0])
+    if call("pttl", keys[2]) < int(args[2]):
+        call("pexpire", keys[2], args[2])
+    return None
+
+
+@emulates(_scripts.ACQUIRE_SEMAPHORE.source)
+def _acquire_semaphore(call, keys, args):
+    now = _now_ms(call)
+    call("zremrangebyscore", keys[0], "-inf", now)
+    if call("zcard", keys[0]) >= int(args[2]):
+        return 0
+    call("zadd", keys[0], now + int(args[1]), args[0])
+    if call("pttl", keys[0]) < int(args[1]):
+        call("pexpire", keys[0], args[1])
+    return 1
+
+
+@emulates(_scripts.RELEASE_SEMAPHORE.source)
+def _release_semaphore(call, keys, args):
+    released = call("zrem", keys[0], args[0])
+    if released == 1:
+        call("publish", args[1], "released")
+    return released
+
+
+@emulates(_scripts.PUBLISH_RESULT.source)
+def _publish_result(call, keys, args):
+    if call("get", keys[0]) == args[0]:
+        call("set", keys[1], args[1], "px", args[2])
+        return 1
+    return 0
+
+
+@emulates(_scripts.FORCE_RELEASE.source)
+def _force_release(call, keys, args):
+    released = call("del", keys[0])
+    if released == 1:
+        call("publish", args[0], "released")
+    return released
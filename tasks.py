@@ -85,6 +85,24 @@ def test(c):
     _run(c, "pytest")
 
 
+@task(
+    help={
+        "latency": "Seconds the stand-in server delays each reply",
+        "output": "File to write JSON results to",
+    }
+)
+def bench(c, latency=0.0, output="benchmark.json"):
+    """
+    Run benchmarks against an in-process stand-in for Redis
+    """
+    _run(
+        c,
+        "python -m redis_heartbeat_lock.benchmark --latency {} --output {}".format(
+            latency, output
+        ),
+    )
+
+
 @task(help={"publish": "Publish the result via coveralls"})
 def coverage(c, publish=False):
     """
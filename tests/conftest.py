@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Shared fixtures. Most tests need a Redis on 127.0.0.1:6379, and skip if there isn't one. Set
+`REDIS_HEARTBEAT_LOCK_FAKE_REDIS=1` to serve them from our in-process stand-in instead; it
+emulates our Lua scripts rather than running them, so it's no substitute for a real Redis."""
+# pylint: disable=redefined-outer-name
+
+import os
+import socket
+import pytest
+from redis_heartbeat_lock import testing
+
+REDIS_HOST = "127.0.0.1"
+REDIS_PORT = 6379
+REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
+
+# Opts in to serving the tests from `testing.FakeRedisServer`
+FAKE_REDIS_ENV = "REDIS_HEARTBEAT_LOCK_FAKE_REDIS"
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "create(cls, **options): what the `create` fixture makes, with default options"
+    )
+
+
+def _redis_listening() -> bool:
+    try:
+        with socket.create_connection((REDIS_HOST, REDIS_PORT), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+@pytest.fixture(scope="session")
+def redis_available():
+    """Whether something is serving Redis for the tests, starting our stand-in if asked to."""
+    if os.environ.get(FAKE_REDIS_ENV, "") in ("", "0"):
+        yield _redis_listening()
+        return
+    if _redis_listening():
+        pytest.fail(f"{FAKE_REDIS_ENV} is set, but something already listens on {REDIS_PORT}.")
+
+    server = testing.FakeRedisServer(host=REDIS_HOST, port=REDIS_PORT).start_in_thread()
+    yield True
+    server.stop_thread()
+
+
+@pytest.fixture
+def redis_server(redis_available):
+    """Skips the test unless something is serving Redis on 127.0.0.1:6379."""
+    if not redis_available:
+        pytest.skip(f"no Redis on {REDIS_HOST}:{REDIS_PORT}; set {FAKE_REDIS_ENV}=1 for the fake")
+
+
+@pytest.fixture
+def create(request, redis_server):
+    """Creates what the test's `create` marker names, e.g. a lock, on the Redis on 127.0.0.1:6379:
+    `await create(key=...)`, or without the `await` for a synchronous lock. The marker's options
+    are the defaults, e.g. `@pytest.mark.create(async_lock.AsyncLock, lock_expiry=2)`."""
+    marker = request.node.get_closest_marker("create")
+    if marker is None:
+        pytest.fail("The create fixture needs a create marker naming what to create.")
+    (cls,) = marker.args
+
+    def _create(**options):
+        return cls.create(**{"url": REDIS_URL, **marker.kwargs, **options})
+
+    return _create
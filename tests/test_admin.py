@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Tests for bulk lock inspection and force-release."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import os
+import socket
+import pytest
+from redis_heartbeat_lock import admin, async_lock, semaphore, testing
+
+
+async def _lock(key: str, url: str = "redis://127.0.0.1:6379", **kwargs) -> async_lock.AsyncLock:
+    lock = await async_lock.AsyncLock.create(key=key, url=url, lock_expiry=5, **kwargs)
+    assert await lock.set_lock(True, nx=True) is True
+    return lock
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("redis_server")
+async def test_lists_held_locks():
+    """Tests that a scan lists every lock held under a prefix, across several batches, with its
+    owner, TTL, age and fencing counter, and nothing else."""
+    prefix = "test_lists_held_locks:"
+    locks = [await _lock(f"{prefix}{i}") for i in range(5)]
+    await _lock("test_lists_held_locks_elsewhere")
+    slots = await semaphore.AsyncSemaphore.create(
+        key=f"{prefix}semaphore", url="redis://127.0.0.1:6379", limit=2
+    )
+    assert await slots.set_lock(True, nx=True) is True
+    await locks[0].backend.call("set", f"{prefix}plain", "not a lock")
+
+    inspector = await admin.LockAdmin.create(url="redis://127.0.0.1:6379", count=2)
+    found = {info.key: info async for info in inspector.locks(prefix)}
+    assert sorted(found) == sorted(lock.key for lock in locks)
+    for lock in locks:
+        info = found[lock.key]
+        assert info.token == lock.token
+        assert info.owner == f"{socket.gethostname()}:{os.getpid()}"
+        assert info.ttl is not None and 4 < info.ttl <= 5
+        assert info.age is not None and 0 <= info.age < 1
+        assert info.fencing_token == lock.fencing_token
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("redis_server")
+async def test_force_release():
+    """Tests that force-releasing wakes waiters, releases every lock under a prefix, and leaves a
+    lock alone if it's changed hands since it was listed."""
+    prefix = "test_force_release:"
+    inspector = await admin.LockAdmin.create(url="redis://127.0.0.1:6379")
+    held = await _lock(f"{prefix}held")
+    [listed] = [info async for info in inspector.locks(f"{prefix}held")]
+
+    # Someone else takes the lock after we listed it
+    await inspector.force_release([held.key])
+    retaken = await _lock(held.key)
+    assert await inspector.force_release([listed]) == 0
+    assert await retaken.exists() == 1
+
+    waiter = await async_lock.AsyncLock.create(
+        key=held.key, url="redis://127.0.0.1:6379", wait_mode="notify", notify_poll_rate=5.0
+    )
+    waiting = asyncio.ensure_future(waiter.set_lock(True, nx=True))
+    await asyncio.sleep(0.2)
+    [current] = [info async for info in inspector.locks(f"{prefix}held")]
+    assert await inspector.force_release([current]) == 1
+    assert await asyncio.wait_for(waiting, timeout=1.0) is True
+    await waiter.release()
+
+    for i in range(3):
+        await _lock(f"{prefix}bulk:{i}")
+    assert await inspector.release_all(f"{prefix}bulk:") == 3
+    assert [info async for info in inspector.locks(prefix)] == []
+
+
+@pytest.mark.asyncio
+async def test_lists_each_lock_once_on_cluster():
+    """Tests that a scan of a cluster covers every node, and lists each lock once."""
+    nodes = testing.FakeRedisCluster(nodes=3).start_in_thread()
+    try:
+        url = nodes.url
+        locks = [await _lock(f"test_cluster_scan:{i}", url=url) for i in range(10)]
+        inspector = await admin.LockAdmin.create(url=url, count=3)
+        found = [info.key async for info in inspector.locks("test_cluster_scan:")]
+        assert sorted(found) == sorted(lock.key for lock in locks)
+        assert await inspector.release_all("test_cluster_scan:") == 10
+    finally:
+        nodes.stop_thread()
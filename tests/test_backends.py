@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Tests for the Redis command backends."""
+# pylint: disable=redefined-outer-name
+
+import pytest
+import redis
+from redis_heartbeat_lock import async_lock, backends, context_manager
+
+pytestmark = pytest.mark.usefixtures("redis_server")
+
+
+@pytest.mark.asyncio
+async def test_defaults_to_native_backend():
+    """Tests that `create` talks to Redis on the event loop when the client supports it."""
+    redis_lock = await async_lock.AsyncLock.create(
+        key="test_defaults_to_native_backend", url="redis://127.0.0.1:6379",
+    )
+
+    assert isinstance(redis_lock.backend, backends.NativeBackend)
+    assert await redis_lock.set_lock(True, True) is True
+    assert await redis_lock.exists() == 1
+    await redis_lock.release()
+    assert await redis_lock.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_thread_pool_backend_holds_lock():
+    """Tests that the thread-pool fallback still gets, holds and releases the lock."""
+    redis_lock = await async_lock.AsyncLock.create(
+        key="test_thread_pool_backend_holds_lock",
+        url="redis://127.0.0.1:6379",
+        lock_acquisition_timeout=1.0,
+        lock_expiry=2,
+        backend="thread_pool",
+    )
+    assert isinstance(redis_lock.backend, backends.ThreadPoolBackend)
+
+    heartbeat = context_manager.ContextManager(period=0.5, redis=redis_lock)
+
+    async with heartbeat as _:
+        lock = await redis_lock.set_lock(True, True)
+        assert lock is False
+
+    assert await redis_lock.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_wraps_existing_clients():
+    """Tests that clients passed in directly are wrapped in the matching backend."""
+    sync_client = redis.Redis.from_url("redis://127.0.0.1:6379")
+    assert isinstance(backends.from_client(sync_client), backends.ThreadPoolBackend)
+
+    native = await backends.from_url("redis://127.0.0.1:6379", "native")
+    assert isinstance(backends.from_client(native.client), backends.NativeBackend)
+    assert backends.from_client(native) is native
+
+    with pytest.raises(Exception, match=r"Unknown backend"):
+        await backends.from_url("redis://127.0.0.1:6379", "carrier_pigeon")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Tests for the benchmarks and the stand-in server they run against."""
+# pylint: disable=redefined-outer-name
+
+import json
+import time
+import pytest
+import redis
+from redis_heartbeat_lock import benchmark, testing
+
+
+def test_server_injects_latency():
+    """Tests that the stand-in server speaks RESP to redis-py, and delays its replies."""
+    server = testing.FakeRedisServer(latency=0.05).start_in_thread()
+    try:
+        client = redis.Redis.from_url(server.url)
+        started_at = time.monotonic()
+        assert client.set("key", "value") is True
+        assert client.get("key") == b"value"
+        assert time.monotonic() - started_at >= 0.1
+        client.close()
+    finally:
+        server.stop_thread()
+
+
+@pytest.mark.asyncio
+async def test_handoff_is_faster_when_notified():
+    """Tests that waiters notified of releases take over faster than polling ones."""
+    server = testing.FakeRedisServer().start_in_thread()
+    try:
+        polled = await benchmark.handoff_latency(server, contenders=3, rounds=1)
+        notified = await benchmark.handoff_latency(
+            server, contenders=3, rounds=1, wait_mode="notify"
+        )
+    finally:
+        server.stop_thread()
+
+    assert notified.metrics["handoff_mean"] < polled.metrics["handoff_mean"]
+
+
+def test_results_are_machine_readable(tmp_path):
+    """Tests that a quick run reports every scenario as JSON."""
+    output = tmp_path / "results.json"
+    benchmark.main(["--quick", "--output", str(output)])
+
+    report = json.loads(output.read_text())
+    assert report["environment"]["quick"] is True
+    assert [result["name"] for result in report["results"]] == [
+        "acquisitions_per_second",
+        "handoff_latency",
+        "handoff_latency",
+        "handoff_latency",
+        "handoff_latency",
+        "heartbeat_overhead",
+        "heartbeat_overhead",
+        "executor_saturation",
+        "cold_start",
+    ]
+    assert all(result["metrics"] for result in report["results"])
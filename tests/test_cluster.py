@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Tests for locks on a Redis Cluster."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import (
+    async_lock,
+    cluster,
+    context_manager,
+    heartbeat,
+    multi_lock,
+    testing,
+)
+
+
+@pytest.fixture
+def redis_cluster():
+    """A stand-in Redis Cluster of three nodes."""
+    nodes = testing.FakeRedisCluster(nodes=3).start_in_thread()
+    yield nodes
+    nodes.stop_thread()
+
+
+def test_related_keys_share_slot():
+    """Tests that a lock's own keys land in its key's hash slot on a cluster, and keep their
+    names elsewhere."""
+    assert cluster.hash_tag("{dataset:1}:partition:1") == "dataset:1"
+    assert cluster.hash_tag("{}dataset") is None
+    assert cluster.related_key("my-key", ":fence", cluster=False) == "my-key:fence"
+    assert cluster.related_key("my-key", ":fence", cluster=True) == "{my-key}:fence"
+    assert cluster.related_key("{a}b", ":fence", cluster=True) == "{a}b:fence"
+    assert cluster.key_slot("{my-key}:fence") == cluster.key_slot("my-key")
+    assert cluster.split_cluster_url("redis+cluster://host:7000/0") == (True, "redis://host:7000/0")
+    assert cluster.split_cluster_url("redis://host:6379") == (False, "redis://host:6379")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["native", "thread_pool"])
+async def test_follows_redirects(redis_cluster, backend):
+    """Tests that the lock keeps working while its slot moves to another node, following `ASK`
+    redirects during the move and `MOVED` redirects after it."""
+    key = f"test_follows_redirects_{backend}"
+    slot = cluster.key_slot(key)
+    holder = await async_lock.AsyncLock.create(
+        key=key, url=redis_cluster.url, backend=backend, share_client=False
+    )
+    rival = await async_lock.AsyncLock.create(
+        key=key,
+        url=redis_cluster.url,
+        backend=backend,
+        lock_acquisition_timeout=0.2,
+        lock_check_rate=0.05,
+        share_client=False,
+    )
+    assert holder.backend.cluster is True
+    assert await holder.set_lock(True, True) is True
+
+    owner = redis_cluster.servers.index(redis_cluster.owner(slot))
+    redis_cluster.migrate(slot, (owner + 1) % 3)
+    assert await holder.set_expiration() is True
+    assert await rival.set_lock(True, True) is False
+
+    redis_cluster.finish_migration(slot)
+    redis_cluster.move(slot, (owner + 2) % 3)
+    assert await holder.set_expiration() is True
+    await holder.release()
+    assert await rival.set_lock(True, True) is True
+    assert rival.fencing_token == 2
+    await rival.release()
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_batched_per_node(redis_cluster):
+    """Tests that the shared scheduler keeps locks spread over every node alive, refreshing them
+    in one pipeline split between the nodes."""
+    keys = [f"test_heartbeats_batched_per_node_{i}" for i in range(12)]
+    assert len({redis_cluster.owner(cluster.key_slot(key)) for key in keys}) == 3
+    locks = [
+        await async_lock.AsyncLock.create(key=key, url=redis_cluster.url, lock_expiry=1)
+        for key in keys
+    ]
+    scheduler = heartbeat.HeartbeatScheduler()
+
+    managers = [
+        context_manager.ContextManager(lock, period=0.3, scheduler=scheduler) for lock in locks
+    ]
+    for manager in managers:
+        await manager.__aenter__()
+    await asyncio.sleep(1.5)
+    assert all([await lock.exists() == 1 for lock in locks])
+    for manager in managers:
+        await manager.__aexit__(None, None, None)
+    assert all([await lock.exists() == 0 for lock in locks])
+
+
+@pytest.mark.asyncio
+async def test_multi_lock_needs_a_hash_tag(redis_cluster):
+    """Tests that keys locked together on a cluster must share a hash tag."""
+    with pytest.raises(Exception, match="hash tag"):
+        await multi_lock.MultiAsyncLock.create(
+            keys=["dataset:1:partition:1", "dataset:1:partition:2"], url=redis_cluster.url
+        )
+
+    keys = ["{dataset:1}:partition:1", "{dataset:1}:partition:2"]
+    holder = await multi_lock.MultiAsyncLock.create(keys=keys, url=redis_cluster.url)
+    waiter = await multi_lock.MultiAsyncLock.create(
+        keys=keys, url=redis_cluster.url, lock_acquisition_timeout=2.0, wait_mode="notify"
+    )
+    assert await holder.set_lock(True, True) is True
+    waiting = asyncio.ensure_future(waiter.set_lock(True, True))
+    await asyncio.sleep(0.2)
+    await holder.release()
+    assert await asyncio.wait_for(waiting, 1.0) is True
+    assert await waiter.exists() == 2
+    await waiter.release()
+
+    # A lone key needs no hash tag, and shares its fencing counter with a plain lock on it
+    single = await async_lock.AsyncLock.create(key="dataset:2", url=redis_cluster.url)
+    assert await single.set_lock(True, True) is True
+    fence = single.fencing_token
+    assert fence is not None
+    await single.release()
+    together = await multi_lock.MultiAsyncLock.create(keys=["dataset:2"], url=redis_cluster.url)
+    assert await together.set_lock(True, True) is True
+    assert together.fencing_tokens == {"dataset:2": fence + 1}
+    await together.release()
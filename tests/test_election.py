@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Tests for leader election."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import time
+import pytest
+from redis_heartbeat_lock import async_lock, election
+
+# A lone class would be taken for the decorated object, hence `with_args`
+pytestmark = pytest.mark.create.with_args(election.LeaderElection)
+
+
+@pytest.mark.asyncio
+async def test_standby_takes_over_on_resign(create):
+    """Tests that a standby is elected as soon as the leader resigns, that callbacks fire, and
+    that anyone can ask who leads."""
+    key = "test_standby_takes_over_on_resign"
+    events = []
+    first = await create(
+        key=key,
+        identity="first",
+        lock_expiry=5,
+        notify_poll_rate=5.0,
+        on_elected=lambda: events.append("first elected"),
+        on_demoted=lambda: events.append("first demoted"),
+    )
+    second = await create(
+        key=key,
+        identity="second",
+        lock_expiry=5,
+        notify_poll_rate=5.0,
+        on_elected=lambda: events.append("second elected"),
+    )
+
+    await first.campaign()
+    assert first.is_leader is True
+    assert await second.leader() == "first"
+
+    standby = asyncio.ensure_future(second.campaign())
+    await asyncio.sleep(0.3)
+    assert not standby.done()
+
+    resigned_at = time.monotonic()
+    await first.resign()
+    await asyncio.wait_for(standby, timeout=1.0)
+    assert time.monotonic() - resigned_at < 0.5
+    assert (first.is_leader, second.is_leader) == (False, True)
+    assert await first.leader() == "second"
+    assert events == ["first elected", "first demoted", "second elected"]
+
+    await second.resign()
+    assert await first.leader() is None
+
+
+@pytest.mark.asyncio
+async def test_standby_takes_over_when_lease_lapses(create):
+    """Tests that a standby that isn't told about a crashed leader still takes over as soon as
+    its lease lapses, rather than at its next check."""
+    key = "test_standby_takes_over_when_lease_lapses"
+    crashed = await async_lock.AsyncLock.create(
+        key=key, url="redis://127.0.0.1:6379", lock_expiry=1
+    )
+    assert await crashed.set_lock(True, nx=True) is True
+    taken_at = time.monotonic()
+
+    standby = await create(key=key, identity="standby", wait_mode="poll", lock_check_rate=5.0)
+    await asyncio.wait_for(standby.campaign(), timeout=2.0)
+    assert time.monotonic() - taken_at < 1.3
+    assert await standby.leader() == "standby"
+    await standby.resign()
+
+
+@pytest.mark.asyncio
+async def test_run_campaigns_again_after_demotion(create):
+    """Tests that a leader finding it's lost leadership is demoted straight away, and campaigns
+    again."""
+    key = "test_run_campaigns_again_after_demotion"
+    events = []
+    leader = await create(
+        key=key,
+        identity="leader",
+        lock_expiry=2,
+        period=0.1,
+        on_elected=lambda: events.append("elected"),
+        on_demoted=lambda: events.append("demoted"),
+    )
+
+    running = asyncio.ensure_future(leader.run())
+    await asyncio.sleep(0.2)
+    first_term = leader.fencing_token
+    assert first_term is not None
+    assert events == ["elected"]
+
+    await leader.backend.call("delete", key)
+    await asyncio.sleep(0.5)
+    assert events == ["elected", "demoted", "elected"]
+    assert leader.is_leader is True
+    assert leader.fencing_token is not None and leader.fencing_token > first_term
+
+    # The hash naming the leader expires with the lock, so the heartbeat keeps it alive too
+    assert 0 < await leader.backend.call("pttl", f"{key}:leader") <= 2000
+    await asyncio.sleep(2.2)
+    assert await leader.leader() == "leader"
+
+    running.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await running
+    assert (leader.is_leader, await leader.leader()) == (False, None)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Tests for the thread pools running the synchronous client."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from redis_heartbeat_lock import async_lock, context_manager, executor, heartbeat
+
+pytestmark = pytest.mark.create(async_lock.AsyncLock, backend="thread_pool")
+
+
+def test_pool_starts_lazily_and_counts_queue():
+    """Tests that a pool starts no threads until it's used, and counts work waiting for one."""
+    pool = executor.ThreadPool("test-pool", max_workers=1)
+    assert not [t for t in threading.enumerate() if "test-pool" in t.name]
+
+    release = threading.Event()
+    first = pool.submit(release.wait, 1.0)
+    second = pool.submit(lambda: 42)
+    assert [t for t in threading.enumerate() if "test-pool" in t.name]
+    assert pool.queue_depth + pool.running == 2
+    release.set()
+    assert second.result(timeout=1.0) == 42
+    assert first.result(timeout=1.0) is True
+    assert pool.queue_depth == 0
+    assert pool.running == 0
+
+    pool.resize(2)
+    assert pool.max_workers == 2
+    assert pool.submit(lambda: 1).result(timeout=1.0) == 1
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scheduled", [False, True])
+async def test_heartbeats_not_starved(scheduled, create):
+    """Tests that heartbeats keep a lock alive while every thread of the default pool is busy."""
+    key = f"test_heartbeats_not_starved_{scheduled}"
+    redis = await create(key=key, lock_expiry=1)
+    scheduler = heartbeat.HeartbeatScheduler() if scheduled else None
+
+    async with context_manager.ContextManager(redis, period=0.3, scheduler=scheduler) as _:
+        release = threading.Event()
+        pool = executor.get_executor()
+        assert isinstance(pool, executor.ThreadPool)
+        futures = [pool.submit(release.wait) for _ in range(pool.max_workers + 2)]
+        try:
+            assert pool.queue_depth >= 2
+            await asyncio.sleep(1.5)
+        finally:
+            release.set()
+            for future in futures:
+                future.result()
+    # The heartbeat didn't miss a beat, so we still held the lock when releasing it
+    assert redis.lease.is_valid() is False
+
+
+@pytest.mark.asyncio
+async def test_lock_with_own_executor(create):
+    """Tests that a lock given its own executor doesn't wait for the shared pools."""
+    key = "test_lock_with_own_executor"
+    own = ThreadPoolExecutor(max_workers=1)
+    redis = await create(key=key, executor=own)
+
+    release = threading.Event()
+    pool = executor.get_executor()
+    assert isinstance(pool, executor.ThreadPool)
+    futures = [pool.submit(release.wait) for _ in range(pool.max_workers + 2)]
+    try:
+        assert await asyncio.wait_for(redis.set_lock(True, True), timeout=1.0) is True
+        await asyncio.wait_for(redis.release(), timeout=1.0)
+    finally:
+        release.set()
+        for future in futures:
+            future.result()
+    own.shutdown()
+
+
+def test_import_has_no_side_effects():
+    """Tests that importing the locks starts no threads, and leaves out optional modules, so cold
+    starts stay cheap."""
+    code = (
+        "import sys, threading\n"
+        "import redis_heartbeat_lock.async_lock, redis_heartbeat_lock.context_manager\n"
+        "optional = ['http.server', 'redis_heartbeat_lock.testing']\n"
+        "print(threading.active_count(), [name for name in optional if name in sys.modules])\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, check=True, text=True
+    ).stdout
+    assert output.strip() == "1 []"
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Tests for owner tokens and fencing counters."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import async_lock, testing
+
+pytestmark = pytest.mark.create(async_lock.AsyncLock, lock_acquisition_timeout=0.5, lock_expiry=4)
+
+
+@pytest.mark.asyncio
+async def test_fencing_token_increases(create):
+    """Tests that every acquisition gets a new owner token and a higher fencing counter."""
+    redis = await create(key="test_fencing_token_increases")
+
+    assert await redis.set_lock(True, True) is True
+    first_token, first_fence = redis.token, redis.fencing_token
+    assert first_fence is not None
+    await redis.release()
+    assert redis.token is None
+
+    assert await redis.set_lock(True, True) is True
+    assert redis.token != first_token
+    assert redis.fencing_token == first_fence + 1
+    await redis.release()
+
+
+@pytest.mark.asyncio
+async def test_stale_holder_cannot_touch_new_lock(create):
+    """Tests that a holder whose lock lapsed can't extend or release its successor's lock."""
+    stale = await create(key="test_stale_holder_cannot_touch_new_lock", lock_expiry=1)
+    successor = await create(key="test_stale_holder_cannot_touch_new_lock")
+
+    assert await stale.set_lock(True, True) is True
+    # Simulate a long GC pause: the lock lapses, and someone else takes it
+    await asyncio.sleep(1.5)
+    assert await successor.set_lock(True, True) is True
+    assert successor.fencing_token is not None and stale.fencing_token is not None
+    assert successor.fencing_token > stale.fencing_token
+
+    await stale.set_expiration()
+    with pytest.raises(Exception, match=r"lost lock before releasing"):
+        await stale.release()
+    assert await successor.exists() == 1
+
+    await successor.release()
+    assert await successor.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_reloads_flushed_scripts():
+    """Tests that we reload our scripts if the server forgets them. Flushing scripts would wipe
+    them from a developer's Redis too, so this runs on a server of its own."""
+    server = testing.FakeRedisServer().start_in_thread()
+    try:
+        redis = await async_lock.AsyncLock.create(
+            key="test_reloads_flushed_scripts", url=server.url, share_client=False
+        )
+
+        assert await redis.set_lock(True, True) is True
+
+        await redis.backend.call("script_flush")
+        results = await redis.backend.pipeline([redis.expiration_command()])
+        assert redis.expiration_set(results[0]) is True
+
+        await redis.backend.call("script_flush")
+        await redis.release()
+        assert await redis.exists() == 0
+    finally:
+        server.stop_thread()
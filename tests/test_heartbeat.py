@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Tests for the shared heartbeat scheduler."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from contextlib import AsyncExitStack
+from redis_heartbeat_lock import async_lock, context_manager, heartbeat
+
+pytestmark = pytest.mark.create(async_lock.AsyncLock, lock_acquisition_timeout=1.0, lock_expiry=2)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_holds_many_locks(create):
+    """Tests that one scheduler holds many locks past their initial expiry."""
+    scheduler = heartbeat.HeartbeatScheduler()
+    locks = [await create(key=f"test_scheduler_holds_many_locks_{i}") for i in range(50)]
+
+    async with AsyncExitStack() as stack:
+        managers = []
+        for lock in locks:
+            manager = context_manager.ContextManager(lock, period=1.0, scheduler=scheduler)
+            await stack.enter_async_context(manager)
+            managers.append(manager)
+        assert len(scheduler) == 50
+
+        # Should still have every lock after another three seconds
+        await asyncio.sleep(3)
+        for lock in locks:
+            assert await lock.exists() == 1
+
+    assert len(scheduler) == 0
+    for lock, manager in zip(locks, managers):
+        assert manager.future.cancelled() is True
+        assert await lock.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_reports_lost_locks(create):
+    """Tests that locks which fail to refresh are reported to their owners."""
+    scheduler = heartbeat.get_scheduler()
+    assert heartbeat.get_scheduler() is scheduler
+
+    lock = await create(key="test_scheduler_reports_lost_locks")
+    intruder = await create(key="test_scheduler_reports_lost_locks")
+    failures = []
+
+    assert await lock.set_lock(True, True) is True
+    registration = scheduler.register(
+        lock, period=0.2, on_failure=lambda r, e: failures.append((r, e)),
+    )
+
+    # Someone else deletes our lock out from under us
+    await intruder.backend.call("delete", intruder.key)
+    with pytest.raises(Exception, match=r"lost lock while refreshing"):
+        await asyncio.wait_for(registration.future, timeout=2.0)
+    assert failures == [(registration, registration.future.exception())]
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_context_manager_raises_lost_lock(create):
+    """Tests that the context manager raises if the scheduler lost its lock."""
+    lock = await create(key="test_context_manager_raises_lost_lock")
+    intruder = await create(key="test_context_manager_raises_lost_lock")
+
+    with pytest.raises(Exception, match=r"lost lock"):
+        async with context_manager.ContextManager(
+            lock, period=0.2, scheduler=heartbeat.get_scheduler()
+        ) as _:
+            await intruder.backend.call("delete", intruder.key)
+            await asyncio.sleep(1.0)
+
+
+@pytest.mark.asyncio
+async def test_failing_callback_does_not_stop_scheduler(create):
+    """Tests that a lost lock's callback raising doesn't stop the scheduler refreshing others."""
+    scheduler = heartbeat.HeartbeatScheduler()
+    lost = await create(key="test_failing_callback_does_not_stop_scheduler_lost")
+    kept = await create(key="test_failing_callback_does_not_stop_scheduler_kept")
+    assert await lost.set_lock(True, True) is True
+    assert await kept.set_lock(True, True) is True
+
+    def _raise(registration, reason):
+        raise Exception("Callback failed")
+
+    lost_registration = scheduler.register(lost, period=0.2, on_failure=_raise)
+    kept_registration = scheduler.register(kept, period=0.2)
+    await lost.backend.call("delete", lost.key)
+    with pytest.raises(Exception, match=r"lost lock while refreshing"):
+        await asyncio.wait_for(lost_registration.future, timeout=2.0)
+
+    # Should still hold the other lock well past its expiry
+    await asyncio.sleep(2.5)
+    assert await kept.exists() == 1
+    assert not kept_registration.future.done()
+    scheduler.unregister(kept_registration)
+    await kept.release()
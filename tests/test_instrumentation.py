@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Tests for lock instrumentation."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import async_lock, context_manager, executor, instrumentation
+
+
+@pytest.fixture
+def recorded():
+    """Install in-memory instrumentation for the test, then put back the no-op default."""
+    yield instrumentation.set_instrumentation(instrumentation.InMemoryInstrumentation())
+    instrumentation.set_instrumentation(None)
+
+
+def test_histogram_quantiles():
+    """Tests that histogram quantiles land in the right bucket."""
+    histogram = instrumentation.Histogram([1, 2, 4, 8])
+    for value in [0.5] * 90 + [3.0] * 9 + [20.0]:
+        histogram.observe(value)
+
+    summary = histogram.summary()
+    assert summary.samples == 100
+    assert summary.min == 0.5 and summary.max == 20.0
+    assert 0.5 <= summary.p50 <= 1
+    assert 2 <= summary.p99 <= 4
+    assert instrumentation.Histogram().summary().p50 == 0.0
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("redis_server")
+async def test_records_lock_lifecycle(recorded):
+    """Tests that acquisitions, contention, heartbeats, holds and executor delays are recorded."""
+    key = "test_records_lock_lifecycle"
+    holder = await async_lock.AsyncLock.create(
+        key=key, url="redis://127.0.0.1:6379", lock_check_rate=0.05, lock_expiry=2,
+    )
+    waiter = await async_lock.AsyncLock.create(
+        key=key, url="redis://127.0.0.1:6379", lock_check_rate=0.05, lock_expiry=2,
+    )
+
+    async with context_manager.ContextManager(holder, period=0.1):
+        await asyncio.sleep(0.3)
+        waiting = asyncio.create_task(waiter.set_lock(True, True))
+        await asyncio.sleep(0.2)
+    assert await waiting is True
+    await waiter.release()
+
+    stats = recorded.stats(key)
+    assert stats.acquisitions == 2
+    assert stats.acquisition_attempts.max >= 3
+    assert stats.acquisition_latency.max >= 0.2
+    assert stats.heartbeat_lateness.samples >= 3
+    assert stats.hold_duration.samples == 2
+    assert stats.hold_duration.max >= 0.5
+    assert recorded.hot_keys(1) == [key]
+
+    await executor.run_sync_in_thread_pool(lambda: None)
+    assert recorded.executor_delay.samples >= 1
+
+
+def test_caps_tracked_keys():
+    """Tests that we stop tracking new keys past the limit, and file them together instead."""
+    recorder = instrumentation.InMemoryInstrumentation(max_keys=2)
+    for i in range(5):
+        recorder.acquisition(f"key_{i}", 0.01, 1, True)
+
+    assert sorted(recorder.keys) == [instrumentation.OTHER_KEY, "key_0", "key_1"]
+    assert recorder.stats(instrumentation.OTHER_KEY).acquisitions == 3
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Tests for client-side lease estimates."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import time
+import pytest
+from redis_heartbeat_lock import async_lock, context_manager, lease
+
+pytestmark = pytest.mark.create(async_lock.AsyncLock, lock_acquisition_timeout=0.5, lock_expiry=2)
+
+
+def test_lease_counts_down_from_send():
+    """Tests that a lease runs from when its command was sent, less an allowance for drift."""
+    tracker = lease.Lease(expiry=10.0)
+    assert tracker.is_valid() is False
+    assert tracker.remaining() == 0.0
+
+    tracker.renewed(time.monotonic() - 4.0)
+    assert 5.8 < tracker.remaining() < 5.9
+    assert tracker.is_valid(margin=5.0) is True
+    assert tracker.is_valid(margin=6.0) is False
+
+    tracker.end()
+    assert tracker.is_valid() is False
+
+
+@pytest.mark.asyncio
+async def test_lock_tracks_lease(create):
+    """Tests that acquiring and refreshing a lock renew its lease, and losing or releasing it ends
+    the lease, all without asking Redis."""
+    key = "test_lock_tracks_lease"
+    redis = await create(key=key)
+    intruder = await create(key=key)
+
+    assert await redis.set_lock(True, True) is True
+    assert 1.9 < redis.lease.remaining() <= 2.0
+    await asyncio.sleep(0.3)
+    assert redis.lease.remaining() < 1.8
+    assert await redis.set_expiration() is True
+    assert redis.lease.remaining() > 1.9
+
+    await redis.release()
+    assert redis.lease.is_valid() is False
+
+    assert await redis.set_lock(True, True) is True
+    await intruder.backend.call("delete", key)
+    assert await redis.set_expiration() is False
+    assert redis.lease.is_valid() is False
+
+
+@pytest.mark.asyncio
+async def test_reentered_lock_shares_lease(create):
+    """Tests that a lock re-entered by its holder's task sees the holder's lease."""
+    key = "test_reentered_lock_shares_lease"
+    outer = await create(key=key, local_first=True)
+    inner = await create(key=key, local_first=True)
+
+    async with context_manager.ContextManager(outer, period=1.0):
+        async with context_manager.ContextManager(inner, period=1.0):
+            assert inner.lease is outer.lease
+            assert inner.lease.is_valid(margin=1.0) is True
+        assert inner.lease is not outer.lease
+        assert outer.lease.is_valid() is True
+    assert outer.lease.is_valid() is False
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Tests for coalescing locks on the same key within a process."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import time
+import pytest
+from redis_heartbeat_lock import async_lock, context_manager, local
+
+pytestmark = pytest.mark.create(async_lock.AsyncLock, local_first=True)
+
+
+@pytest.mark.asyncio
+async def test_local_waiters_queue_in_process(create):
+    """Tests that local waiters take the lock in turn as soon as it's released, without polling."""
+    key = "test_local_waiters_queue_in_process"
+    order = []
+
+    async def _work(i: int) -> None:
+        # Polling this slowly, five holders in a row would take seconds
+        redis = await create(key=key, lock_check_rate=2.0)
+        async with context_manager.ContextManager(period=1.0, redis=redis):
+            order.append(i)
+            await asyncio.sleep(0.02)
+
+    started_at = time.monotonic()
+    workers = []
+    for i in range(5):
+        workers.append(asyncio.create_task(_work(i)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*workers)
+
+    assert order == [0, 1, 2, 3, 4]
+    assert time.monotonic() - started_at < 1.0
+    assert len(local.get_local_table()) == 0
+
+
+@pytest.mark.asyncio
+async def test_reenters_lock_held_by_task(create):
+    """Tests that a task holding a key can take it again, and keeps it until the outermost release."""
+    key = "test_reenters_lock_held_by_task"
+    outer = await create(key=key, lock_acquisition_timeout=0.5)
+    inner = await create(key=key, lock_acquisition_timeout=0.5)
+
+    async with context_manager.ContextManager(period=1.0, redis=outer):
+        async with context_manager.ContextManager(period=1.0, redis=inner) as _:
+            assert inner.reentered is True
+            assert inner.token == outer.token
+            assert inner.fencing_token == outer.fencing_token
+        assert outer.reentered is False
+        assert await outer.exists() == 1
+
+    assert await outer.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_reenters_same_lock(create):
+    """Tests that re-entering the very same lock leaves its outer hold intact, still refreshed
+    by its heartbeat, and released cleanly at the end."""
+    key = "test_reenters_same_lock"
+    lock = await create(key=key, lock_expiry=1)
+
+    async with context_manager.ContextManager(period=0.3, redis=lock):
+        token, fencing_token = lock.token, lock.fencing_token
+        async with context_manager.ContextManager(period=0.3, redis=lock):
+            assert lock.reentered is True
+            assert lock.token == token
+        assert (lock.reentered, lock.token, lock.fencing_token) == (False, token, fencing_token)
+
+        # Should still hold the lock well past its expiry
+        await asyncio.sleep(1.5)
+        assert await lock.exists() == 1
+        assert lock.lease.is_valid() is True
+
+    assert await lock.exists() == 0
+    assert len(local.get_local_table()) == 0
+
+
+@pytest.mark.asyncio
+async def test_other_task_times_out_locally(create):
+    """Tests that another task waiting behind a local holder times out without reaching Redis."""
+    key = "test_other_task_times_out_locally"
+    holder = await create(key=key)
+    waiter = await create(key=key, lock_acquisition_timeout=0.2)
+
+    assert await holder.set_lock(True, True) is True
+    assert await asyncio.create_task(waiter.set_lock(True, True)) is False
+    assert waiter.token is None
+
+    await holder.release()
+    assert await asyncio.create_task(waiter.set_lock(True, True)) is True
+    await waiter.release()
+    assert len(local.get_local_table()) == 0
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Tests for noticing a lost lock while the protected block is still running."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import time
+import pytest
+from typing import List
+from redis_heartbeat_lock import async_lock, context_manager, heartbeat, testing
+
+pytestmark = pytest.mark.create(async_lock.AsyncLock, lock_acquisition_timeout=1.0, lock_expiry=2)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scheduled", [False, True])
+async def test_cancels_block_on_loss(scheduled, create):
+    """Tests that losing the lock cancels the protected block straight away, and raises why."""
+    key = f"test_cancels_block_on_loss_{scheduled}"
+    lock = await create(key=key)
+    intruder = await create(key=key)
+    scheduler = heartbeat.HeartbeatScheduler() if scheduled else None
+    finished = False
+
+    started_at = time.monotonic()
+    with pytest.raises(Exception, match=r"lost lock while refreshing"):
+        async with context_manager.ContextManager(
+            lock, period=0.2, scheduler=scheduler, cancel_on_loss=True
+        ) as _:
+            await intruder.backend.call("delete", intruder.key)
+            await asyncio.sleep(5.0)
+            finished = True
+
+    assert finished is False
+    assert time.monotonic() - started_at < 1.0
+    assert await lock.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_signals_loss(create):
+    """Tests that losing the lock sets the manager's event and calls back, without cancelling."""
+    key = "test_signals_loss"
+    lock = await create(key=key)
+    intruder = await create(key=key)
+    reasons: List[Exception] = []
+    manager = context_manager.ContextManager(lock, period=0.2, on_lost=reasons.append)
+
+    with pytest.raises(Exception, match=r"lost lock while refreshing"):
+        async with manager:
+            await intruder.backend.call("delete", intruder.key)
+            await asyncio.wait_for(manager.lost.wait(), timeout=1.0)
+            assert len(reasons) == 1
+
+
+@pytest.mark.asyncio
+async def test_unreachable_redis_loses_lock_at_expiry():
+    """Tests that a heartbeat which can't reach Redis gives up the lock once it would have lapsed."""
+    server = testing.FakeRedisServer().start_in_thread()
+    try:
+        lock = await async_lock.AsyncLock.create(
+            key="test_unreachable_redis", url=server.url, lock_expiry=2, share_client=False
+        )
+        manager = context_manager.ContextManager(lock, period=0.5)
+
+        with pytest.raises(Exception, match=r"it expired before refreshing"):
+            async with manager:
+                # Redis stops answering
+                server.drop_rate = 1.0
+                await asyncio.wait_for(manager.lost.wait(), timeout=3.0)
+                server.drop_rate = 0.0
+    finally:
+        server.stop_thread()
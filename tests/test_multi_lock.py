@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Tests for locking many keys at once."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import async_lock, context_manager, heartbeat, multi_lock
+
+pytestmark = pytest.mark.create(
+    multi_lock.MultiAsyncLock, lock_acquisition_timeout=0.5, lock_expiry=2
+)
+
+
+@pytest.mark.asyncio
+async def test_acquires_all_keys(create):
+    """Tests that the context manager takes, holds and releases every key."""
+    keys = [f"test_acquires_all_keys_{i}" for i in range(10)]
+    redis = await create(keys=keys)
+
+    async with context_manager.ContextManager(period=0.5, redis=redis) as _:
+        assert await redis.exists() == 10
+        await asyncio.sleep(3)
+        assert await redis.exists() == 10
+
+    assert await redis.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_acquires_none_if_any_held(create):
+    """Tests that if any key is held, we take none of them."""
+    keys = [f"test_acquires_none_if_any_held_{i}" for i in range(3)]
+    single = await async_lock.AsyncLock.create(key=keys[1], url="redis://127.0.0.1:6379")
+    assert await single.set_lock(True, True) is True
+
+    redis = await create(keys=keys)
+    with pytest.raises(Exception, match=r"Failed to get lock"):
+        async with context_manager.ContextManager(period=0.5, redis=redis) as _:
+            pass
+
+    assert await redis.exists() == 1
+    await single.release()
+
+
+@pytest.mark.asyncio
+async def test_waits_for_release(create):
+    """Tests that a waiter in notify mode takes the keys as soon as they're released."""
+    keys = [f"test_waits_for_release_{i}" for i in range(3)]
+    holder = await create(keys=keys[:2])
+    waiter = await create(keys=keys, lock_acquisition_timeout=4.0, wait_mode="notify")
+
+    async with context_manager.ContextManager(
+        period=0.5, redis=holder, scheduler=heartbeat.get_scheduler()
+    ) as _:
+        acquisition = asyncio.create_task(waiter.set_lock(True, True))
+        await asyncio.sleep(0.5)
+        assert acquisition.done() is False
+
+    assert await asyncio.wait_for(acquisition, timeout=1.0) is True
+    await waiter.release()
+    assert await waiter.exists() == 0
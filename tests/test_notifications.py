@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Tests for event-driven lock acquisition."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+import redis
+import time
+from redis_heartbeat_lock import async_lock, context_manager
+
+pytestmark = [
+    pytest.mark.usefixtures("redis_server"),
+    pytest.mark.create(
+        async_lock.AsyncLock,
+        lock_acquisition_timeout=4.0,
+        lock_expiry=4,
+        backend="native",
+        wait_mode="notify",
+        notify_poll_rate=10.0,
+    ),
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["native", "thread_pool"])
+async def test_waiter_acquires_on_release(backend, create):
+    """Tests that a waiter gets the lock as soon as it's released, without waiting to poll."""
+    holder = await create(key=f"test_waiter_acquires_on_release_{backend}", backend=backend)
+    waiter = await create(key=f"test_waiter_acquires_on_release_{backend}", backend=backend)
+
+    async with context_manager.ContextManager(period=1.0, redis=holder) as _:
+        acquisition = asyncio.create_task(waiter.set_lock(True, True))
+        await asyncio.sleep(0.5)
+        assert acquisition.done() is False
+        released_at = time.time()
+
+    assert await acquisition is True
+    assert time.time() - released_at < 1.0
+    await waiter.release()
+    assert await waiter.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_waiter_acquires_on_expiry(create):
+    """Tests that keyspace notifications wake waiters when a holder's lock lapses."""
+    redis.Redis.from_url("redis://127.0.0.1:6379").config_set("notify-keyspace-events", "Kgx")
+
+    holder = await async_lock.AsyncLock.create(
+        key="test_waiter_acquires_on_expiry", url="redis://127.0.0.1:6379", lock_expiry=1,
+    )
+    waiter = await create(key="test_waiter_acquires_on_expiry")
+
+    # Take the lock and never refresh or release it, as a crashed holder would
+    assert await holder.set_lock(True, True) is True
+    started_at = time.time()
+    assert await waiter.set_lock(True, True) is True
+    assert time.time() - started_at < 2.0
+    await waiter.release()
+
+
+@pytest.mark.asyncio
+async def test_waiter_times_out(create):
+    """Tests that waiters still give up after the acquisition timeout."""
+    holder = await create(key="test_waiter_times_out")
+    waiter = await async_lock.AsyncLock.create(
+        key="test_waiter_times_out",
+        url="redis://127.0.0.1:6379",
+        lock_acquisition_timeout=0.5,
+        wait_mode="notify",
+    )
+
+    assert await holder.set_lock(True, True) is True
+    assert await waiter.set_lock(True, True) is False
+    await holder.release()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Tests for adaptive heartbeat periods."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import async_lock, context_manager, heartbeat, pacing, testing
+
+
+def test_period_follows_latency():
+    """Tests that the period lengthens while refreshes are fast, and shortens as they slow down."""
+    pacer = pacing.AdaptivePeriod(expiry=8.0)
+    assert pacer.period() == 4.0
+
+    for _ in range(10):
+        pacer.observe(0.001)
+    fast = pacer.period()
+    assert 5.5 < fast < 6.0
+
+    pacer.observe(1.5)
+    assert pacer.period() < fast - 1.5
+    for _ in range(10):
+        pacer.observe(3.0)
+    assert pacer.period() <= 2.0
+
+    pacer.observe(6.0)
+    assert pacer.period() == 0.05
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scheduled", [False, True])
+async def test_adaptive_heartbeat_holds_lock_on_slow_redis(scheduled):
+    """Tests that an adaptive heartbeat keeps a lock whose expiry is only a few round-trips."""
+    server = testing.FakeRedisServer(latency=0.15).start_in_thread()
+    try:
+        key = f"test_adaptive_heartbeat_holds_lock_on_slow_redis_{scheduled}"
+        redis = await async_lock.AsyncLock.create(
+            key=key, url=server.url, lock_expiry=1, share_client=False
+        )
+        scheduler = heartbeat.HeartbeatScheduler() if scheduled else None
+
+        async with context_manager.ContextManager(
+            redis, period=1.0, scheduler=scheduler, adaptive=True
+        ):
+            await asyncio.sleep(2.5)
+            assert await redis.exists() == 1
+    finally:
+        server.stop_thread()
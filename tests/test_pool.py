@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Tests for the shared client registry."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import async_lock, pool, testing
+from redis_heartbeat_lock.scripts import Script
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("redis_server")
+async def test_locks_share_a_client():
+    """Tests that locks on the same URL share one client, unless asked not to."""
+    first = await async_lock.AsyncLock.create(
+        key="test_locks_share_a_client_1", url="redis://127.0.0.1:6379",
+    )
+    second = await async_lock.AsyncLock.create(
+        key="test_locks_share_a_client_2", url="redis://127.0.0.1:6379",
+    )
+    private = await async_lock.AsyncLock.create(
+        key="test_locks_share_a_client_3", url="redis://127.0.0.1:6379", share_client=False,
+    )
+
+    assert first.backend is second.backend
+    assert private.backend is not first.backend
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["native", "thread_pool"])
+@pytest.mark.usefixtures("redis_server")
+async def test_pool_stats_count_waits(backend):
+    """Tests that a saturated pool makes callers wait, and that we count the waits."""
+    registry = pool.ClientRegistry(max_connections=2, pool_timeout=5.0)
+    shared = await registry.get("redis://:secret@127.0.0.1:6379", backend)
+    assert await registry.get("redis://:secret@127.0.0.1:6379", backend) is shared
+
+    # Five concurrent commands on two connections: some have to wait their turn
+    await asyncio.gather(*[shared.call("ping") for _ in range(5)])
+
+    [stats] = registry.stats()
+    assert stats.url == "redis://127.0.0.1:6379"
+    assert stats.backend == backend
+    assert stats.max_connections == 2
+    assert stats.in_use == 0
+    assert 1 <= stats.idle <= 2
+    if backend == "native":
+        # The thread pool may run the commands one after another, so only the native backend is
+        # guaranteed to saturate the pool.
+        assert stats.waits >= 3
+
+    await registry.close()
+    assert registry.stats() == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["native", "thread_pool"])
+async def test_warm_up_opens_connections_and_loads_scripts(backend):
+    """Tests that warming up a shared client opens connections ahead of time, and loads every
+    script, so the first lock doesn't have to. Flushing scripts would wipe them from a developer's
+    Redis too, so this runs on a server of its own."""
+    server = testing.FakeRedisServer().start_in_thread()
+    try:
+        registry = pool.ClientRegistry(max_connections=5)
+        shared = await registry.get(server.url, backend)
+        await shared.call("script_flush")
+        assert await registry.warm_up(server.url, backend, connections=3) is shared
+
+        [stats] = registry.stats()
+        assert stats.idle == 3
+        assert stats.in_use == 0
+        loaded = await shared.call("script_exists", *[script.sha for script in Script.all()])
+        assert all(loaded)
+        await registry.close()
+    finally:
+        server.stop_thread()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Tests for the Prometheus exporter."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import urllib.error
+import urllib.request
+import pytest
+from redis_heartbeat_lock import async_lock, context_manager, instrumentation, prometheus
+
+
+@pytest.fixture
+def server():
+    """Serve metrics by key from a fresh in-memory instrumentation on a free port, then stop."""
+    metrics = prometheus.start_http_server(port=0, key_labels=True)
+    instrumentation.set_instrumentation(instrumentation.InMemoryInstrumentation())
+    yield metrics
+    metrics.stop()
+    instrumentation.set_instrumentation(None)
+
+
+async def _scrape(url: str) -> str:
+    def _get() -> str:
+        with urllib.request.urlopen(url, timeout=2.0) as response:
+            assert response.headers["Content-Type"] == prometheus.CONTENT_TYPE
+            return response.read().decode()
+
+    return await asyncio.get_event_loop().run_in_executor(None, _get)
+
+
+def _sample(text: str, line_start: str) -> float:
+    values = [line.rsplit(" ", 1)[1] for line in text.splitlines() if line.startswith(line_start)]
+    assert len(values) == 1, line_start
+    return float(values[0])
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("redis_server")
+async def test_serves_lock_metrics(server):
+    """Tests that a scrape shows locks held while they're held, and counts acquisitions,
+    contention and holds."""
+    key = "test_serves_lock_metrics"
+    holder = await async_lock.AsyncLock.create(
+        key=key, url="redis://127.0.0.1:6379", lock_check_rate=0.05, lock_expiry=2,
+    )
+    waiter = await async_lock.AsyncLock.create(
+        key=key, url="redis://127.0.0.1:6379", lock_check_rate=0.05, lock_expiry=2,
+    )
+    labels = f'{{key="{key}"}}'
+
+    async with context_manager.ContextManager(holder, period=0.1):
+        waiting = asyncio.create_task(waiter.set_lock(True, True))
+        await asyncio.sleep(0.3)
+        text = await _scrape(server.url)
+        assert _sample(text, f"redis_heartbeat_lock_locks_held{labels}") == 1
+    assert await waiting is True
+    await waiter.release()
+
+    text = await _scrape(server.url)
+    assert _sample(text, f"redis_heartbeat_lock_locks_held{labels}") == 0
+    acquired = f'redis_heartbeat_lock_acquisitions_total{{key="{key}",result="acquired"}}'
+    assert _sample(text, acquired) == 2
+    assert _sample(text, f"redis_heartbeat_lock_contended_acquisitions_total{labels}") == 1
+    assert _sample(text, f"redis_heartbeat_lock_hold_duration_seconds_count{labels}") == 2
+    assert _sample(text, f"redis_heartbeat_lock_heartbeat_lateness_seconds_count{labels}") >= 1
+    assert _sample(text, f"redis_heartbeat_lock_locks_lost_total{labels}") == 0
+
+
+def test_renders_histograms_and_escapes_labels():
+    """Tests that histogram buckets are cumulative up to `+Inf`, label values are escaped, and
+    keys are only labelled when asked for."""
+    recorded = instrumentation.InMemoryInstrumentation()
+    key = 'odd"key\\with\nescapes'
+    for latency in (0.0001, 0.01, 100.0):
+        recorded.acquisition(key, latency, 1, True)
+    recorded.acquisition("other_key", 1.0, 1, False)
+
+    text = prometheus.render(recorded)
+    assert "key=" not in text
+    assert _sample(text, "redis_heartbeat_lock_acquisition_latency_seconds_count ") == 4
+    assert _sample(text, 'redis_heartbeat_lock_acquisitions_total{result="failed"}') == 1
+
+    text = prometheus.render(recorded, key_labels=True)
+    escaped = 'key="odd\\"key\\\\with\\nescapes"'
+    name = "redis_heartbeat_lock_acquisition_latency_seconds"
+    buckets = [
+        line for line in text.splitlines() if line.startswith(f"{name}_bucket{{{escaped}")
+    ]
+    counts = [float(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+    assert buckets[-1].startswith(f'{name}_bucket{{{escaped},le="+Inf"}}')
+    assert counts[-1] == 3
+    assert _sample(text, f"{name}_count{{{escaped}}}") == 3
+    assert _sample(text, f"{name}_sum{{{escaped}}}") == pytest.approx(100.0101)
+    assert f"# TYPE {name} histogram" in text
+
+
+@pytest.mark.asyncio
+async def test_unknown_path_not_found(server):
+    """Tests that only the metrics path is served."""
+    with pytest.raises(urllib.error.HTTPError, match="404"):
+        await _scrape(server.url.replace("/metrics", "/other"))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""Tests for locks held across several independent Redis nodes."""
+# pylint: disable=redefined-outer-name
+
+import time
+import pytest
+from redis_heartbeat_lock import context_manager, heartbeat, redlock, testing
+
+
+@pytest.fixture
+def servers():
+    """Three independent stand-in Redis servers."""
+    nodes = [testing.FakeRedisServer().start_in_thread() for _ in range(3)]
+    yield nodes
+    for node in nodes:
+        node.stop_thread()
+
+
+async def _create(key: str, servers, **kwargs) -> redlock.RedLock:
+    return await redlock.RedLock.create(
+        key=key,
+        urls=[server.url for server in servers],
+        lock_check_rate=0.05,
+        share_client=False,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_takes_every_node_at_once(servers):
+    """Tests that the lock is taken on every node at once, rather than one after another, and
+    released on all of them."""
+    key = "test_takes_every_node_at_once"
+    holder = await _create(key, servers, node_timeout=2.0)
+    rival = await _create(key, servers, lock_acquisition_timeout=0.3)
+    assert holder.quorum == 2
+
+    for server in servers:
+        server.latency = 0.1
+    started_at = time.monotonic()
+    assert await holder.set_lock(True) is True
+    # Connecting and loading our script takes a few round-trips on each node
+    elapsed = time.monotonic() - started_at
+    for server in servers:
+        server.latency = 0.0
+    assert await holder.exists() == 3
+    assert elapsed < 0.3 * len(servers)
+    assert holder.lease.is_valid() is True
+
+    assert await rival.set_lock(True) is False
+    await holder.release()
+    assert await holder.exists() == 0
+    assert await rival.set_lock(True) is True
+    await rival.release()
+
+
+@pytest.mark.asyncio
+async def test_needs_a_majority(servers):
+    """Tests that the lock holds with a node down, but not with most of them down."""
+    key = "test_needs_a_majority"
+    holder = await _create(key, servers, lock_acquisition_timeout=0.5)
+
+    servers[0].drop_rate = 1.0
+    assert await holder.set_lock(True) is True
+    assert await holder.set_expiration() is True
+    await holder.release()
+
+    servers[1].drop_rate = 1.0
+    assert await holder.set_lock(True) is False
+    assert holder.lease.is_valid() is False
+    # What the last node did take was given back
+    servers[0].drop_rate = 0.0
+    servers[1].drop_rate = 0.0
+    assert await holder.exists() == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scheduled", [False, True])
+async def test_heartbeat_refreshes_every_node(servers, scheduled):
+    """Tests that the heartbeat keeps the lock on every node past its expiry."""
+    key = f"test_heartbeat_refreshes_every_node_{scheduled}"
+    holder = await _create(key, servers, lock_expiry=1)
+    rival = await _create(key, servers, lock_acquisition_timeout=1.5)
+    scheduler = heartbeat.HeartbeatScheduler() if scheduled else None
+
+    async with context_manager.ContextManager(holder, period=0.3, scheduler=scheduler):
+        assert await rival.set_lock(True) is False
+        assert await holder.exists() == 3
+
+    assert await rival.set_lock(True) is True
+    await rival.release()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Tests for the read/write lock."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import context_manager, heartbeat, rw_lock
+
+pytestmark = pytest.mark.create(rw_lock.ReadWriteLock, lock_check_rate=0.05)
+
+
+@pytest.mark.asyncio
+async def test_readers_share_writers_exclude(create):
+    """Tests that readers hold the lock together, and a writer waits for all of them."""
+    key = "test_readers_share_writers_exclude"
+    readers = [await create(key=key, mode="read") for _ in range(3)]
+    writer = await create(key=key, mode="write", lock_acquisition_timeout=0.2)
+
+    assert all(await asyncio.gather(*[reader.set_lock(True) for reader in readers]))
+    assert await readers[0].exists() == 3
+    assert await writer.set_lock(True) is False
+
+    for reader in readers:
+        await reader.release()
+    assert await writer.set_lock(True) is True
+    assert writer.fencing_token is not None
+    late_reader = await create(key=key, mode="read", lock_acquisition_timeout=0.2)
+    assert await late_reader.set_lock(True) is False
+    await writer.release()
+
+
+@pytest.mark.asyncio
+async def test_waiting_writer_keeps_new_readers_out(create):
+    """Tests that once a writer is waiting, new readers queue behind it rather than starving it."""
+    key = "test_waiting_writer_keeps_new_readers_out"
+    reader = await create(key=key, mode="read")
+    writer = await create(key=key, mode="write", wait_mode="notify")
+    late_reader = await create(key=key, mode="read", wait_mode="notify")
+
+    assert await reader.set_lock(True) is True
+    writing = asyncio.create_task(writer.set_lock(True))
+    await asyncio.sleep(0.1)
+    reading = asyncio.create_task(late_reader.set_lock(True))
+    await asyncio.sleep(0.2)
+    assert not reading.done()
+
+    await reader.release()
+    assert await writing is True
+    await asyncio.sleep(0.1)
+    assert not reading.done()
+
+    await writer.release()
+    assert await reading is True
+    await late_reader.release()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scheduled", [False, True])
+async def test_heartbeat_keeps_reader_lease(scheduled, create):
+    """Tests that the heartbeat keeps a reader's lease alive past its expiry."""
+    key = f"test_heartbeat_keeps_reader_lease_{scheduled}"
+    reader = await create(key=key, mode="read", lock_expiry=1)
+    writer = await create(key=key, mode="write", lock_acquisition_timeout=1.5)
+    scheduler = heartbeat.get_scheduler() if scheduled else None
+
+    async with context_manager.ContextManager(period=0.3, redis=reader, scheduler=scheduler):
+        assert await writer.set_lock(True) is False
+        assert await reader.exists() == 1
+
+    assert await writer.set_lock(True) is True
+    await writer.release()
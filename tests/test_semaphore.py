@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Tests for the counting semaphore."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import pytest
+from redis_heartbeat_lock import context_manager, semaphore
+
+pytestmark = pytest.mark.create(semaphore.AsyncSemaphore, lock_check_rate=0.05)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("wait_mode", ["poll", "notify"])
+async def test_limits_holders(wait_mode, create):
+    """Tests that at most `limit` holders have a slot at once, and a waiter takes a freed slot."""
+    key = f"test_limits_holders_{wait_mode}"
+    holders = [await create(key=key, limit=2) for _ in range(2)]
+    waiter = await create(key=key, limit=2, lock_acquisition_timeout=0.2, wait_mode=wait_mode)
+
+    assert all(await asyncio.gather(*[holder.set_lock(True) for holder in holders]))
+    assert await waiter.set_lock(True) is False
+    assert await waiter.exists() == 2
+
+    await holders[0].release()
+    assert await waiter.set_lock(True) is True
+    await holders[1].release()
+    await waiter.release()
+    assert await waiter.exists() == 0
+
+
+@pytest.mark.asyncio
+async def test_lapsed_lease_dropped_lazily(create):
+    """Tests that a holder that never releases only keeps its slot until its lease lapses."""
+    key = "test_lapsed_lease_dropped_lazily"
+    crashed = await create(key=key, limit=1, lock_expiry=1)
+    waiter = await create(key=key, limit=1, lock_acquisition_timeout=2.0)
+
+    assert await crashed.set_lock(True) is True
+    assert await waiter.set_lock(True) is True
+    assert await waiter.exists() == 1
+
+    await waiter.release()
+    with pytest.raises(Exception, match="lost lock before releasing"):
+        await crashed.release()
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_keeps_lease(create):
+    """Tests that the heartbeat keeps a holder's lease alive past its expiry."""
+    key = "test_heartbeat_keeps_lease"
+    holder = await create(key=key, limit=1, lock_expiry=1)
+    waiter = await create(key=key, limit=1, lock_acquisition_timeout=1.5)
+
+    async with context_manager.ContextManager(period=0.3, redis=holder):
+        assert await waiter.set_lock(True) is False
+
+    assert await waiter.set_lock(True) is True
+    await waiter.release()
@@ -6,6 +6,8 @@ import asyncio
 import pytest
 from redis_heartbeat_lock import async_lock, context_manager
 
+pytestmark = pytest.mark.usefixtures("redis_server")
+
 
 @pytest.mark.asyncio
 async def test_raises_if_exception_occurs():
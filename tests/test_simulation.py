@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""Tests for the deterministic simulation harness, and for mutual exclusion under faults."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import time
+import pytest
+from redis_heartbeat_lock import async_lock, context_manager, heartbeat, simulation
+
+
+async def _hold_for_a_minute(sim: simulation.Simulation) -> float:
+    redis = async_lock.AsyncLock("simulated_holds_lock", sim.client(), 2.0, 0.2, 4)
+    async with context_manager.ContextManager(period=2.0, redis=redis) as _:
+        assert await redis.set_lock(True, True) is False
+        for _ in range(12):
+            await asyncio.sleep(5)
+            assert sim.get("simulated_holds_lock") == redis.token
+    assert await redis.exists() == 0
+    return sim.now()
+
+
+def test_holds_lock_on_virtual_time():
+    """Tests that a heartbeat keeps a lock for a simulated minute, many times its expiry, in far
+    less real time, and that keys expire on the simulated clock."""
+    started_at = time.monotonic()
+    sim = simulation.Simulation()
+    assert 62 <= sim.run(_hold_for_a_minute(sim)) < 63
+    assert time.monotonic() - started_at < 1.0
+
+    async def _expire() -> None:
+        client = sim.client()
+        await client.call("set", "simulated_expiry", "1", px=500)
+        sim.stall(0.6)
+        assert sim.get("simulated_expiry") is None
+        assert await client.call("exists", "simulated_expiry") == 0
+
+    sim = simulation.Simulation()
+    sim.run(_expire())
+
+
+async def _contend(sim: simulation.Simulation, features: dict, workers: int = 4) -> list:
+    """Workers take turns at a lock while the process stalls and connections drop at random.
+    Whenever a worker's lease says it holds the lock, the lock must hold its token. Returns what
+    happened, and when."""
+    key = "simulated_contention"
+    trace = []
+    scheduler = heartbeat.HeartbeatScheduler() if features.pop("scheduler", False) else None
+    adaptive = features.pop("adaptive", False)
+
+    async def _work(name: int) -> None:
+        redis = async_lock.AsyncLock(key, sim.client(), 3.0, 0.05, 1, **features)
+        manager = context_manager.ContextManager(
+            redis=redis, period=0.3, scheduler=scheduler, adaptive=adaptive, cancel_on_loss=True
+        )
+        for _ in range(5):
+            try:
+                async with manager as _:
+                    trace.append((round(sim.now(), 6), name, "acquired"))
+                    for _ in range(sim.random.randint(1, 8)):
+                        if not redis.lease.is_valid():
+                            break
+                        assert sim.get(key) == redis.token, "Two holders at once"
+                        await asyncio.sleep(sim.random.uniform(0.0, 0.2))
+            except AssertionError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                trace.append((round(sim.now(), 6), name, "failed"))
+
+    async def _faults() -> None:
+        while True:
+            await asyncio.sleep(sim.random.expovariate(2.0))
+            if sim.random.random() < 0.5:
+                sim.stall(sim.random.uniform(0.0, 1.5))
+            else:
+                sim.disconnect()
+
+    chaos = asyncio.ensure_future(_faults())
+    await asyncio.gather(*[_work(i) for i in range(workers)])
+    chaos.cancel()
+    return trace
+
+
+@pytest.mark.parametrize(
+    "features",
+    [
+        {},
+        {"strategy": "jitter"},
+        {"strategy": "fair"},
+        {"wait_mode": "notify", "notify_poll_rate": 0.5},
+        {"local_first": True},
+        {"scheduler": True, "adaptive": True},
+    ],
+)
+def test_mutual_exclusion_under_faults(features):
+    """Tests that no two workers ever hold a lock at once, whatever the lock's performance
+    features, across many seeded runs with latency, dropped replies, stalls and disconnects."""
+    outcomes = {"acquired": 0, "failed": 0}
+    for seed in range(10):
+        sim = simulation.Simulation(seed=seed, drop_rate=0.01)
+        sim.server.latency = lambda: sim.random.uniform(0.0, 0.02)
+        for _, _, outcome in sim.run(_contend(sim, dict(features))):
+            outcomes[outcome] += 1
+    assert outcomes["acquired"] > 50
+    assert outcomes["failed"] > 0
+
+
+def test_failover_is_detected_and_runs_are_reproducible():
+    """Tests that failing over to a replica that never saw a lock gets its holder told it's lost
+    the lock by the next heartbeat, and that a seed always plays out the same way."""
+
+    async def _fail_over(sim: simulation.Simulation) -> float:
+        sim.replicate()
+        redis = async_lock.AsyncLock("simulated_failover", sim.client(), 1.0, 0.05, 4)
+        manager = context_manager.ContextManager(redis=redis, period=1.0)
+        with pytest.raises(Exception, match="lost lock"):
+            async with manager as _:
+                await asyncio.sleep(2.5)
+                sim.fail_over()
+                failed_over_at = sim.now()
+                await asyncio.wait_for(manager.lost.wait(), timeout=1.5)
+        return sim.now() - failed_over_at
+
+    sim = simulation.Simulation()
+    assert sim.run(_fail_over(sim)) <= 1.0
+
+    traces = []
+    for _ in range(2):
+        sim = simulation.Simulation(seed=7, drop_rate=0.05)
+        sim.server.latency = lambda: sim.random.uniform(0.0, 0.05)
+        traces.append(sim.run(_contend(sim, {"strategy": "jitter"})))
+    assert traces[0] == traces[1]
+    assert len(traces[0]) > 5
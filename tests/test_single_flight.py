@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""Tests for single-flight computation."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import time
+import pytest
+from redis_heartbeat_lock import single_flight
+
+pytestmark = pytest.mark.create(single_flight.SingleFlight, lock_check_rate=0.05)
+
+
+def test_result_cache_bounds():
+    """Tests that the local cache forgets results once they expire, and keeps at most `max_size`,
+    dropping the least recently used."""
+    cache = single_flight.ResultCache(max_size=2)
+    cache.put("a", 1, ttl=10)
+    cache.put("b", 2, ttl=10)
+    assert cache.get("a") == 1
+    cache.put("c", 3, ttl=10)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    cache.put("d", None, ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get("d", "missing") == "missing"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("wait_mode", ["poll", "notify"])
+async def test_computes_once(wait_mode, create):
+    """Tests that however many workers and callers want a result at once, it's computed once, and
+    everyone gets it."""
+    key = f"test_computes_once_{wait_mode}"
+    workers = [await create(wait_mode=wait_mode) for _ in range(3)]
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.3)
+        return {"answer": 42}
+
+    results = await asyncio.gather(
+        *(worker.get(key, compute) for worker in workers for _ in range(4))
+    )
+    assert len(calls) == 1
+    assert results == [{"answer": 42}] * 12
+
+    # Served from memory from now on, until we forget it
+    assert await workers[0].get(key, compute) == {"answer": 42}
+    assert len(calls) == 1
+    await workers[0].invalidate(key)
+    assert await workers[0].get(key, compute) == {"answer": 42}
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_computation_retried(create):
+    """Tests that if the worker computing a result fails, its callers see why, and a worker
+    waiting for the result computes it instead."""
+    key = "test_failed_computation_retried"
+    first, second = await create(), await create()
+
+    async def fail():
+        await asyncio.sleep(0.2)
+        raise ValueError("boom")
+
+    async def succeed():
+        return "done"
+
+    failing = asyncio.ensure_future(asyncio.gather(first.get(key, fail), first.get(key, fail)))
+    await asyncio.sleep(0.05)
+    waiting = asyncio.ensure_future(second.get(key, succeed))
+    with pytest.raises(ValueError, match="boom"):
+        await failing
+    assert await waiting == "done"
+    assert await first.get(key, fail) == "done"
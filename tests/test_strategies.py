@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Tests for the strategies waiters use to retry a contended lock."""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import random
+import pytest
+from redis_heartbeat_lock import async_lock, backoff
+
+pytestmark = pytest.mark.create(async_lock.AsyncLock, lock_check_rate=0.05)
+
+
+def test_jitter_stays_between_base_and_cap():
+    """Tests that jittered delays grow from the base, never pass the cap, and don't repeat."""
+    jitter = backoff.DecorrelatedJitterBackoff(0.01, 0.5, rng=random.Random(42))
+    delays = [jitter.next_delay() for _ in range(50)]
+
+    assert all(0.01 <= delay <= 0.5 for delay in delays)
+    assert delays[0] <= 0.03
+    assert len(set(delays)) > 25
+
+
+@pytest.mark.asyncio
+async def test_jitter_acquires_once_released(create):
+    """Tests that a jittered waiter takes the lock once it's released."""
+    holder = await create(key="test_jitter_acquires_once_released")
+    waiter = await create(
+        key="test_jitter_acquires_once_released", strategy="jitter", backoff_cap=0.1
+    )
+
+    assert await holder.set_lock(True, True) is True
+    waiting = asyncio.create_task(waiter.set_lock(True, True))
+    await asyncio.sleep(0.3)
+    await holder.release()
+
+    assert await waiting is True
+    await waiter.release()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("wait_mode", ["poll", "notify"])
+async def test_fair_waiters_take_turns(wait_mode, create):
+    """Tests that fair waiters take the lock in the order they asked for it."""
+    key = f"test_fair_waiters_take_turns_{wait_mode}"
+    holder = await create(key=key, strategy="fair", wait_mode=wait_mode)
+    assert await holder.set_lock(True, True) is True
+
+    order = []
+
+    async def _wait(i: int) -> None:
+        waiter = await create(key=key, strategy="fair", wait_mode=wait_mode)
+        assert await waiter.set_lock(True, True) is True
+        order.append(i)
+        await asyncio.sleep(0.05)
+        await waiter.release()
+
+    waiters = []
+    for i in range(5):
+        waiters.append(asyncio.create_task(_wait(i)))
+        # Let each waiter join the queue before the next
+        await asyncio.sleep(0.05)
+    await holder.release()
+    await asyncio.gather(*waiters)
+
+    assert order == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_fair_waiter_gives_up_its_place(create):
+    """Tests that a fair waiter that times out leaves the queue, so it doesn't hold up others."""
+    key = "test_fair_waiter_gives_up_its_place"
+    holder = await create(key=key, strategy="fair")
+    quitter = await create(key=key, strategy="fair", lock_acquisition_timeout=0.2)
+    patient = await create(key=key, strategy="fair", lock_acquisition_timeout=1.0)
+
+    assert await holder.set_lock(True, True) is True
+    quitting = asyncio.create_task(quitter.set_lock(True, True))
+    await asyncio.sleep(0.05)
+    waiting = asyncio.create_task(patient.set_lock(True, True))
+    assert await quitting is False
+
+    await holder.release()
+    assert await waiting is True
+    await patient.release()
+    assert await holder.backend.call("exists", f"{key}:queue") == 0
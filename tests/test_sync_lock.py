@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Tests for the synchronous lock and its shared heartbeat thread."""
+# pylint: disable=redefined-outer-name
+
+import contextlib
+import threading
+import time
+import pytest
+from typing import List
+from redis_heartbeat_lock import sync_lock
+
+pytestmark = pytest.mark.create(sync_lock.SyncLock, lock_check_rate=0.05)
+
+
+def test_holds_past_expiry(create):
+    """Tests that a lock held in a `with` block is refreshed past its expiry, keeps rivals out,
+    and is released afterwards."""
+    key = "test_holds_past_expiry"
+    rival = create(key=key, lock_acquisition_timeout=0.2)
+
+    with create(key=key, lock_expiry=1, period=0.3) as holder:
+        assert holder.fencing_token is not None
+        time.sleep(1.5)
+        assert holder.exists() == 1
+        assert holder.lease.is_valid() is True
+        assert rival.set_lock() is False
+
+    assert holder.exists() == 0
+    assert rival.set_lock() is True
+    rival.release()
+
+
+def test_one_thread_refreshes_every_lock(create):
+    """Tests that a single heartbeat thread keeps every held lock alive."""
+    keys = [f"test_one_thread_refreshes_every_lock_{i}" for i in range(5)]
+    with contextlib.ExitStack() as stack:
+        locks = [stack.enter_context(create(key=key, lock_expiry=1, period=0.3)) for key in keys]
+        time.sleep(1.5)
+        assert all(lock.exists() == 1 for lock in locks)
+        threads = [t for t in threading.enumerate() if t.name == "redis-heartbeat-lock-heartbeat"]
+        assert len(threads) == 1
+        assert len(sync_lock.get_heartbeat_thread()) == len(keys)
+    assert len(sync_lock.get_heartbeat_thread()) == 0
+
+
+def test_lost_lock_raises_on_exit(create):
+    """Tests that the heartbeat notices a lost lock straight away, and the block's exit raises
+    why."""
+    key = "test_lost_lock_raises_on_exit"
+    reasons: List[Exception] = []
+    with pytest.raises(Exception, match="lost lock while refreshing"):
+        with create(key=key, lock_expiry=2, period=0.2, on_lost=reasons.append) as holder:
+            holder.client.delete(key)
+            assert holder.lost.wait(timeout=1.0) is True
+            assert len(reasons) == 1
+            assert holder.lease.is_valid() is False
+
+
+def test_failing_on_lost_does_not_stop_heartbeats(create):
+    """Tests that an `on_lost` callback raising doesn't stop the thread refreshing other locks."""
+    key = "test_failing_on_lost_does_not_stop_heartbeats"
+
+    def _raise(reason):
+        raise Exception("Callback failed")
+
+    with create(key=f"{key}_kept", lock_expiry=1, period=0.3) as kept:
+        with pytest.raises(Exception, match="lost lock while refreshing"):
+            with create(key=key, lock_expiry=2, period=0.2, on_lost=_raise) as holder:
+                holder.client.delete(key)
+                assert holder.lost.wait(timeout=1.0) is True
+        time.sleep(1.5)
+        assert kept.exists() == 1